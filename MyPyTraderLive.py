@@ -12,6 +12,9 @@ from PyQt5.QtGui import QPainter, QColor, QPen, QIcon, QPixmap
 from PyQt5.QtCore import Qt, QSize, QPoint, QTimer, QThread, pyqtSignal
 import databento as db
 import pandas as pd 
+from response_log import ResponseLog
+from dbn_cache import DBNCache
+from definitions_store import DefinitionsStore
 
 
 
@@ -260,6 +263,8 @@ class TradingApp(QMainWindow):
         # Initialize Databento worker
         self.databento_worker = None
         self.is_databento_initialized = False
+        self.dbn_cache = DBNCache()  # Historical requests are served from disk once downloaded
+        self.definitions_store = DefinitionsStore()  # Option chain lookups without re-downloading definitions
         
         # Define the symbol map for continuous contracts
         self.symbol_map = {
@@ -369,9 +374,8 @@ class TradingApp(QMainWindow):
         main_layout.addLayout(settings_layout)
         
         # Response area
-        self.response_area = QTextEdit()
-        self.response_area.setReadOnly(True)
-        main_layout.addWidget(self.response_area)
+        self.response_log = ResponseLog(self)
+        main_layout.addWidget(self.response_log)
         
         # Set a fixed width for the labels to align all fields
         for i in range(input_layout.rowCount()):
@@ -456,11 +460,8 @@ class TradingApp(QMainWindow):
         else:
             return "stop"  # Default to "stop" if unknown type
 
-    def update_response_area(self, text):
-        self.response_area.append(text)
-        self.response_area.verticalScrollBar().setValue(
-            self.response_area.verticalScrollBar().maximum()
-        )
+    def update_response_area(self, text, level="INFO"):
+        self.response_log.log(text, level)
 
 
 
@@ -473,7 +474,7 @@ class TradingApp(QMainWindow):
             quantity = self.quantity_input.value()
             stop_loss = float(self.long_stop_loss_input.text()) if action == "buy" else float(self.short_stop_loss_input.text())
         except ValueError:
-            self.update_response_area("Error: Invalid input for price or stop loss.\n")
+            self.update_response_area("Error: Invalid input for price or stop loss.\n", level="ERROR")
             return
         
         order = {
@@ -595,7 +596,7 @@ class TradingApp(QMainWindow):
             self.is_databento_initialized = True
             self.update_response_area("Databento worker initialized. Starting to receive price updates.\n")
         except Exception as e:
-            self.update_response_area(f"Error initializing Databento worker: {str(e)}\n")
+            self.update_response_area(f"Error initializing Databento worker: {str(e)}\n", level="ERROR")
             self.databento_worker = None
             self.is_databento_initialized = False
             self.update_checkbox.setChecked(False)
@@ -613,15 +614,9 @@ class TradingApp(QMainWindow):
         start_date = last_friday.replace(hour=0, minute=0, second=0, microsecond=0)
         end_date = start_date + timedelta(days=1)  # Next day
         
-        # Query data using OHLCV schema
-        df = client.timeseries.get_range(
-            dataset=dataset,
-            symbols=[symbol],
-            stype_in="continuous",
-            start=start_date.isoformat(),
-            end=end_date.isoformat(),
-            schema="ohlcv-1d"
-        ).to_df()
+        # Query data using OHLCV schema (a past Friday never changes, so after the first call this is a local read)
+        df = self.dbn_cache.to_df(client, dataset, "ohlcv-1d", [symbol], start_date.isoformat(), end_date.isoformat(),
+                                  stype_in="continuous")
         
         # Get the closing price
         if not df.empty:
@@ -642,40 +637,16 @@ class TradingApp(QMainWindow):
 
 
     def get_frontMonth_options(self, current_price, underlying):
-        symbol_list = []
         client = db.Historical(key="db-4cBdtNdAxE9CBR3HgFuqJDidcfbrL")
-        definitions = client.timeseries.get_range(
-            dataset=db.Dataset.GLBX_MDP3,
-            schema=db.Schema.DEFINITION,
-            start="2024-09-26",
-        )
-        
-        # Convert to a DataFrame
-        df = definitions.to_df()
-        
-        # Select all instruments with a security type of OOF (options-on-futures)
-        df = df[df["security_type"] == "OOF"]
+        # Pulls only definitions published since the last refresh, and at most once a day
+        self.definitions_store.refresh(client)
         
-        # Select only options with an ESZ4 underlying
-        df = df[df["underlying"] == underlying]
-        
-        # Convert expiration to datetime and strike_price to float
-        df['expiration'] = pd.to_datetime(df['expiration'])
-        df['strike_price'] = df['strike_price'].astype(float)
-        
-        # Filter for options within 10% of the current price
-        df = df[(df['strike_price'] >= 0.95 * current_price) & 
-                (df['strike_price'] <= 1.05 * current_price)]
-        
-        # Create a view for printing
-        result = df[["raw_symbol", "underlying", "instrument_class", "strike_price", "expiration"]]
-        result = result.sort_values(["expiration", "strike_price"])
-
+        # Options-on-futures on this underlying within 5% of the current price, by expiration then strike
+        result = self.definitions_store.query_options(underlying, 0.95 * current_price, 1.05 * current_price)
         
         # Print the options
         #print(f"{len(result):,d}", "relevant option(s) for ESZ4")
-        for symbol in result.raw_symbol:
-            symbol_list.append(symbol)
+        symbol_list = [raw_symbol for raw_symbol, _, _, _, _ in result]
         #print(symbol_list)
         return(symbol_list)
     
@@ -902,34 +873,34 @@ class TradingApp(QMainWindow):
                                 self.price_input.setText(f"{close_price:.2f}")
                                 self.update_stop_loss()
 
-                            self.update_response_area(f"Updated {ticker} price: {close_price:.2f}\n")
+                            self.update_response_area(f"Updated {ticker} price: {close_price:.2f}\n", level="DEBUG")
                             
                             if hasattr(message, 'open') and hasattr(message, 'high') and hasattr(message, 'low'):
                                 open_price = message.open / scale_factor
                                 high_price = message.high / scale_factor
                                 low_price = message.low / scale_factor
-                                self.update_response_area(f"OHLCV: Open: {open_price:.2f}, High: {high_price:.2f}, Low: {low_price:.2f}, Close: {close_price:.2f}, Volume: {message.volume}\n")
+                                self.update_response_area(f"OHLCV: Open: {open_price:.2f}, High: {high_price:.2f}, Low: {low_price:.2f}, Close: {close_price:.2f}, Volume: {message.volume}\n", level="DEBUG")
                             
                             if hasattr(message, 'ts_event'):
-                                self.update_response_area(f"Timestamp: {message.ts_event}\n")
+                                self.update_response_area(f"Timestamp: {message.ts_event}\n", level="DEBUG")
                         else:
-                            self.update_response_area(f"Received data for unmatched ticker: {ticker}\n")
+                            self.update_response_area(f"Received data for unmatched ticker: {ticker}\n", level="DEBUG")
                     else:
                         open_price = message.open / scale_factor if hasattr(message, 'open') else 'N/A'
                         high_price = message.high / scale_factor if hasattr(message, 'high') else 'N/A'
                         low_price = message.low / scale_factor if hasattr(message, 'low') else 'N/A'
                         close_price = message.close / scale_factor if hasattr(message, 'close') else 'N/A'
                         
-                        self.update_response_area(f"Received data for unmatched instrument_id: {instrument_id}\n")
-                        self.update_response_area(f"OHLCV data for unmatched ID:\n")
-                        self.update_response_area(f"  Raw - Open: {message.open}, High: {message.high}, Low: {message.low}, Close: {message.close}\n")
-                        self.update_response_area(f"  Scaled - Open: {open_price:.2f}, High: {high_price:.2f}, Low: {low_price:.2f}, Close: {close_price:.2f}, Volume: {message.volume}\n")
+                        self.update_response_area(f"Received data for unmatched instrument_id: {instrument_id}\n", level="DEBUG")
+                        self.update_response_area(f"OHLCV data for unmatched ID:\n", level="DEBUG")
+                        self.update_response_area(f"  Raw - Open: {message.open}, High: {message.high}, Low: {message.low}, Close: {message.close}\n", level="DEBUG")
+                        self.update_response_area(f"  Scaled - Open: {open_price:.2f}, High: {high_price:.2f}, Low: {low_price:.2f}, Close: {close_price:.2f}, Volume: {message.volume}\n", level="DEBUG")
                 else:
-                    self.update_response_area("Received message without instrument_id attribute\n")
+                    self.update_response_area("Received message without instrument_id attribute\n", level="DEBUG")
                 
                 self.print_debug_info()
             except Exception as e:
-                self.update_response_area(f"Error processing data: {str(e)}\n")
+                self.update_response_area(f"Error processing data: {str(e)}\n", level="ERROR")
             pass
         elif subscription_id == "options":
             # Handle data for options subscription
@@ -1011,24 +982,24 @@ class TradingApp(QMainWindow):
         return long_stop_loss, short_stop_loss
 
     def print_debug_info(self):
-        self.update_response_area("Debug Information:\n")
-        self.update_response_area(f"Symbol Map: {self.symbol_map}\n")
-        self.update_response_area(f"Instrument ID Map: {self.instrument_id_map}\n")
-        self.update_response_area(f"Is Databento Initialized: {self.is_databento_initialized}\n")
-        self.update_response_area(f"Current Ticker: {self.ticker_combo.currentText()}\n")
+        self.update_response_area("Debug Information:\n", level="DEBUG")
+        self.update_response_area(f"Symbol Map: {self.symbol_map}\n", level="DEBUG")
+        self.update_response_area(f"Instrument ID Map: {self.instrument_id_map}\n", level="DEBUG")
+        self.update_response_area(f"Is Databento Initialized: {self.is_databento_initialized}\n", level="DEBUG")
+        self.update_response_area(f"Current Ticker: {self.ticker_combo.currentText()}\n", level="DEBUG")
 
     def handle_ohlcv_data(self, message):
         try:
             instrument_id = getattr(message, 'instrument_id', None)
 
-            self.update_response_area(f"Received OHLCV data:\n")
-            self.update_response_area(f"  Instrument ID: {instrument_id}\n")
-            self.update_response_area(f"  Open: {message.open}\n")
-            self.update_response_area(f"  High: {message.high}\n")
-            self.update_response_area(f"  Low: {message.low}\n")
-            self.update_response_area(f"  Close: {message.close}\n")
-            self.update_response_area(f"  Volume: {message.volume}\n")
-            self.update_response_area(f"  Timestamp: {message.ts_event}\n")
+            self.update_response_area(f"Received OHLCV data:\n", level="DEBUG")
+            self.update_response_area(f"  Instrument ID: {instrument_id}\n", level="DEBUG")
+            self.update_response_area(f"  Open: {message.open}\n", level="DEBUG")
+            self.update_response_area(f"  High: {message.high}\n", level="DEBUG")
+            self.update_response_area(f"  Low: {message.low}\n", level="DEBUG")
+            self.update_response_area(f"  Close: {message.close}\n", level="DEBUG")
+            self.update_response_area(f"  Volume: {message.volume}\n", level="DEBUG")
+            self.update_response_area(f"  Timestamp: {message.ts_event}\n", level="DEBUG")
 
             symbol = self.instrument_id_map.get(instrument_id)
             if symbol:
@@ -1043,21 +1014,21 @@ class TradingApp(QMainWindow):
                     
                     # Use the close price as the current price
                     self.price_input.setText(f"{close_price:.2f}")
-                    self.update_response_area(f"Updated {ticker} price: {close_price:.2f}\n")
-                    self.update_response_area(f"OHLCV: Open: {open_price:.2f}, High: {high_price:.2f}, Low: {low_price:.2f}, Close: {close_price:.2f}, Volume: {message.volume}\n")
-                    self.update_response_area(f"Timestamp: {message.ts_event}\n")
+                    self.update_response_area(f"Updated {ticker} price: {close_price:.2f}\n", level="DEBUG")
+                    self.update_response_area(f"OHLCV: Open: {open_price:.2f}, High: {high_price:.2f}, Low: {low_price:.2f}, Close: {close_price:.2f}, Volume: {message.volume}\n", level="DEBUG")
+                    self.update_response_area(f"Timestamp: {message.ts_event}\n", level="DEBUG")
                     
                     # Update stop loss values
                     self.update_stop_loss()
                 else:
-                    self.update_response_area(f"Matched symbol {symbol} but no corresponding ticker found.\n")
+                    self.update_response_area(f"Matched symbol {symbol} but no corresponding ticker found.\n", level="DEBUG")
             else:
-                self.update_response_area(f"Received OHLCV data for unmatched instrument_id: {instrument_id}\n")
+                self.update_response_area(f"Received OHLCV data for unmatched instrument_id: {instrument_id}\n", level="DEBUG")
             
             self.print_debug_info()
         except Exception as e:
-            self.update_response_area(f"Error processing OHLCV data: {str(e)}\n")
-            self.update_response_area(f"Message attributes: {dir(message)}\n")
+            self.update_response_area(f"Error processing OHLCV data: {str(e)}\n", level="ERROR")
+            self.update_response_area(f"Message attributes: {dir(message)}\n", level="DEBUG")
 
     def update_price_and_stop_loss(self, ticker, price):
         self.price_input.setText(f"{price:.2f}")
@@ -1,13 +1,17 @@
 import sys
 import json
+import copy
 import requests
 import os
+import queue
+import threading
+from urllib.parse import urlsplit
 import math 
 from datetime import datetime, timezone, timedelta
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, 
                              QPushButton, QLabel, QComboBox, QLineEdit, QTextEdit, 
                              QMessageBox, QDialog, QDialogButtonBox, QFormLayout, QGridLayout, QSpinBox, QSizePolicy,QDoubleSpinBox,
-                             QCheckBox, QTableWidget, QTableWidgetItem, QScrollArea, QMenuBar, QAction, QHeaderView, QAbstractItemView, QDateTimeEdit)
+                             QCheckBox, QTableWidget, QTableWidgetItem, QScrollArea, QMenuBar, QAction, QHeaderView, QAbstractItemView, QDateTimeEdit, QFileDialog)
 from PyQt5.QtGui import QPainter, QColor, QPen, QIcon, QPixmap, QPalette
 from PyQt5.QtCore import Qt, QSize, QPoint, QTimer, QThread, pyqtSignal, QMetaObject, pyqtSlot, QDateTime
 import databento as db
@@ -16,15 +20,30 @@ import time
 import sip
 from pytz import UTC
 import re
+from collections import namedtuple
+from atr_engine import IncrementalATR, MinuteBarAggregator
+from archive_writer import BufferedArchiveWriter, FLUSH_POLICIES
+from risk_engine import RiskEngine
+from latency_metrics import LatencyTracker, STAGES
+from dbn_cache import DBNCache
+from bar_store import BarStore
+from response_log import ResponseLog
+import order_journal
+from tick_buffer import ConflatingTickBuffer
 
 class ArchiveWorker(QThread):
     error_signal = pyqtSignal(str)
 
-    def __init__(self, archive_key):
+    def __init__(self, archive_key, flush_policy="bar_close", flush_records=500, flush_interval_ms=1000):
         super().__init__()
         self.archive_key = archive_key
+        self.flush_policy = flush_policy
+        self.flush_records = flush_records
+        self.flush_interval_ms = flush_interval_ms
         self.running = True
         self.live = None
+        self.file_path = None
+        self.last_timestamp = None  # ts_event (ns) of the last bar written to self.file_path
 
     def get_latest_timestamp(self, file_path):
         try:
@@ -49,29 +68,50 @@ class ArchiveWorker(QThread):
             start=start_time
         )
         
+        # ohlcv-1m records are already closed bars, so bar_close syncs each minute's batch as soon as it is written
+        writer = BufferedArchiveWriter(file_path, flush_policy=self.flush_policy, flush_records=self.flush_records,
+                                       flush_interval_ms=self.flush_interval_ms, closed_bars=True)
+        # The record loop below blocks until the next bar arrives, so the writer is polled from a side thread
+        stop_polling = threading.Event()
+        poll_seconds = self.flush_interval_ms / 1000 if self.flush_policy == "interval" else 0.25
+
+        def poll_writer():
+            while not stop_polling.wait(poll_seconds):
+                writer.poll()
+
+        poller = threading.Thread(target=poll_writer, daemon=True)
+        poller.start()
         if is_new_file:
-            self.live.add_stream(file_path)
+            # The live client writes the DBN header and every record through the writer,
+            # so records are only written by hand when appending to an existing file
+            self.live.add_stream(writer)
             print(f"Added new stream for {file_path}")
 
-        previous_timestamp = None
-        with open(file_path, 'ab') as file:
+        try:
             for rec in self.live:  # This will automatically start the streaming
                 if not self.running:
                     break
                 if rec is not None:
-                    file.write(bytes(rec))
-                    file.flush()  # Ensure data is written to disk
-
-                    # Periodically check and report progress
-                    latest_timestamp = self.get_latest_timestamp(file_path)
-                    if latest_timestamp and latest_timestamp != previous_timestamp:
-                        previous_timestamp = latest_timestamp
-                        print(f"Data written up to {previous_timestamp}")
+                    if not is_new_file:
+                        writer.write(bytes(rec))
+                    writer.record_written(getattr(rec, 'ts_event', None))
+
+                    # Report progress from the bar we just wrote rather than re-reading the file
+                    if isinstance(rec, db.OHLCVMsg) and rec.ts_event != self.last_timestamp:
+                        self.last_timestamp = rec.ts_event
+                        print(f"Data written up to {pd.Timestamp(self.last_timestamp, unit='ns', tz='UTC')}")
                 else:
                     print("Warning: Received invalid record from live_client")
-
-        if self.live:
-            self.live.stop()
+        finally:
+            if self.live:
+                self.live.stop()
+                try:
+                    self.live.block_for_close(timeout=5)  # Let the stream finish writing before we close it
+                except Exception as e:
+                    print(f"Error waiting for archive stream to close: {e}")
+            stop_polling.set()
+            poller.join()
+            writer.close()
 
     def run(self):
         archive_dir = "databento_archives"
@@ -81,11 +121,17 @@ class ArchiveWorker(QThread):
             try:
                 current_date = datetime.now().strftime('%Y%m%d')
                 filename = f"ohlcv-1m_{current_date}.dbn"
-                self.file_path = os.path.join(archive_dir, filename)
+                file_path = os.path.join(archive_dir, filename)
+                if file_path != self.file_path:
+                    self.file_path = file_path
+                    self.last_timestamp = None
 
                 if os.path.exists(self.file_path):
-                    # File exists, start from the latest timestamp in the file
-                    last_timestamp = self.get_latest_timestamp(self.file_path)
+                    # File exists, start from the latest timestamp in the file (only decode it if we didn't write it)
+                    if self.last_timestamp is not None:
+                        last_timestamp = pd.Timestamp(self.last_timestamp, unit='ns', tz='UTC')
+                    else:
+                        last_timestamp = self.get_latest_timestamp(self.file_path)
                     start_time = last_timestamp + timedelta(minutes=1) if last_timestamp else datetime.now().replace(second=0, microsecond=0)
                 else:
                     # New file, start from 2 hours ago
@@ -104,13 +150,14 @@ class ArchiveWorker(QThread):
 
     def stop(self):
         self.running = False
-        if os.path.exists(self.file_path):
+        if self.file_path and os.path.exists(self.file_path):
             os.remove(self.file_path)
         if self.live:
             self.live.stop()
 
 class SettingsDialog(QDialog):
-    def __init__(self, parent, api_url, databento_key, archive_key, atr_period, atr_lookback):
+    def __init__(self, parent, api_url, databento_key, archive_key, atr_period, atr_lookback,
+                 archive_flush_policy, archive_flush_records, archive_flush_interval_ms, feed_mode):
         super().__init__(parent)
         self.setWindowTitle("Settings")
         
@@ -134,6 +181,27 @@ class SettingsDialog(QDialog):
         self.atr_lookback_input.setRange(60, 1440)  # 1 hour to 1 day in minutes
         self.atr_lookback_input.setValue(atr_lookback)
         layout.addRow("ATR Lookback (minutes):", self.atr_lookback_input)
+
+        self.archive_flush_policy_combo = QComboBox()
+        self.archive_flush_policy_combo.addItems(FLUSH_POLICIES)
+        self.archive_flush_policy_combo.setCurrentText(archive_flush_policy)
+        layout.addRow("Archive Flush Policy:", self.archive_flush_policy_combo)
+
+        self.archive_flush_records_input = QSpinBox()
+        self.archive_flush_records_input.setRange(1, 100000)
+        self.archive_flush_records_input.setValue(archive_flush_records)
+        layout.addRow("Archive Flush Every N Records:", self.archive_flush_records_input)
+
+        self.archive_flush_interval_input = QSpinBox()
+        self.archive_flush_interval_input.setRange(10, 600000)
+        self.archive_flush_interval_input.setValue(archive_flush_interval_ms)
+        layout.addRow("Archive Flush Interval (ms):", self.archive_flush_interval_input)
+
+        self.feed_mode_combo = QComboBox()
+        self.feed_mode_combo.addItems(FEED_MODES)
+        self.feed_mode_combo.setCurrentText(feed_mode)
+        self.feed_mode_combo.setToolTip("mbp-1 / tbbo price open positions from the top of book; other tickers stay on ohlcv-1s")
+        layout.addRow("Position Feed Mode:", self.feed_mode_combo)
         
         buttons = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel, Qt.Horizontal, self)
         buttons.accepted.connect(self.accept)
@@ -144,9 +212,77 @@ class SettingsDialog(QDialog):
     def get_settings(self):
         return (self.url_input.text(), self.databento_key_input.text(), 
                 self.archive_key_input.text(), self.atr_period_input.value(), 
-                self.atr_lookback_input.value())
+                self.atr_lookback_input.value(), self.archive_flush_policy_combo.currentText(),
+                self.archive_flush_records_input.value(), self.archive_flush_interval_input.value(),
+                self.feed_mode_combo.currentText())
+
 
 
+class LatencyMetricsDialog(QDialog):
+    def __init__(self, parent, tracker, dump_file, tick_buffer=None):
+        super().__init__(parent)
+        self.setWindowTitle("Latency Metrics")
+        self.tracker = tracker
+        self.dump_file = dump_file
+        self.tick_buffer = tick_buffer
+
+        layout = QVBoxLayout(self)
+
+        self.metrics_table = QTableWidget(len(STAGES), 5)
+        self.metrics_table.setHorizontalHeaderLabels(["Count", "p50 (ms)", "p90 (ms)", "p99 (ms)", "Max (ms)"])
+        self.metrics_table.setVerticalHeaderLabels(STAGES)
+        self.metrics_table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.metrics_table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
+        layout.addWidget(self.metrics_table)
+
+        self.feed_label = QLabel("")
+        layout.addWidget(self.feed_label)
+
+        dump_button = QPushButton("Dump to JSON")
+        dump_button.clicked.connect(self.dump)
+        layout.addWidget(dump_button)
+
+        self.status_label = QLabel("")
+        layout.addWidget(self.status_label)
+
+        self.refresh_timer = QTimer(self)
+        self.refresh_timer.timeout.connect(self.refresh)
+        self.refresh_timer.start(1000)
+        self.refresh()
+        self.resize(600, 340)
+
+    def refresh(self):
+        for row, stage in enumerate(STAGES):
+            stats = self.tracker.percentiles(stage)
+            values = [stats['count'], stats['p50'], stats['p90'], stats['p99'], stats['max']]
+            for col, value in enumerate(values):
+                if value is None:
+                    text = "-"
+                elif col == 0:
+                    text = str(value)
+                else:
+                    text = f"{value:.2f}"
+                self.metrics_table.setItem(row, col, QTableWidgetItem(text))
+
+        if self.tick_buffer is not None:
+            feed = self.tick_buffer.stats()
+            conflated_pct = 100 * feed['conflated'] / feed['received'] if feed['received'] else 0
+            self.feed_label.setText(f"Feed ticks: {feed['received']} received, {feed['delivered']} delivered, "
+                                    f"{feed['conflated']} conflated ({conflated_pct:.1f}%), "
+                                    f"{feed['pending']} pending (max {feed['max_pending']})")
+
+    def dump(self):
+        try:
+            extra = {'feed': self.tick_buffer.stats()} if self.tick_buffer is not None else None
+            self.tracker.dump(self.dump_file, extra)
+            self.status_label.setText(f"Wrote {os.path.abspath(self.dump_file)}")
+        except OSError as e:
+            self.status_label.setText(f"Error writing {self.dump_file}: {e}")
+
+    def closeEvent(self, event):
+        self.refresh_timer.stop()
+        super().closeEvent(event)
+
 
 class AddTradeDialog(QDialog):
     def __init__(self, parent=None, current_price=0, current_entry_price=None):
@@ -169,14 +305,45 @@ class AddTradeDialog(QDialog):
     def get_trade_info(self):
         return float(self.entry_price_input.text()), self.action_combo.currentText()
     
+# What crosses from the feed threads to the GUI: prices stay as the feed's 1e-9 fixed-point ints,
+# ticker_index is the symbol's position in its subscription and received_ns is when the worker read it.
+# bid/ask are only set by the top-of-book schemas.
+Tick = namedtuple('Tick', ['ticker_index', 'ts_event', 'ts_recv', 'open', 'high', 'low', 'close', 'volume', 'received_ns',
+                           'bid', 'ask'], defaults=(None, None))
+
+# Schemas positions can be priced from: 1 s bars for everything, or top of book for tickers with an open position
+FEED_MODES = ["ohlcv-1s", "mbp-1", "tbbo"]
+UNDEF_PRICE = 2 ** 63 - 1  # Databento's null price
+
+
+def make_tick(record, ticker_index, received_ns):
+    return Tick(ticker_index, record.ts_event, getattr(record, 'ts_recv', None), record.open, record.high,
+                record.low, record.close, record.volume, received_ns)
+
+
+def make_quote_tick(record, ticker_index, received_ns):
+    # mbp-1 / tbbo: the trade price for trades, otherwise the mid of the best bid and ask
+    level = record.levels[0]
+    bid = level.bid_px if level.bid_px != UNDEF_PRICE else None
+    ask = level.ask_px if level.ask_px != UNDEF_PRICE else None
+    if record.action == 'T' and record.price != UNDEF_PRICE:
+        price, volume = record.price, record.size
+    elif bid is not None and ask is not None:
+        price, volume = (bid + ask) // 2, 0
+    else:
+        return None  # One-sided book and no trade; nothing to price from
+    return Tick(ticker_index, record.ts_event, record.ts_recv, price, price, price, price, volume, received_ns, bid, ask)
+
+
 class DatabentoWorker(QThread):
-    data_received = pyqtSignal(str, object)
+    ticks_ready = pyqtSignal()  # New ticks are waiting in tick_buffer; only emitted when the GUI isn't already due to drain it
     symbol_mapped = pyqtSignal(str, object)
     connection_error = pyqtSignal(str)
 
-    def __init__(self, key, is_replay=False, replay_start=None, replay_symbol=None):
+    def __init__(self, key, is_replay=False, replay_start=None, replay_symbol=None, tick_buffer=None):
         super().__init__()
         self.key = key
+        self.tick_buffer = tick_buffer if tick_buffer is not None else ConflatingTickBuffer()
         self.subscriptions = {}
         self.is_running = True
         self.client = None
@@ -185,6 +352,7 @@ class DatabentoWorker(QThread):
         self.replay_symbol = replay_symbol
         self.max_retries = 5
         self.retry_delay = 5  # seconds
+        self.routes = {}  # instrument_id -> (subscription id, index of its symbol in that subscription)
 
     def add_subscription(self, subscription_id, dataset, schema, symbols, stype_in=None):
         self.subscriptions[subscription_id] = {
@@ -217,19 +385,33 @@ class DatabentoWorker(QThread):
                     self.client.subscribe(**subscribe_params)
                 
                 for message in self.client:
+                    received_ns = time.time_ns()
                     if not self.is_running:
                         break
                     if isinstance(message, db.SymbolMappingMsg):
                         print(f"Received SymbolMappingMsg: {message}")
                         relevant_sub_id = self.determine_relevant_subscription(message)
                         if relevant_sub_id:
+                            self.routes[message.instrument_id] = (relevant_sub_id, self.symbol_index(relevant_sub_id, message))
                             print(f"Emitting symbol_mapped for subscription: {relevant_sub_id}")
                             self.symbol_mapped.emit(relevant_sub_id, message)
                         else:
                             print(f"Could not determine relevant subscription for message: {message}")
+                    elif isinstance(message, db.SystemMsg):
+                        # Handle system messages (like Heartbeat)
+                        print(f"Received system message: {message.msg}")
+                    elif hasattr(message, 'close') or hasattr(message, 'levels'):
+                        # Only the subscription that owns the instrument gets the update
+                        route = self.routes.get(message.instrument_id)
+                        if route:
+                            if hasattr(message, 'levels'):
+                                tick = make_quote_tick(message, route[1], received_ns)
+                            else:
+                                tick = make_tick(message, route[1], received_ns)
+                            if tick and self.tick_buffer.put(route, tick):
+                                self.ticks_ready.emit()
                     else:
-                        for sub_id in self.subscriptions:
-                            self.data_received.emit(sub_id, message)
+                        print(f"Unexpected message format: {message}")
                 
                 # If we get here, it means the connection was closed normally
                 break
@@ -254,12 +436,282 @@ class DatabentoWorker(QThread):
                 return sub_id
         return None
 
+    def symbol_index(self, sub_id, message):
+        symbols = self.subscriptions[sub_id]['symbols']
+        if message.stype_in_symbol in symbols:
+            return symbols.index(message.stype_in_symbol)
+        return symbols.index(message.stype_out_symbol)
+
     def stop(self):
         self.is_running = False
         if self.client:
             self.client.stop()
 
 
+REPLAY_SPEEDS = {"1x": 1, "10x": 10, "100x": 100, "Max": None}
+
+
+class ReplayWorker(QThread):
+    # Streams recorded market data to the GUI at a multiple of real time (speed=None means as fast as possible).
+    # The source is either a local DBN file or a Historical API range. API ranges go through the DBN cache,
+    # so they are read from files on disk (any length, nothing held in memory) and replays of the same
+    # sessions don't download them again.
+    record_ready = pyqtSignal(object)
+    finished_signal = pyqtSignal(str)
+    error_signal = pyqtSignal(str)
+
+    def __init__(self, key=None, file_path=None, symbol=None, start=None, end=None, speed=1, max_in_flight=256, cache=None):
+        super().__init__()
+        self.key = key
+        self.cache = cache
+        self.file_path = file_path
+        self.symbol = symbol
+        self.start_time = start
+        self.end_time = end
+        self.speed = speed
+        self.running = True
+        # Backpressure: at most max_in_flight records emitted but not yet handled by the GUI
+        self.in_flight = threading.Semaphore(max_in_flight)
+        self.records_played = 0
+
+    def record_handled(self):
+        # Called by the GUI once it has processed a record from record_ready
+        self.in_flight.release()
+
+    def run(self):
+        store = None
+        try:
+            if self.file_path:
+                store = db.DBNStore.from_file(self.file_path)
+            else:
+                store = self.cache.records(db.Historical(self.key), "GLBX.MDP3", "ohlcv-1s", [self.symbol],
+                                           self.start_time, self.end_time, stype_in="continuous")
+            instrument_symbols = {}  # instrument_id -> continuous symbol, from mapping records in the file
+            first_ts = None
+            first_wall = None
+
+            for record in store:
+                if not self.running:
+                    break
+                if isinstance(record, db.SymbolMappingMsg):
+                    instrument_symbols[record.instrument_id] = record.stype_in_symbol
+                    continue
+                if isinstance(record, db.SystemMsg) or not hasattr(record, 'close'):
+                    continue
+
+                # Archive files hold several instruments; keep the one being replayed
+                mapped_symbol = instrument_symbols.get(record.instrument_id)
+                if self.file_path and self.symbol and mapped_symbol is not None and mapped_symbol != self.symbol:
+                    continue
+
+                if self.speed:
+                    if first_ts is None:
+                        first_ts = record.ts_event
+                        first_wall = time.monotonic()
+                    delay = first_wall + (record.ts_event - first_ts) / 1e9 / self.speed - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+
+                while not self.in_flight.acquire(timeout=0.5):
+                    if not self.running:
+                        break
+                if not self.running:
+                    break
+                self.record_ready.emit(make_tick(record, 0, time.time_ns()))
+                self.records_played += 1
+
+            self.finished_signal.emit(f"Replay finished. {self.records_played} records played.")
+        except Exception as e:
+            self.error_signal.emit(f"Error in replay: {str(e)}")
+        finally:
+            if hasattr(store, 'close'):
+                store.close()  # Lets the cache remove its uncached temp file if the replay stopped early
+
+    def stop(self):
+        self.running = False
+
+
+class OrderDispatchWorker(QThread):
+    order_completed = pyqtSignal(object)
+
+    def __init__(self, api_url, keepalive_interval=25, request_timeout=(3.05, 10)):
+        super().__init__()
+        self.api_url = api_url
+        self.request_timeout = request_timeout  # (connect, read) seconds; orders are sent one at a time, so a hung request must not stall the rest
+        self.order_queue = queue.Queue()
+        self.is_running = True
+        self.next_order_id = 0
+        self.keepalive_interval = keepalive_interval  # seconds of idle before pinging the webhook host
+        self.ping_timeout = 2  # seconds
+        self.ping_thread = None
+        self.session = None
+
+    def create_session(self):
+        # One keep-alive pool shared by every order so only the first request pays for TCP+TLS
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=4)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    def set_api_url(self, api_url):
+        self.api_url = api_url
+        self.warm_up()
+
+    def warm_up(self):
+        self.order_queue.put({'kind': 'warmup'})
+
+    def submit(self, order, kind, trace=None, dry_run=False):
+        # Called from the GUI thread; the HTTP round trip happens in run()
+        self.next_order_id += 1
+        job = {
+            'id': self.next_order_id,
+            'kind': kind,
+            'order': order,
+            'trace': trace,  # Market-data timing of the tick that triggered the order, if any
+            'dry_run': dry_run,  # Replay orders are acknowledged locally and never reach the webhook
+            'submitted_at': time.time(),
+            'dequeued_at': None,
+            'sent_at': None,
+            'responded_at': None,
+            'success': False,
+            'response': None,
+            'error': None
+        }
+        self.order_queue.put(job)
+        return job['id']
+
+    def ping(self):
+        # Touch the webhook host (not the webhook itself) to open or refresh the pooled connection
+        parts = urlsplit(self.api_url)
+        if not parts.scheme or not parts.netloc:
+            return
+        try:
+            self.session.head(f"{parts.scheme}://{parts.netloc}/", timeout=self.ping_timeout)
+        except requests.RequestException as e:
+            print(f"Webhook keep-alive ping failed: {e}")
+
+    def ping_in_background(self):
+        # Keep-alives run on their own thread and share the connection pool, so an order never waits behind one
+        if self.ping_thread is not None and self.ping_thread.is_alive():
+            return
+        self.ping_thread = threading.Thread(target=self.ping, daemon=True)
+        self.ping_thread.start()
+
+    def run(self):
+        self.session = self.create_session()
+        self.ping_in_background()
+        while self.is_running:
+            try:
+                job = self.order_queue.get(timeout=self.keepalive_interval)
+            except queue.Empty:
+                self.ping_in_background()
+                continue
+            if job is None:
+                break
+            if job['kind'] == 'warmup':
+                self.ping_in_background()
+                continue
+            job['dequeued_at'] = time.time()
+            if job['dry_run']:
+                job['sent_at'] = job['responded_at'] = time.time()
+                job['response'] = {"success": True, "dry_run": True}
+                job['success'] = True
+                job['latency_ms'] = (job['responded_at'] - job['submitted_at']) * 1000
+                self.order_completed.emit(job)
+                continue
+            try:
+                job['sent_at'] = time.time()
+                response = self.session.post(self.api_url, json=job['order'], timeout=self.request_timeout)
+                job['responded_at'] = time.time()
+                response.raise_for_status()
+
+                job['response'] = response.json()
+                job['success'] = bool(job['response'].get("success"))
+            except requests.Timeout as e:
+                job['responded_at'] = time.time()
+                job['error'] = f"Webhook request timed out after {job['responded_at'] - job['sent_at']:.1f}s: {e}"
+            except Exception as e:
+                if job['responded_at'] is None:
+                    job['responded_at'] = time.time()
+                job['error'] = str(e)
+            job['latency_ms'] = (job['responded_at'] - job['submitted_at']) * 1000
+            self.order_completed.emit(job)
+        self.session.close()
+
+    def stop(self):
+        self.is_running = False
+        self.order_queue.put(None)  # Wake up run() so it can exit
+
+
+class PersistenceWorker(QThread):
+    error_signal = pyqtSignal(str)
+
+    def __init__(self, file_path, journal_path):
+        super().__init__()
+        self.file_path = file_path
+        self.journal_path = journal_path
+        self.condition = threading.Condition()
+        self.pending = []  # ('journal', text) and ('snapshot', text) operations, in submission order
+        self.is_running = True
+
+    def append_journal(self, text):
+        with self.condition:
+            self.pending.append(('journal', text))
+            self.condition.notify()
+
+    def save(self, payload):
+        # A snapshot supersedes the journal; the journal is truncated once the snapshot is on disk
+        with self.condition:
+            self.pending.append(('snapshot', payload))
+            self.condition.notify()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.pending and self.is_running:
+                    self.condition.wait()
+                operations = self.pending
+                self.pending = []
+            if not operations:
+                break  # Stopped with nothing left to write
+
+            # Everything queued before the newest snapshot is already contained in it
+            snapshot_indexes = [index for index, (kind, _) in enumerate(operations) if kind == 'snapshot']
+            if snapshot_indexes:
+                operations = operations[snapshot_indexes[-1]:]
+
+            try:
+                journal_text = ''.join(text for kind, text in operations if kind == 'journal')
+                if operations[0][0] == 'snapshot':
+                    self.write_atomic(operations[0][1])
+                    open(self.journal_path, 'w').close()
+                if journal_text:
+                    self.append_to_journal(journal_text)
+            except OSError as e:
+                self.error_signal.emit(f"Error saving {self.file_path}: {str(e)}")
+
+    def append_to_journal(self, text):
+        with open(self.journal_path, 'a') as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def write_atomic(self, payload):
+        # Write a temp file and rename it over the old one so a crash never leaves a half-written file
+        temp_path = f"{self.file_path}.tmp"
+        with open(temp_path, 'w') as f:
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.file_path)
+
+    def stop(self):
+        with self.condition:
+            self.is_running = False
+            self.condition.notify()
+
+
 class TPTableWidget(QTableWidget):
     tp_changed = pyqtSignal(int, int, object)
 
@@ -322,14 +774,29 @@ class TradingApp(QMainWindow):
         
         self.last_tp_table_update = 0
         self.tp_table_update_interval = 60  # in seconds
+        self.tp_table_render_interval_ms = 100  # Repaint the TP table at most 10 times a second
+        self.tp_table_dirty = False
+        self.tp_table_cells = {}  # (row, column) -> last rendered value, so unchanged cells are left alone
 
 
         self.orders_file = 'active_orders.json'
-        self.active_orders = {}
-        self.tp_levels = {}
+        self.journal_file = 'active_orders.journal'  # Events appended since orders_file was last written
+        self.journaled_state = {}  # ('order' | 'tp_levels', ticker) -> JSON last written to the journal
+        self.journal_entries = 0
+        self.journal_compact_after = 500  # Fold the journal into a fresh snapshot after this many events
+        # Positions, stops and TP ladders live in the engine; active_orders/tp_levels forward to it
+        self.risk_engine = RiskEngine()
         self.entry_price = None
         
         self.databento_worker = None
+        self.quote_worker = None  # Top-of-book feed for tickers with open positions (feed_mode mbp-1/tbbo)
+        self.feed_tickers = {}  # subscription id -> tickers in the order they were subscribed
+        self.quote_subscription = None  # Subscription id of the current top-of-book session, e.g. "positions-3"
+        self.quote_sessions = 0
+        self.quote_last_seen = {}  # ticker -> time.monotonic() of its last top-of-book tick
+        self.quote_stale_after = 3  # Seconds without a quote before the 1 s bars price the ticker again
+        self.retired_workers = []  # Feed workers told to stop, kept referenced until their thread ends
+        self.tick_buffer = ConflatingTickBuffer()  # Newest tick per ticker, drained by drain_ticks
         self.is_databento_initialized = False
         
         self.symbol_map = {
@@ -359,20 +826,53 @@ class TradingApp(QMainWindow):
             "MES": "MES1!",
             "MCL": "MCL1!"
         }
+
+        # Every ticker seen under either contract type, so positions stay monitored after switching
+        self.all_symbol_map = dict(self.symbol_map)
+        self.all_ticker_map = dict(self.ticker_map)
+        self.all_trail_by_amounts = dict(self.default_trail_by_amounts)
+        self.risk_engine.order_symbols = self.all_ticker_map
         
-        self.instrument_id_map = {}
         self.current_prices = {ticker: 0 for ticker in self.symbol_map}
         self.atr_period = 14  # Default ATR period
         self.atr_lookback = 390  # Default to 6.5 hours (typical trading day)
         self.atr_values = {}  # Dictionary to store ATR values for each ticker
+        self.atr_engines = {}  # Per-ticker IncrementalATR, seeded once from the archive then fed live bars
+        self.bar_store = BarStore()  # Archived 1-minute bars across all daily files, converted incrementally
+        self.minute_bars = {}  # Per-ticker MinuteBarAggregator turning 1s bars into 1m bars
         self.trail_by_amount = 0
-        self.first_tp_hit = False 
         
         self.load_settings()
         self.load_active_orders()  # Load active orders before setting up UI
+
+        # State is serialized on the GUI thread and written to disk in the background
+        self.persistence_worker = PersistenceWorker(self.orders_file, self.journal_file)
+        self.persistence_worker.error_signal.connect(self.handle_persistence_error)
+        self.persistence_worker.start()
+        self.compact_journal()  # Start the session from a snapshot that includes any replayed events
+
+        # Orders are sent from a worker thread; callbacks run back on the GUI thread
+        self.order_dispatcher = None
+        self.order_callbacks = {}
+        self.latency_tracker = LatencyTracker()
+        self.latency_dump_file = 'latency_metrics.json'
+        self.feed_bar_interval_ns = 1_000_000_000  # ohlcv-1s bars; their exchange reference is the bar close
+        self.latency_dump_timer = QTimer(self)
+        self.latency_dump_timer.timeout.connect(self.dump_latency_metrics)
+        self.latency_dump_timer.start(60 * 1000)
+        self.latency_dialog = None
+        self.start_order_dispatcher()
         
         #Replay mode
         self.is_replay_mode = False
+        self.replay_worker = None
+        self.dbn_cache = DBNCache()  # Historical ranges already downloaded are replayed from disk
+        self.replay_clock = None  # Virtual time (seconds) of the record being replayed; None when live
+        self.resume_live_after_replay = False
+        self.pre_replay_tp_levels = None  # TP ladders as they were before the replay; restored when it ends
+        self.simulated_order_ids = set()  # Replay orders still in the dispatcher queue
+        self.replay_ticker = None  # Ticker the replayed records price
+        self.risk_engine.clock = self.now
 
         #self.archive_key = ""
         self.archive_worker = None
@@ -380,7 +880,11 @@ class TradingApp(QMainWindow):
         self.trade_timer = None
         self.trade_start_time = None
         self.timer_duration = 5 * 60  # 5 minutes in seconds
-        self.timer_expired_message_shown = False
+        self.risk_engine.timer_duration = self.timer_duration
+        # Timer exits for every open position, not just the one on screen; trade_timer only drives the label
+        self.position_timer = QTimer(self)
+        self.position_timer.timeout.connect(self.check_position_timers)
+        self.position_timer.start(1000)
         
         
         self.setup_ui()
@@ -390,6 +894,7 @@ class TradingApp(QMainWindow):
         self.initialize_price_and_stoploss()
         self.update_trade_status()
         self.setup_menu_bar()
+        self.connect_risk_settings()
 
         # Initialize price updates by default
         self.enable_price_updates_action.setChecked(True)
@@ -589,6 +1094,9 @@ class TradingApp(QMainWindow):
 
         # TP Table
         self.tp_table = TPTableWidget(self)
+        self.tp_table_render_timer = QTimer(self)
+        self.tp_table_render_timer.setSingleShot(True)
+        self.tp_table_render_timer.timeout.connect(self.render_tp_table_if_dirty)
         self.tp_table_container = QWidget()
         self.tp_table_container.setLayout(QVBoxLayout())
         self.tp_table_container.layout().setContentsMargins(0, 0, 0, 0)
@@ -614,9 +1122,9 @@ class TradingApp(QMainWindow):
         main_layout.addLayout(status_layout)
 
         # Response area
-        self.response_area = QTextEdit()
-        self.response_area.setReadOnly(True)
-        main_layout.addWidget(self.response_area)
+        self.response_log = ResponseLog(self, max_lines=self.log_max_lines, level=self.log_level)
+        self.response_log.level_changed.connect(self.set_log_level)
+        main_layout.addWidget(self.response_log)
 
         # Set size policy for the central widget to be expanding
         central_widget.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding)
@@ -699,6 +1207,9 @@ class TradingApp(QMainWindow):
         else:
             self.ticker_combo.setCurrentIndex(0)
         self.ticker_combo.blockSignals(False)
+        self.all_symbol_map.update(self.symbol_map)
+        self.all_ticker_map.update(self.ticker_map)
+        self.all_trail_by_amounts.update(self.default_trail_by_amounts)
         
         # Update the current ticker and its values
         self.update_default_values(self.ticker_combo.currentText())
@@ -735,28 +1246,66 @@ class TradingApp(QMainWindow):
             "price": current_price
         }
 
-        try:
-            response = requests.post(self.api_url, json=order)
-            response.raise_for_status()
-            
-            response_data = response.json()
-            if response_data.get("success"):
+        def on_completed(job):
+            if job['success']:
                 self.update_response_area(f"Take Profit order sent successfully for {symbol}. Quantity: {quantity}\n")
-                
+
                 # Update the active order
-                self.active_orders[current_ticker]['quantity'] -= quantity
-                if self.active_orders[current_ticker]['quantity'] <= 0:
-                    del self.active_orders[current_ticker]
-                    self.update_response_area(f"Position for {current_ticker} fully closed.\n")
-                
+                if current_ticker in self.active_orders:
+                    if self.risk_engine.reduce_position(current_ticker, quantity) <= 0:
+                        self.update_response_area(f"Position for {current_ticker} fully closed.\n")
+
                 self.save_active_orders()
                 self.update_trade_status()
                 self.update_tp_table()
                 self.update_tp_quantity_max()
             else:
-                self.update_response_area(f"Error sending Take Profit order: {response_data}\n")
-        except requests.RequestException as e:
-            self.update_response_area(f"Error sending Take Profit order: {str(e)}\n")
+                self.update_response_area(f"Error sending Take Profit order: {self.order_failure_reason(job)}\n", level="ERROR")
+
+        self.dispatch_order(order, "take_profit", on_completed)
+
+    def start_order_dispatcher(self):
+        self.order_dispatcher = OrderDispatchWorker(self.api_url)
+        self.order_dispatcher.order_completed.connect(self.handle_order_completed)
+        self.order_dispatcher.start()
+
+    def dispatch_order(self, order, kind, callback=None, trace=None):
+        # Simulated for as long as a replay is loaded, whatever the menu checkbox says
+        dry_run = self.replay_worker is not None
+        order_id = self.order_dispatcher.submit(order, kind, trace, dry_run=dry_run)
+        if dry_run:
+            self.simulated_order_ids.add(order_id)
+        if callback:
+            self.order_callbacks[order_id] = callback
+        return order_id
+
+    def handle_order_completed(self, job):
+        # Per-order timings; the level filter hides them unless the log is set to DEBUG
+        self.update_response_area(f"Order {job['id']} ({job['kind']}) for {job['order'].get('ticker')}: "
+                                  f"queued {(job['dequeued_at'] - job['submitted_at']) * 1000:.1f} ms, "
+                                  f"round trip {(job['responded_at'] - job['sent_at']) * 1000:.1f} ms, "
+                                  f"total {job['latency_ms']:.1f} ms\n", level="DEBUG")
+        self.latency_tracker.record_order(job)
+        self.simulated_order_ids.discard(job['id'])
+        callback = self.order_callbacks.pop(job['id'], None)
+        if callback:
+            callback(job)
+
+    def dump_latency_metrics(self):
+        try:
+            self.latency_tracker.dump(self.latency_dump_file, {'feed': self.tick_buffer.stats()})
+        except OSError as e:
+            print(f"Error writing {self.latency_dump_file}: {e}")
+
+    def show_latency_metrics(self):
+        if self.latency_dialog is None:
+            self.latency_dialog = LatencyMetricsDialog(self, self.latency_tracker, self.latency_dump_file, self.tick_buffer)
+        self.latency_dialog.refresh_timer.start(1000)
+        self.latency_dialog.show()
+        self.latency_dialog.raise_()
+
+    def order_failure_reason(self, job):
+        return job['error'] if job['error'] else job['response']
 
     def stop_all_workers(self):
         if self.databento_worker:
@@ -767,6 +1316,27 @@ class TradingApp(QMainWindow):
                 print("Databento worker did not stop gracefully. Terminating...")
                 self.databento_worker.terminate()
 
+        if self.quote_worker:
+            print("Stopping top-of-book worker...")
+            self.quote_worker.stop()
+            self.quote_worker.wait(msecs=5000)
+            if self.quote_worker.isRunning():
+                print("Top-of-book worker did not stop gracefully. Terminating...")
+                self.quote_worker.terminate()
+
+        for worker in list(self.retired_workers):
+            worker.wait(msecs=5000)
+            if worker.isRunning():
+                worker.terminate()
+
+        if self.order_dispatcher:
+            print("Stopping Order dispatcher...")
+            self.order_dispatcher.stop()
+            self.order_dispatcher.wait(msecs=5000)  # Let in-flight orders finish
+            if self.order_dispatcher.isRunning():
+                print("Order dispatcher did not stop gracefully. Terminating...")
+                self.order_dispatcher.terminate()
+
         if self.archive_worker:
             print("Stopping Archive worker...")
             self.archive_worker.stop()
@@ -775,16 +1345,24 @@ class TradingApp(QMainWindow):
                 print("Archive worker did not stop gracefully. Terminating...")
                 self.archive_worker.terminate()
 
-        if hasattr(self, 'historical_timer'):
-            print("Stopping historical timer...")
-            self.historical_timer.stop()
+        if self.replay_worker:
+            print("Stopping Replay worker...")
+            self.stop_replay(resume_live=False)
+
+        if self.persistence_worker:
+            # Stopped last so any state saved while shutting the others down still reaches disk
+            print("Stopping Persistence worker...")
+            self.persistence_worker.stop()
+            self.persistence_worker.wait()
 
 
     def cleanup(self):
         print("Cleaning up...")
-        self.stop_all_workers()
         self.save_settings()
-        self.save_active_orders()
+        self.stop_replay(resume_live=False)  # Simulated positions must not reach the snapshot
+        self.compact_journal()
+        self.dump_latency_metrics()
+        self.stop_all_workers()
         print("Cleanup completed.")
 
     def closeEvent(self, event):
@@ -804,7 +1382,7 @@ class TradingApp(QMainWindow):
         ticker = self.ticker_combo.currentText()
         atr = self.calculate_atr(ticker)
         if atr == 0:
-            self.update_response_area(f"Warning: Using ATR value of 0 for {ticker}. Check data availability.\n")
+            self.update_response_area(f"Warning: Using ATR value of 0 for {ticker}. Check data availability.\n", level="WARNING")
         multiplier = self.atr_multiplier_input.value()
         stop_loss_amount = atr * multiplier
         self.stop_loss_input.setText(f"{stop_loss_amount:.2f}")
@@ -838,66 +1416,57 @@ class TradingApp(QMainWindow):
 
 
     def calculate_atr(self, ticker):
+        if ticker not in self.symbol_map:
+            self.update_response_area(f"Error calculating ATR for {ticker}: No symbol mapping found for ticker: {ticker}\n", level="ERROR")
+            return 0
+        if ticker not in self.atr_engines:
+            self.seed_atr_engines()
+        return self.atr_engines[ticker].value
+
+    def seed_atr_engines(self):
+        # Replay the last lookback of archived 1-minute bars into an engine for each unseeded ticker.
+        # The lookback is taken across daily files, so it is still full right after the archive rolls over at midnight.
+        engines = {ticker: IncrementalATR(self.atr_period) for ticker in self.symbol_map if ticker not in self.atr_engines}
+        if not engines:
+            return
         try:
-            symbol = self.symbol_map.get(ticker)
-            if not symbol:
-                raise ValueError(f"No symbol mapping found for ticker: {ticker}")
-
-            # Find the most recent archived file
-            archive_dir = "databento_archives"
-            archive_files = sorted([f for f in os.listdir(archive_dir) if f.endswith('.dbn')], reverse=True)
-            
-            if not archive_files:
+            # Only archive files that are new or changed since the last seed are decoded
+            self.bar_store.update()
+            if not self.bar_store.sources:
                 raise ValueError("No archived data files found")
 
-            latest_file = os.path.join(archive_dir, archive_files[0])
-
-            # Read the archived data
-            #if os.path.getsize(latest_file) > 0:
-            dbn_store = db.read_dbn(latest_file)
-            df = dbn_store.to_df(schema="ohlcv-1m")
-
-
-            # Map contract symbols to general symbols
-            df['general_symbol'] = df['symbol'].apply(self.map_contract_to_general_symbol)
-
-            # Filter data for the specific symbol
-            df = df[df['general_symbol'] == symbol]
-
-            # Sort the DataFrame by the index (timestamp) in descending order
-            df = df.sort_index(ascending=False)
-
             # Take the latest periods for ATR calculation
             periods_needed = max(self.atr_lookback, self.atr_period * 2)
-            df = df.head(periods_needed)
-
-            if df.empty:
-                raise ValueError(f"No data returned for {ticker}")
-
-            # Convert nanoseconds to standard units if necessary
-            scale_factor = 1e9 if df['high'].max() > 1e6 else 1
-
-            df['high'] = df['high'] / scale_factor
-            df['low'] = df['low'] / scale_factor
-            df['close'] = df['close'] / scale_factor
 
-            # Reverse the DataFrame back to chronological order for ATR calculation
-            df = df.sort_index()
+            for ticker, engine in engines.items():
+                root = self.symbol_map[ticker].split('.')[0]  # MES.c.0 -> MES
+                bars = self.bar_store.lookback(root, periods_needed)
+                if len(bars['ts']) == 0:
+                    self.update_response_area(f"Error calculating ATR for {ticker}: No data returned for {ticker}\n", level="ERROR")
+                    continue
+
+                files = self.bar_store.files_covering(int(bars['ts'][0]), int(bars['ts'][-1]) + 1)
+                print(f"Seeding ATR for {ticker} from {len(bars['ts'])} bars in {len(files)} archive file(s)")
+                for ts, high, low, close in zip(bars['ts'].tolist(), bars['high'].tolist(), bars['low'].tolist(), bars['close'].tolist()):
+                    engine.add_bar(ts, high, low, close)
+        except Exception as e:
+            self.update_response_area(f"Error seeding ATR from archive: {str(e)}\n", level="ERROR")
 
-            df['tr1'] = df['high'] - df['low']
-            df['tr2'] = abs(df['high'] - df['close'].shift())
-            df['tr3'] = abs(df['low'] - df['close'].shift())
-            df['true_range'] = df[['tr1', 'tr2', 'tr3']].max(axis=1)
-            df['atr'] = df['true_range'].rolling(window=self.atr_period).mean()
+        # Tickers without archive data still get an engine; the live feed fills it in
+        self.atr_engines.update(engines)
 
-            atr_value = df['atr'].iloc[-1]
-            return atr_value
-        except Exception as e:
-            self.update_response_area(f"Error calculating ATR for {ticker}: {str(e)}\n")
-            return 0
+    def update_atr_bar(self, ticker, message):
+        aggregator = self.minute_bars.setdefault(ticker, MinuteBarAggregator())
+        completed = aggregator.add(message.ts_event, message.open / 1000000000, message.high / 1000000000,
+                                   message.low / 1000000000, message.close / 1000000000)
+        if completed and ticker in self.atr_engines:
+            bar_ts, _, high, low, close = completed
+            if self.atr_engines[ticker].add_bar(bar_ts, high, low, close) and ticker == self.ticker_combo.currentText():
+                self.update_atr()
 
     def initial_resize(self):
-        self.update_tp_table()
+        self.render_tp_table()
+        self.adjust_table_size()
     
 
     def on_checkbox_changed(self, row, state):
@@ -940,6 +1509,11 @@ class TradingApp(QMainWindow):
         self.enable_archive_action.triggered.connect(self.toggle_archive)
         preference_menu.addAction(self.enable_archive_action)
         
+        # Add 'Latency Metrics' action
+        latency_metrics_action = QAction("Latency Metrics", self)
+        latency_metrics_action.triggered.connect(self.show_latency_metrics)
+        preference_menu.addAction(latency_metrics_action)
+
         # Add 'Open Settings' action
         open_settings_action = QAction("Open Settings", self)
         open_settings_action.triggered.connect(self.open_settings)
@@ -973,50 +1547,111 @@ class TradingApp(QMainWindow):
 
  
 
+    def encode_journal_state(self):
+        return order_journal.encode_state(self.active_orders, self.tp_levels)
+
     def save_active_orders(self):
+        # Append a small event for each ticker whose order or TP ladder changed since the last save,
+        # instead of rewriting the whole file
+        if self.replay_worker is not None:
+            # Replayed trades are simulated; the book on disk stays as it was before the replay
+            self.risk_engine.invalidate_tp_index()
+            return
+
+        state = self.encode_journal_state()
+        events = order_journal.diff_events(self.journaled_state, state)
+        for event in events:
+            if event['event'] in order_journal.TP_EVENTS:
+                self.risk_engine.invalidate_tp_index(event['ticker'])  # The ladder was edited; re-sort it on the next tick
+        self.journaled_state = state
+
+        if not events:
+            return
+        self.persistence_worker.append_journal(order_journal.format_events(events, time.time()))
+        self.journal_entries += len(events)
+        if self.journal_entries >= self.journal_compact_after:
+            self.compact_journal()
+
+    def compact_journal(self):
+        if self.replay_worker is not None:
+            return  # The book holds simulated trades; the snapshot keeps the pre-replay state
         data_to_save = {
             'active_orders': self.active_orders,
             'tp_levels': self.tp_levels
         }
-        with open(self.orders_file, 'w') as f:
-            json.dump(data_to_save, f, indent=2)
+        # Serialize now so the writer gets a consistent snapshot; the disk write happens off this thread
+        self.persistence_worker.save(json.dumps(data_to_save, separators=(',', ':')))
+        self.journaled_state = self.encode_journal_state()
+        self.journal_entries = 0
+
+    def replay_journal(self):
+        if not os.path.exists(self.journal_file):
+            return
+        replayed = order_journal.replay(self.journal_file, self.active_orders, self.tp_levels)
+        print(f"Replayed {replayed} journal events from {self.journal_file}")
+
+    def handle_persistence_error(self, error_msg):
+        self.update_response_area(f"{error_msg}\n", level="ERROR")
+
+    @property
+    def active_orders(self):
+        return self.risk_engine.positions
+
+    @active_orders.setter
+    def active_orders(self, value):
+        self.risk_engine.positions = value
+
+    @property
+    def tp_levels(self):
+        return self.risk_engine.tp_levels
+
+    @tp_levels.setter
+    def tp_levels(self, value):
+        self.risk_engine.tp_levels = value
+        self.risk_engine.invalidate_tp_index()
+
+    @property
+    def pending_exits(self):
+        return self.risk_engine.pending_exits
 
     def load_active_orders(self):
+        self.active_orders = {}
+        self.tp_levels = {}
         if os.path.exists(self.orders_file):
             try:
                 with open(self.orders_file, 'r') as f:
                     data = json.load(f)
                     self.active_orders = data.get('active_orders', {})
                     self.tp_levels = data.get('tp_levels', {})
-                
-                # Validate loaded data
-                for ticker, order in list(self.active_orders.items()):
-                    if not isinstance(order, dict) or 'entry_price' not in order or 'action' not in order:
-                        del self.active_orders[ticker]
-                        print(f"Removed invalid order for {ticker}")
-                
-                for ticker, tps in list(self.tp_levels.items()):
-                    if not isinstance(tps, list):
-                        del self.tp_levels[ticker]
-                        print(f"Removed invalid TP levels for {ticker}")
-                    else:
-                        validated_tps = []
-                        for tp in tps:
-                            if isinstance(tp, dict) and 'target' in tp and 'quantity' in tp:
-                                # Ensure 'hit' status is present, default to False if not
-                                tp['hit'] = tp.get('hit', False)
-                                validated_tps.append(tp)
-                        self.tp_levels[ticker] = validated_tps
-                
-                print(f"Loaded active orders: {self.active_orders}")
-                print(f"Loaded TP levels: {self.tp_levels}")
             except json.JSONDecodeError:
                 print(f"Error loading {self.orders_file}. Starting with empty orders and TP levels.")
                 self.active_orders = {}
                 self.tp_levels = {}
-        else:
-            self.active_orders = {}
-            self.tp_levels = {}
+
+        # Events journaled after the snapshot bring the state up to the moment the app stopped
+        self.replay_journal()
+                
+        # Validate loaded data
+        for ticker, order in list(self.active_orders.items()):
+            if not isinstance(order, dict) or 'entry_price' not in order or 'action' not in order:
+                del self.active_orders[ticker]
+                print(f"Removed invalid order for {ticker}")
+        
+        for ticker, tps in list(self.tp_levels.items()):
+            if not isinstance(tps, list):
+                del self.tp_levels[ticker]
+                print(f"Removed invalid TP levels for {ticker}")
+            else:
+                validated_tps = []
+                for tp in tps:
+                    if isinstance(tp, dict) and 'target' in tp and 'quantity' in tp:
+                        # Ensure 'hit' status is present, default to False if not
+                        tp['hit'] = tp.get('hit', False)
+                        validated_tps.append(tp)
+                self.tp_levels[ticker] = validated_tps
+        
+        print(f"Loaded active orders: {self.active_orders}")
+        print(f"Loaded TP levels: {self.tp_levels}")
 
 
     def update_ui_from_loaded_data(self):
@@ -1036,14 +1671,14 @@ class TradingApp(QMainWindow):
             self.update_stop_loss_on_startup(current_ticker)
             
             # Calculate remaining time and update timer label
-            elapsed_time = time.time() - order['timestamp']
+            elapsed_time = self.now() - order['timestamp']
             remaining_time = max(0, self.timer_duration - elapsed_time)
             minutes, seconds = divmod(int(remaining_time), 60)
             self.timer_label.setText(f"Time left: {minutes:02d}:{seconds:02d}")
             
             # Start the timer if there's remaining time
             if remaining_time > 0:
-                self.trade_start_time = time.time() - elapsed_time
+                self.trade_start_time = self.now() - elapsed_time
                 self.start_trade_timer()
         else:
             # If not in a trade, use the current price
@@ -1101,8 +1736,27 @@ class TradingApp(QMainWindow):
 
 
     def update_tp_table(self):
+        # Callers only mark the table dirty; render_tp_table repaints it at most once per interval
+        self.tp_table_dirty = True
+        if not self.tp_table_render_timer.isActive():
+            self.tp_table_render_timer.start(self.tp_table_render_interval_ms)
+
+    def set_tp_cell(self, row, column, value):
+        if self.tp_table_cells.get((row, column)) == value:
+            return False
+        self.tp_table_cells[(row, column)] = value
+        return True
+
+    def render_tp_table_if_dirty(self):
+        # A direct render since the table was marked dirty already painted everything pending
+        if self.tp_table_dirty:
+            self.render_tp_table()
+
+    def render_tp_table(self):
         if self.tp_table.is_editing:
+            self.update_tp_table()  # Try again once editing is done
             return
+        self.tp_table_dirty = False
 
         self.tp_table.blockSignals(True)
         
@@ -1111,6 +1765,7 @@ class TradingApp(QMainWindow):
         
         if current_ticker in self.tp_levels and self.tp_levels[current_ticker]:
             tp_levels = self.tp_levels[current_ticker]
+            base_color = self.tp_table.palette().color(QPalette.ColorRole.Base)
             
             for row, tp in enumerate(tp_levels):
                 # Update the Price and Status columns
@@ -1126,17 +1781,20 @@ class TradingApp(QMainWindow):
                 
                 # Price
                 price_item = self.tp_table.item(row, 3)
-                if price_item:
-                    price_item.setText(f"{tp_price:.2f}")
+                price_text = f"{tp_price:.2f}"
+                if price_item and self.set_tp_cell(row, 3, price_text):
+                    price_item.setText(price_text)
                 
                 # Status
                 status_item = self.tp_table.item(row, 4)
-                if status_item:
-                    status = "Hit" if tp.get('hit', False) else "Active"
+                status = "Hit" if tp.get('hit', False) else "Active"
+                if status_item and self.set_tp_cell(row, 4, status):
                     status_item.setText(status)
                 
                 # Apply highlighting to all columns if TP is hit
-                highlight_color = QColor(1, 56, 30) if tp.get('hit', False) else self.tp_table.palette().color(QPalette.ColorRole.Base)
+                highlight_color = QColor(1, 56, 30) if tp.get('hit', False) else base_color
+                if not self.set_tp_cell(row, 'highlight', highlight_color.name()):
+                    continue
                 
                 for col in range(5):
                     if col == 0:  # Enabled column (QCheckBox)
@@ -1152,7 +1810,6 @@ class TradingApp(QMainWindow):
                             item.setBackground(highlight_color)
         
         self.tp_table.blockSignals(False)
-        self.adjust_table_size()
 
 
     def force_tp_table_update(self):
@@ -1160,7 +1817,7 @@ class TradingApp(QMainWindow):
         current_ticker = self.ticker_combo.currentText()
         self.tp_table.setRowCount(0)  # Clear the table
         self.populate_tp_table()
-        self.update_tp_table()
+        self.render_tp_table()
         self.adjust_table_size()
         QApplication.processEvents()  # Force the GUI to update immediately
         print(f"TP levels after update: {self.tp_levels.get(current_ticker, [])}")      
@@ -1172,6 +1829,7 @@ class TradingApp(QMainWindow):
     def populate_tp_table(self):
         current_ticker = self.ticker_combo.currentText()
         self.tp_table.setRowCount(0)  # Clear the table first
+        self.tp_table_cells.clear()  # Rows are rebuilt, so nothing rendered so far is still on screen
         
         if current_ticker in self.tp_levels:
             self.sort_tp_levels(current_ticker)  # Sort the TP levels before populating
@@ -1211,7 +1869,7 @@ class TradingApp(QMainWindow):
                 status_item.setTextAlignment(Qt.AlignCenter)
                 self.tp_table.setItem(row, 4, status_item)
         
-        self.update_tp_table()  # Call update_tp_table after populating
+        self.render_tp_table()  # Fill in prices and highlighting for the new rows
         self.adjust_table_size()
 
 
@@ -1281,8 +1939,6 @@ class TradingApp(QMainWindow):
         price = self.current_prices.get(ticker, 0)
         self.price_input.setText(f"{price:.2f}")
         self.update_default_values(ticker)
-        if self.is_databento_initialized:
-            self.initialize_databento_worker()
         self.update_trade_status()
         self.populate_tp_table()
         self.update_stop_loss_display(ticker)
@@ -1296,21 +1952,22 @@ class TradingApp(QMainWindow):
         if ticker is None or ticker == False:
             ticker = self.ticker_combo.currentText()
         print(f"Using ticker: {ticker}")
-        if ticker in self.tp_levels:
-                for tp in self.tp_levels[ticker]:
-                    tp['hit'] = False
+        self.risk_engine.reset_tp_hits(ticker)
         if ticker in self.active_orders:
-            del self.active_orders[ticker]
+            self.risk_engine.close_position(ticker)
         else:
             self.update_response_area(f"No active trade found for {ticker}.\n")
 
-        self.entry_price = None
-        if self.trade_timer:
-            self.trade_timer.stop()
-        self.trade_start_time = None
-        self.timer_label.setText("Time left: 05:00")
-        self.update_trade_status()
+        # The timer and labels belong to the displayed ticker; a stop on a background ticker leaves them alone
+        if ticker == self.ticker_combo.currentText():
+            self.entry_price = None
+            if self.trade_timer:
+                self.trade_timer.stop()
+            self.trade_start_time = None
+            self.timer_label.setText("Time left: 05:00")
+            self.update_trade_status()
         self.save_active_orders()
+        self.sync_quote_subscription()
         self.update_tp_table()
         self.update_stop_loss_display(ticker)
         self.update_response_area(f"Trade cleared for {ticker}.\n")
@@ -1326,13 +1983,9 @@ class TradingApp(QMainWindow):
         if dialog.exec_():
             entry_price, action = dialog.get_trade_info()
             
-            self.active_orders[current_ticker] = {
-                "symbol": current_ticker,
-                "action": action,
-                "quantity": self.quantity_input.value(),
-                "entry_price": entry_price,
-                "timestamp": int(time.time())
-            }
+            # Replaces whatever was recorded for this ticker
+            self.risk_engine.close_position(current_ticker)
+            self.risk_engine.open_position(current_ticker, action, self.quantity_input.value(), entry_price)
             
             # Start the timer when a new trade is added
             self.start_trade_timer()
@@ -1348,6 +2001,7 @@ class TradingApp(QMainWindow):
                     tp['price'] = entry_price - tp['target']
             
             self.save_active_orders()
+            self.sync_quote_subscription()
             self.update_trade_status()
             self.update_tp_table()
             self.update_tp_quantity_max()
@@ -1428,77 +2082,9 @@ class TradingApp(QMainWindow):
         self.tp_table_container.updateGeometry()
 
 
-    def check_stop_loss(self, ticker, current_price):
-        if ticker not in self.active_orders:
-            return False
-
-        order = self.active_orders[ticker]
-        entry_price = order['entry_price']
-        action = order['action']
-        stop_loss = order.get('stop_loss')
-
-        if not stop_loss:
-            return False
-
-        stop_type = stop_loss.get('type')
-        stop_price = stop_loss.get('stopPrice')
-        trail_amount = stop_loss.get('trailAmount')
-
-        if stop_type == 'stop' or stop_type == 'stop_limit':
-            if stop_price is None:
-                return False
-            if action == 'buy' and current_price <= stop_price:
-                return True
-            elif action == 'sell' and current_price >= stop_price:
-                return True
-        elif stop_type == 'trailing_stop':
-            if trail_amount is None:
-                return False
-            if action == 'buy':
-                if stop_price is None:
-                    stop_price = entry_price - trail_amount
-                new_stop_price = max(current_price - trail_amount, stop_price)
-                if current_price <= new_stop_price:
-                    return True
-                if new_stop_price > stop_price:
-                    stop_loss['stopPrice'] = new_stop_price
-            elif action == 'sell':
-                if stop_price is None:
-                    stop_price = entry_price + trail_amount
-                new_stop_price = min(current_price + trail_amount, stop_price)
-                if current_price >= new_stop_price:
-                    return True
-                if new_stop_price < stop_price:
-                    stop_loss['stopPrice'] = new_stop_price
-        elif stop_type == 'trail_after_1st_tp':
-            initial_stop_price = stop_loss.get('initialStopPrice')
-            if initial_stop_price is None:
-                return False
-            if not self.first_tp_hit:
-                if action == 'buy' and current_price <= initial_stop_price:
-                    return True
-                elif action == 'sell' and current_price >= initial_stop_price:
-                    return True
-            else:
-                # After first TP hit, behave like a trailing stop
-                if action == 'buy':
-                    new_stop_price = max(current_price - trail_amount, stop_price or initial_stop_price)
-                    if current_price <= new_stop_price:
-                        return True
-                    if new_stop_price > (stop_price or initial_stop_price):
-                        stop_loss['stopPrice'] = new_stop_price
-                elif action == 'sell':
-                    new_stop_price = min(current_price + trail_amount, stop_price or initial_stop_price)
-                    if current_price >= new_stop_price:
-                        return True
-                    if new_stop_price < (stop_price or initial_stop_price):
-                        stop_loss['stopPrice'] = new_stop_price
-
-        return False
-    
     def start_trade_timer(self):
-        self.trade_start_time = time.time()
-        self.timer_expired_message_shown = False  # Reset the flag when starting a new timer
+        self.trade_start_time = self.now()
+        self.risk_engine.timer_notified.discard(self.ticker_combo.currentText())  # Reset the notice when starting a new timer
         if self.trade_timer is None:
             self.trade_timer = QTimer(self)
             self.trade_timer.timeout.connect(self.update_trade_timer)
@@ -1522,280 +2108,155 @@ class TradingApp(QMainWindow):
         if self.trade_start_time is None:
             return
         
-        elapsed_time = time.time() - self.trade_start_time
+        elapsed_time = self.now() - self.trade_start_time
         remaining_time = max(0, self.timer_duration - elapsed_time)
         
         minutes, seconds = divmod(int(remaining_time), 60)
         self.timer_label.setText(f"Time left: {minutes:02d}:{seconds:02d}")
         
-        if remaining_time <= 0:
-            self.check_exit_condition()
-        
         # Always restart the timer to continue checking
         self.trade_timer.start(1000)
 
+    def now(self):
+        # Wall-clock time when live, the replayed record's time during a replay
+        if self.replay_clock is not None:
+            return self.replay_clock
+        return time.time()
+
+
+    def check_position_timers(self):
+        self.dispatch_intents(self.risk_engine.check_timers(self.now()))
 
     def check_exit_condition(self):
         current_ticker = self.ticker_combo.currentText()
-        if current_ticker in self.active_orders:
-            current_price = float(self.price_input.text())
-            entry_price = self.active_orders[current_ticker]['entry_price']
-            action = self.active_orders[current_ticker]['action']
-            selected_action = self.action_combo.currentText()
-            
-            # Check if the trade is in profit
-            is_in_profit = (action == 'buy' and current_price > entry_price) or (action == 'sell' and current_price < entry_price)
-            
-            if selected_action in ["Exit", "Reverse"]:
-                if not is_in_profit:
-                    if selected_action == "Exit":
-                        self.send_order("exit")
-                        self.update_response_area("Timer expired. Not in profit. Exiting trade.\n")
-                    else:  # Reverse
-                        self.reverse_trade(current_ticker, current_price, action)
-                        self.update_response_area("Timer expired. Not in profit. Reversing trade.\n")
-                    self.timer_expired_message_shown = False  # Reset the flag after action
-                elif not self.timer_expired_message_shown:
-                    self.update_response_area(f"Timer expired. In profit. Holding trade ({selected_action} not executed).\n")
-                    self.timer_expired_message_shown = True
-            elif selected_action == "Hold" and not self.timer_expired_message_shown:
-                self.update_response_area("Timer expired. Holding trade as per selected action.\n")
-                self.timer_expired_message_shown = True
-        else:
+        if current_ticker not in self.active_orders:
             self.update_response_area("No active trade to check exit condition.\n")
+            return
+        self.dispatch_intents(self.risk_engine.check_exit_condition(current_ticker, float(self.price_input.text())))
 
 
-
-
-    def reverse_trade(self, ticker, current_price, current_action):
-        # First, exit the current trade
-        self.send_order("exit")
-        self.update_response_area(f"Exiting current trade for {ticker}.\n")
-
-        # Determine the new action (opposite of the current action)
-        new_action = 'sell' if current_action == 'buy' else 'buy'
-
-        # Get the current stop loss settings
-        stop_loss_amount = float(self.stop_loss_input.text())
-        stop_loss_type = self.stop_loss_type_combo.currentText()
-
-        # Calculate the new stop loss
-        if stop_loss_type == "Trailing":
-            stop_loss_info = {
-                "type": "trailing_stop",
-                "trailAmount": stop_loss_amount
-            }
-        else:
-            if new_action == "buy":
-                stop_loss_price = current_price - stop_loss_amount
-            else:  # sell
-                stop_loss_price = current_price + stop_loss_amount
-            
-            stop_loss_info = {
-                "type": self.get_stop_loss_type(stop_loss_type),
-                "stopPrice": stop_loss_price
-            }
-
-        # Enter a new trade in the opposite direction
-        new_order = {
-            "ticker": self.ticker_map.get(ticker, ticker),
-            "action": new_action,
-            "orderType": "market",
-            "limitPrice": current_price,
-            "quantity": self.quantity_input.value(),
-            "stopLoss": stop_loss_info  # Include the stop loss information
-        }
-
-        # Send the new order
-        response_text = self.send_order_to_server(new_order)
-        if "success" in response_text.lower():
-            self.active_orders[ticker] = {
-                "symbol": ticker,
-                "action": new_action,
-                "quantity": self.quantity_input.value(),
-                "entry_price": current_price,
-                "timestamp": int(time.time()),
-                "stop_loss": stop_loss_info  # Store stop loss info
-            }
-            self.save_active_orders()
-            self.update_trade_status()
-            self.adjust_tp_levels_on_reverse(ticker, current_price, new_action)
-            self.update_tp_table()
-            self.update_stop_loss_display(ticker)
-            self.start_trade_timer()  # Restart the timer for the new trade
-            self.update_response_area(f"Reversed trade for {ticker}. New action: {new_action}, Entry price: {current_price}\n")
-            self.update_response_area(f"Stop loss set: {stop_loss_info['type']} @ {stop_loss_info.get('stopPrice', stop_loss_info.get('trailAmount')):.2f}\n")
-        else:
-            self.update_response_area(f"Failed to reverse trade for {ticker}. Error: {response_text}\n")
-
+    def reverse_trade(self, ticker, current_price):
+        self.dispatch_intents(self.risk_engine.reverse_intents(ticker, current_price))
 
 
     def adjust_tp_levels(self, ticker, entry_price, action):
-        if ticker in self.tp_levels:
-            adjusted_tp_levels = []
-            for tp in self.tp_levels[ticker]:
-                new_tp = tp.copy()
-                new_tp['hit'] = False  # Reset hit status
-                if action == 'buy':
-                    new_tp['price'] = entry_price + abs(new_tp['target'])
-                else:  # sell
-                    new_tp['price'] = entry_price - abs(new_tp['target'])
-                adjusted_tp_levels.append(new_tp)
-            
-            self.tp_levels[ticker] = adjusted_tp_levels
+        if self.risk_engine.adjust_tp_levels(ticker, entry_price, action):
             self.save_active_orders()  # Save the updated TP levels
             self.update_response_area(f"Adjusted TP levels for new {action} trade on {ticker}.\n")
 
 
-    def adjust_tp_levels_on_reverse(self, ticker, new_entry_price, new_action):
-        if ticker in self.tp_levels:
-            adjusted_tp_levels = []
-            for tp in self.tp_levels[ticker]:
-                new_tp = tp.copy()
-                new_tp['hit'] = False  # Reset hit status
-                if new_action == 'buy':
-                    new_tp['target'] = abs(new_tp['target'])  # Make target positive for long trades
-                    new_tp['price'] = new_entry_price + new_tp['target']
-                else:  # sell
-                    new_tp['target'] = -abs(new_tp['target'])  # Make target negative for short trades
-                    new_tp['price'] = new_entry_price + new_tp['target']
-                adjusted_tp_levels.append(new_tp)
-            
-            self.tp_levels[ticker] = adjusted_tp_levels
-            self.save_active_orders()  # Save the updated TP levels
-            self.update_response_area(f"Adjusted TP levels for reversed trade on {ticker}.\n")
-
-
     def delayed_tp_check(self):
-        for ticker in self.active_orders.keys():
+        for ticker in list(self.active_orders.keys()):
             current_price = self.current_prices.get(ticker)
             if current_price is not None and current_price != 0:
-                self.check_and_update_tp_levels(ticker, current_price)
-                self.update_stop_loss(ticker, current_price)  # Add this line
+                self.evaluate_risk(ticker, current_price)
             else:
                 print(f"Skipping TP check for {ticker} due to invalid price")
         self.update_response_area("Initial TP check completed.\n")
 
 
-    def update_stop_loss(self, ticker, current_price):
-        if ticker in self.active_orders:
-            order = self.active_orders[ticker]
-            stop_loss = order.get('stop_loss')
-            if stop_loss:
-                if self.check_stop_loss(ticker, current_price):
-                    # Stop loss hit, send exit order
-                    exit_order = {
-                        "ticker": self.ticker_map.get(ticker, ticker),
-                        "action": "exit",
-                        "orderType": "market"
-                        #"quantity": order['quantity']  # Exit the full position
-                    }
-                    try:
-                        response = requests.post(self.api_url, json=exit_order)
-                        response.raise_for_status()
-                        
-                        response_data = response.json()
-                        if response_data.get("success"):
-                            self.update_response_area(f"Stop loss hit for {ticker} at price {current_price:.2f}. Exit order sent.\n")
-                            # Remove the order from active orders
-                            del self.active_orders[ticker]
-                            self.save_active_orders()
-                            self.update_trade_status()
-                            self.update_tp_table()
-                        else:
-                            self.update_response_area(f"Error sending exit order for stop loss: {response_data}\n")
-                    except requests.RequestException as e:
-                        self.update_response_area(f"Error sending exit order for stop loss: {str(e)}\n")
-                else:
-                    self.update_stop_loss_display(ticker)
-            else:
-                print(f"No stop loss set for {ticker}")
-        else:
-            print(f"No active order for {ticker}")
-
-    
-    def execute_tp_order(self, ticker, tp):
-        self.update_response_area(f"TP hit for {ticker}: {tp['quantity']} @ {tp['price']:.2f}\n")
-        
-        if ticker in self.active_orders:
-            # Send exit order
-            exit_order = {
-                "ticker": self.ticker_map.get(ticker, ticker),
-                "action": "exit",
-                "orderType": "market",
-                "quantity": tp['quantity'],
-                "price": tp['price']
-            }
-            
-            try:
-                response = requests.post(self.api_url, json=exit_order)
-                response.raise_for_status()
-                
-                response_data = response.json()
-                if response_data.get("success"):
-                    self.update_response_area(f"Exit order sent for TP: {ticker}, Quantity: {tp['quantity']}, Price: {tp['price']:.2f}\n")
-                    
-                    # Update the active order
-                    self.active_orders[ticker]['quantity'] -= tp['quantity']
-                    remaining_quantity = self.active_orders[ticker]['quantity']
-                    
-                    if remaining_quantity <= 0:
-                        del self.active_orders[ticker]
-                        self.update_response_area(f"Order for {ticker} fully closed and removed from active orders.\n")
-                    else:
-                        # Update trailing stop
-                        self.update_trailing_stop(ticker, tp['price'], remaining_quantity)
-                    
-                    self.save_active_orders()
-                    self.update_trade_status()
-                    self.update_tp_table()
-                else:
-                    self.update_response_area(f"Error sending exit order for TP: {response_data}\n")
-            except requests.RequestException as e:
-                self.update_response_area(f"Error sending exit order for TP: {str(e)}\n")
-        
-        self.update_tp_quantity_max()
-        self.save_active_orders()
-        self.update_trade_status()
-
+    def connect_risk_settings(self):
+        # The engine never reads widgets; push the inputs it needs whenever they change
+        self.trail_by_input.textChanged.connect(self.sync_risk_settings)
+        self.stop_loss_input.textChanged.connect(self.sync_risk_settings)
+        self.stop_loss_type_combo.currentTextChanged.connect(self.sync_risk_settings)
+        self.quantity_input.valueChanged.connect(self.sync_risk_settings)
+        self.action_combo.currentTextChanged.connect(self.sync_risk_settings)
+        self.sync_risk_settings()
 
+    def sync_risk_settings(self, *args):
+        current_ticker = self.ticker_combo.currentText()
+        self.risk_engine.timer_action = self.action_combo.currentText()
+        self.risk_engine.reverse_stop_loss_type = self.get_stop_loss_type(self.stop_loss_type_combo.currentText())
+        self.risk_engine.reverse_quantity = self.quantity_input.value()
+        self.risk_engine.trail_by_amounts = dict(self.all_trail_by_amounts)
+        try:
+            self.risk_engine.reverse_stop_loss_amount = float(self.stop_loss_input.text())
+        except ValueError:
+            pass
+        try:
+            self.risk_engine.trail_by_amounts[current_ticker] = float(self.trail_by_input.text())
+        except ValueError:
+            pass
 
-    def update_trailing_stop(self, ticker, signal_price, remaining_quantity):
-        if ticker not in self.active_orders:
-            return
+    def dispatch_intents(self, intents, trace=None):
+        for intent in intents:
+            ticker = intent['ticker']
+            kind = intent['kind']
 
-        order = self.active_orders[ticker]
-        stop_loss = order.get('stop_loss', {})
-        
-        trail_amount = stop_loss.get('trailAmount') or float(self.trail_by_input.text())
+            if kind == 'stop_moved':
+                self.save_active_orders()  # Journal the ratcheted stop
+                self.update_stop_loss_display(ticker)
+                continue
+            if kind == 'timer_notice':
+                self.update_response_area(intent['message'])
+                continue
+
+            if kind == 'take_profit':
+                levels = ", ".join(f"{tp['quantity']} @ {tp['price']:.2f}" for tp in intent['tps'])
+                self.update_response_area(f"TP hit for {ticker}: {levels}\n")
+            elif kind == 'timer_exit':
+                self.update_response_area("Timer expired. Not in profit. Exiting trade.\n")
+            elif kind == 'reverse_exit':
+                self.update_response_area("Timer expired. Not in profit. Reversing trade.\n")
+                self.update_response_area(f"Exiting current trade for {ticker}.\n")
+
+            self.latency_tracker.record_decision(trace)
+            self.dispatch_order(intent['order'], kind, lambda job, intent=intent: self.handle_intent_result(intent, job), trace)
+
+        if intents:
+            self.update_tp_table()
 
-        update_order = {
-            "ticker": self.ticker_map.get(ticker, ticker),
-            "action": "exit",
-            "orderType": "trailing_stop",
-            "signalPrice": str(int(signal_price)),  # Convert to integer and then to string
-            "trailAmount": str(trail_amount),
-            "quantity": str(remaining_quantity)
-        }
+    def handle_intent_result(self, intent, job):
+        ticker = intent['ticker']
+        kind = intent['kind']
+        price = intent['price']
+        success = job['success']
+        follow_ups = self.risk_engine.on_order_result(intent, success)
 
-        try:
-            response = requests.post(self.api_url, json=update_order)
-            response.raise_for_status()
-            
-            response_data = response.json()
-            if response_data.get("success"):
-                self.update_response_area(f"Updated trailing stop for {ticker}. Signal price: {signal_price}, Trail amount: {trail_amount}, Remaining quantity: {remaining_quantity}\n")
-                order['stop_loss'] = {
-                    "type": "trailing_stop",
-                    "trailAmount": trail_amount,
-                    "signalPrice": signal_price
-                }
-                self.save_active_orders()
+        if kind == 'stop_loss':
+            if success:
+                self.update_response_area(f"Stop loss hit for {ticker} at price {price:.2f}. Exit order sent.\n")
             else:
-                self.update_response_area(f"Error updating trailing stop: {response_data}\n")
-        except requests.RequestException as e:
-            self.update_response_area(f"Error updating trailing stop: {str(e)}\n")
+                self.update_response_area(f"Error sending exit order for stop loss: {self.order_failure_reason(job)}\n", level="ERROR")
+            self.clear_trade(ticker)
+            return
+        elif kind == 'take_profit':
+            if success:
+                self.update_response_area(f"Exit order sent for TP: {ticker}, Quantity: {intent['quantity']}, Price: {intent['tps'][-1]['price']:.2f}\n")
+                if intent.get('remaining_quantity', 1) <= 0:
+                    self.update_response_area(f"Order for {ticker} fully closed and removed from active orders.\n")
+            else:
+                self.update_response_area(f"Error sending exit order for TP: {self.order_failure_reason(job)}\n", level="ERROR")
+        elif kind == 'trailing_stop':
+            if success:
+                self.update_response_area(f"Updated trailing stop for {ticker}. Signal price: {price}, Trail amount: {intent['trail_amount']}, Remaining quantity: {intent['remaining_quantity']}\n")
+            else:
+                self.update_response_area(f"Error updating trailing stop: {self.order_failure_reason(job)}\n", level="ERROR")
+        elif kind in ('timer_exit', 'reverse_exit'):
+            if success:
+                self.update_response_area(f"Exit order sent successfully for {intent['order']['ticker']}!\n")
+                self.update_response_area(f"Removed order for {ticker} from active orders.\n")
+            else:
+                self.update_response_area(f"Error sending exit order for {ticker}: {self.order_failure_reason(job)}\n", level="ERROR")
+        elif kind == 'reverse_entry':
+            if success:
+                stop_loss_info = intent['stop_loss']
+                if ticker == self.ticker_combo.currentText():
+                    self.start_trade_timer()  # Restart the timer for the new trade
+                self.update_response_area(f"Reversed trade for {ticker}. New action: {intent['action']}, Entry price: {price}\n")
+                self.update_response_area(f"Adjusted TP levels for reversed trade on {ticker}.\n")
+                self.update_response_area(f"Stop loss set: {stop_loss_info['type']} @ {stop_loss_info.get('stopPrice', stop_loss_info.get('trailAmount')):.2f}\n")
+            else:
+                self.update_response_area(f"Failed to reverse trade for {ticker}. Error: {self.order_failure_reason(job)}\n", level="ERROR")
 
+        self.save_active_orders()
+        self.sync_quote_subscription()  # Exits and reversals may have closed the position
+        self.update_trade_status()
+        self.update_tp_table()
+        self.update_tp_quantity_max()
+        self.update_stop_loss_display(ticker)
+        self.dispatch_intents(follow_ups)
 
 
     def remove_tp_level(self):
@@ -1819,54 +2280,27 @@ class TradingApp(QMainWindow):
 
 
     def check_and_update_tp_levels(self, ticker, current_price):
-        if ticker not in self.tp_levels or ticker not in self.active_orders:
-            return
-
-        order = self.active_orders[ticker]
-        action = order['action']
-        entry_price = order['entry_price']
-
-        for tp in self.tp_levels[ticker]:
-            if tp['enabled'] and not tp['hit']:
-                tp_price = tp['price']
-                
-                if (action == 'buy' and current_price >= tp_price) or \
-                   (action == 'sell' and current_price <= tp_price):
-                    tp['hit'] = True
-                    self.execute_tp_order(ticker, tp)
-                else:
-                    print(f"TP for {ticker} not hit: Current price {current_price}, TP price {tp_price}, Entry price {entry_price}")
-
+        self.dispatch_intents(self.risk_engine.check_tp_levels(ticker, current_price))
         self.update_tp_table()
 
 
-    def handle_databento_data(self, subscription_id, message):
+    def handle_databento_data(self, subscription_id, tick):
         try:
-            if isinstance(message, db.SystemMsg):
-                # Handle system messages (like Heartbeat)
-                print(f"Received system message: {message.msg}")
-                return  # Skip further processing for system messages
-
+            trace = None
             if subscription_id == "historical":
-                ticker = self.ticker_combo.currentText()
-                if hasattr(message, 'close'):
-                    price = message.close / 1000000000  # Adjust scale factor if needed
-                else:
-                    print(f"Unexpected message format: {message}")
-                    return
+                ticker = self.replay_ticker  # Fixed when the replay started, whatever the combo shows now
             else:
-                if hasattr(message, 'instrument_id'):
-                    instrument_id = message.instrument_id
-                    symbol = self.instrument_id_map.get(instrument_id)
-                    ticker = next((key for key, value in self.symbol_map.items() if value == symbol), None)
-                    if hasattr(message, 'close'):
-                        price = message.close / 1000000000  # Adjust scale factor if needed
-                    else:
-                        print(f"Unexpected message format: {message}")
-                        return
-                else:
-                    print(f"Unexpected message format: {message}")
-                    return
+                tickers = self.feed_tickers.get(subscription_id, [])
+                ticker = tickers[tick.ticker_index] if tick.ticker_index < len(tickers) else None
+                trace = self.latency_tracker.trace_record(tick, tick.received_ns, self.feed_bar_interval_ns)
+                if ticker and subscription_id == "main":
+                    self.update_atr_bar(ticker, tick)
+                    if self.has_fresh_quotes(ticker):
+                        return  # Price and risk come from the top-of-book feed while it keeps up
+                elif ticker and subscription_id == self.quote_subscription:
+                    self.quote_last_seen[ticker] = time.monotonic()
+            price = tick.close / 1000000000  # Adjust scale factor if needed
+            bar = (tick.open / 1000000000, tick.high / 1000000000, tick.low / 1000000000, price)
 
             if ticker:
                 self.current_prices[ticker] = price
@@ -1874,53 +2308,31 @@ class TradingApp(QMainWindow):
                     self.price_input.setText(f"{price:.2f}")
                     self.update_tp_table()
 
-                    # Check and update stop loss
-                    if ticker in self.active_orders:
-                        if self.check_stop_loss(ticker, price):
-                            # Stop loss hit, send exit order
-                            exit_order = {
-                                "ticker": self.ticker_map.get(ticker, ticker),
-                                "action": "exit",
-                                "orderType": "market",
-                            }
-                            try:
-                                response = requests.post(self.api_url, json=exit_order)
-                                response.raise_for_status()
-                                
-                                response_data = response.json()
-                                if response_data.get("success"):
-                                    self.update_response_area(f"Stop loss hit for {ticker} at price {price:.2f}. Exit order sent.\n")
-                                    del self.active_orders[ticker]
-                                    self.save_active_orders()
-                                    self.update_trade_status()
-                                    self.update_tp_table()
-                                else:
-                                    self.update_response_area(f"Error sending exit order for stop loss: {response_data}\n")
-                            except requests.RequestException as e:
-                                self.update_response_area(f"Error sending exit order for stop loss: {str(e)}\n")
-                            self.clear_trade(ticker)
-                        else:
-                            self.update_stop_loss_display(ticker)
-                    
-                    # Check and execute TPs
-                    if ticker in self.tp_levels:
-                        for tp in self.tp_levels[ticker]:
-                            if tp['enabled'] and not tp['hit']:
-                                if ticker in self.active_orders:
-                                    action = self.active_orders[ticker]['action']
-                                    if (action == 'buy' and price >= tp['price']) or \
-                                    (action == 'sell' and price <= tp['price']):
-                                        tp['hit'] = True
-                                        self.execute_tp_order(ticker, tp)
-                                        self.update_tp_table()
-                
-                self.update_tp_table()  # Update again after potential TP executions
+                # Risk runs for every open position, whichever ticker the UI is showing
+                self.evaluate_risk(ticker, price, trace, bar)
                         
         except Exception as e:
             print(f"Error processing data: {type(e).__name__}: {str(e)}")
-            print(f"Message: {message}")
+            print(f"Tick: {tick}")
 
 
+    def drain_ticks(self):
+        # One wake-up handles every ticker's newest tick, however many arrived while the GUI was busy
+        for (subscription_id, _), tick in self.tick_buffer.take():
+            self.handle_databento_data(subscription_id, tick)
+
+    def evaluate_risk(self, ticker, price, trace=None, bar=None):
+        # The engine decides; the GUI only sends the resulting orders and refreshes itself.
+        # With bar=(open, high, low, close) the bar's high and low are checked too, not just its close.
+        if bar is not None:
+            intents = self.risk_engine.on_bar(ticker, *bar)
+        else:
+            intents = self.risk_engine.on_tick(ticker, price)
+        if intents:
+            self.dispatch_intents(intents, trace)
+        elif ticker in self.active_orders:
+            self.update_stop_loss_display(ticker)
+
     def toggle_archive(self, state):
         if state:
             if not self.archive_key:
@@ -1929,7 +2341,9 @@ class TradingApp(QMainWindow):
                 return
 
             if not self.archive_worker:
-                self.archive_worker = ArchiveWorker(self.archive_key)
+                self.archive_worker = ArchiveWorker(self.archive_key, flush_policy=self.archive_flush_policy,
+                                                    flush_records=self.archive_flush_records,
+                                                    flush_interval_ms=self.archive_flush_interval_ms)
                 self.archive_worker.error_signal.connect(self.handle_archive_error)
             
             self.archive_worker.start()
@@ -1942,19 +2356,31 @@ class TradingApp(QMainWindow):
             self.update_response_area("OHLCV-1m archiving stopped.\n")
 
     def handle_archive_error(self, error_msg):
-        self.update_response_area(f"Archive error: {error_msg}\n")
+        self.update_response_area(f"Archive error: {error_msg}\n", level="ERROR")
 
     def open_settings(self):
-        dialog = SettingsDialog(self, self.api_url, self.databento_key, self.archive_key, self.atr_period, self.atr_lookback)
+        dialog = SettingsDialog(self, self.api_url, self.databento_key, self.archive_key, self.atr_period, self.atr_lookback,
+                                self.archive_flush_policy, self.archive_flush_records, self.archive_flush_interval_ms,
+                                self.feed_mode)
         if dialog.exec_() == QDialog.Accepted:
-            self.api_url, self.databento_key, self.archive_key, self.atr_period, self.atr_lookback = dialog.get_settings()
+            (self.api_url, self.databento_key, self.archive_key, self.atr_period, self.atr_lookback,
+             self.archive_flush_policy, self.archive_flush_records, self.archive_flush_interval_ms,
+             self.feed_mode) = dialog.get_settings()
+            self.order_dispatcher.set_api_url(self.api_url)  # Re-warm the pool for the new endpoint
+            self.atr_engines.clear()  # Re-seed with the new period/lookback on next use
             self.save_settings()
             self.update_response_area(f"Settings updated:\nWebhook URL: {self.api_url}\n"
                                       f"Databento API Key: {'*' * len(self.databento_key)}\n"
                                       f"Archive Key: {'*' * len(self.archive_key)}\n"
                                       f"ATR Period: {self.atr_period}\n"
-                                      f"ATR Lookback: {self.atr_lookback} minutes\n")
-            self.initialize_databento_worker()
+                                      f"ATR Lookback: {self.atr_lookback} minutes\n"
+                                      f"Archive Flush Policy: {self.archive_flush_policy}\n"
+                                      f"Position Feed Mode: {self.feed_mode}\n")
+            self.update_atr()
+            if self.replay_worker is not None:
+                self.resume_live_after_replay = True  # Reconnect with the new settings once the replay ends
+            else:
+                self.initialize_databento_worker()
 
 
     def load_settings(self):
@@ -1967,6 +2393,12 @@ class TradingApp(QMainWindow):
                     self.archive_key = settings.get('archive_key', "")
                     self.atr_period = settings.get('atr_period', 14)
                     self.atr_lookback = settings.get('atr_lookback', 390)
+                    self.archive_flush_policy = settings.get('archive_flush_policy', "bar_close")
+                    self.archive_flush_records = settings.get('archive_flush_records', 500)
+                    self.archive_flush_interval_ms = settings.get('archive_flush_interval_ms', 1000)
+                    self.log_level = settings.get('log_level', "INFO")
+                    self.log_max_lines = settings.get('log_max_lines', 2000)
+                    self.feed_mode = settings.get('feed_mode', "ohlcv-1s")
                 print(f"Loaded settings: API URL: {self.api_url}, Databento Key: {'*' * len(self.databento_key)}, Archive Key: {'*' * len(self.archive_key)}")
             except json.JSONDecodeError:
                 print("Error loading settings.json. Using default settings.")
@@ -1982,6 +2414,12 @@ class TradingApp(QMainWindow):
         self.archive_key = ""
         self.atr_period = 14
         self.atr_lookback = 390
+        self.archive_flush_policy = "bar_close"
+        self.archive_flush_records = 500
+        self.archive_flush_interval_ms = 1000
+        self.log_level = "INFO"
+        self.log_max_lines = 2000
+        self.feed_mode = "ohlcv-1s"
 
     def save_settings(self):
         settings = {
@@ -1989,7 +2427,13 @@ class TradingApp(QMainWindow):
             'databento_key': self.databento_key,
             'archive_key': self.archive_key,
             'atr_period': self.atr_period,
-            'atr_lookback': self.atr_lookback
+            'atr_lookback': self.atr_lookback,
+            'archive_flush_policy': self.archive_flush_policy,
+            'archive_flush_records': self.archive_flush_records,
+            'archive_flush_interval_ms': self.archive_flush_interval_ms,
+            'log_level': self.log_level,
+            'log_max_lines': self.log_max_lines,
+            'feed_mode': self.feed_mode
         }
         with open('settings.json', 'w') as f:
             json.dump(settings, f, indent=2)
@@ -2073,6 +2517,8 @@ class TradingApp(QMainWindow):
     def update_stop_loss_display(self, ticker=None):
         if ticker is None:
             ticker = self.ticker_combo.currentText()
+        elif ticker != self.ticker_combo.currentText():
+            return  # The label only ever shows the selected ticker
         
         if ticker in self.active_orders:
             order = self.active_orders[ticker]
@@ -2093,7 +2539,7 @@ class TradingApp(QMainWindow):
                 elif stop_type == 'trail_after_1st_tp':
                     initial_stop_price = stop_loss['initialStopPrice']
                     trail_amount = stop_loss['trailAmount']
-                    if not self.first_tp_hit:
+                    if ticker not in self.risk_engine.first_tp_hit_tickers:
                         self.stop_loss_price_label.setText(f"SL @: {initial_stop_price:.2f} (Trail @ TP)")
                     else:
                         stop_price = stop_loss.get('stopPrice', initial_stop_price)
@@ -2140,7 +2586,7 @@ class TradingApp(QMainWindow):
             quantity = self.quantity_input.value()
             stop_loss_amount = float(self.stop_loss_input.text())
         except ValueError:
-            self.update_response_area("Error: Invalid input for price or stop loss.\n")
+            self.update_response_area("Error: Invalid input for price or stop loss.\n", level="ERROR")
             return
         
         order = {
@@ -2186,70 +2632,55 @@ class TradingApp(QMainWindow):
             
             order["stopLoss"] = broker_stop_loss
         
-        response_text = self.send_order_to_server(order)
-        
-        if "success" in response_text.lower():
+        if action == "exit":
+            self.pending_exits.add(ticker)
+
+        def on_completed(job, response_text):
             if action == "exit":
-                if ticker in self.active_orders:
-                    del self.active_orders[ticker]
-                    self.save_active_orders()
-                    response_text += f"Removed order for {ticker} from active orders.\n"
-            else:  # buy or sell
-                stop_loss_info = {**broker_stop_loss, **local_stop_loss_info}
-                if ticker in self.active_orders:
-                    # Updating existing order
-                    existing_order = self.active_orders[ticker]
-                    new_quantity = existing_order['quantity'] + quantity
-                    weighted_entry_price = (existing_order['entry_price'] * existing_order['quantity'] + current_price * quantity) / new_quantity
-                    
-                    self.active_orders[ticker].update({
-                        "quantity": new_quantity,
-                        "entry_price": weighted_entry_price,
-                        "timestamp": int(time.time()),
-                        "stop_loss": stop_loss_info  # Update stop loss info
-                    })
+                self.pending_exits.discard(ticker)
+
+            if job['success']:
+                if action == "exit":
+                    if ticker in self.active_orders:
+                        self.risk_engine.close_position(ticker)
+                        self.save_active_orders()
+                        response_text += f"Removed order for {ticker} from active orders.\n"
+                else:  # buy or sell
+                    stop_loss_info = {**broker_stop_loss, **local_stop_loss_info}
+                    is_update = ticker in self.active_orders
+                    position = self.risk_engine.open_position(ticker, action, quantity, current_price, stop_loss_info)
+                    if is_update:
+                        response_text += f"Updated existing {action} position for {symbol}.\n"
+                        response_text += f"New Total Quantity: {position['quantity']}\n"
+                        response_text += f"New Weighted Entry Price: {position['entry_price']:.2f}\n"
+                    else:
+                        response_text += f"New {action} position opened for {symbol}.\n"
                     
-                    response_text += f"Updated existing {action} position for {symbol}.\n"
-                    response_text += f"New Total Quantity: {new_quantity}\n"
-                    response_text += f"New Weighted Entry Price: {weighted_entry_price:.2f}\n"
-                else:
-                    # New order
-                    self.active_orders[ticker] = {
-                        "symbol": ticker,
-                        "action": action,
-                        "quantity": quantity,
-                        "entry_price": current_price,
-                        "timestamp": int(time.time()),
-                        "stop_loss": stop_loss_info  # Store stop loss info
-                    }
-                    response_text += f"New {action} position opened for {symbol}.\n"
+                    self.save_active_orders()
+                    self.adjust_tp_levels(ticker, current_price, action)
                 
-                self.save_active_orders()
-                self.adjust_tp_levels(ticker, current_price, action)
+                self.sync_quote_subscription()  # The position opened or closed; top of book follows open positions
+                self.update_trade_status()
+                self.update_tp_table()
+                self.update_stop_loss_display(ticker)
             
-            self.update_trade_status()
-            self.update_tp_table()
-            self.update_stop_loss_display(ticker)
-        
-        # Add stop loss details to the response text
-        if "stopLoss" in order:
-            sl_info = order["stopLoss"]
-            if sl_info["type"] == "trailing_stop":
-                response_text += f"Stop Loss: Trailing @ {sl_info['trailAmount']:.2f}\n"
-            elif stop_loss_type == "Trail after 1st TP":
-                response_text += f"Stop Loss: Trail after 1st TP, Initial @ {broker_stop_loss['stopPrice']:.2f}, Trail Amount: {local_stop_loss_info['trailAmount']:.2f}\n"
-            else:
-                response_text += f"Stop Loss: {sl_info['type'].capitalize()} @ {sl_info['stopPrice']:.2f}\n"
-        
-        self.update_response_area(response_text) 
-
-    def send_order_to_server(self, order):
-        try:
-            response = requests.post(self.api_url, json=order)
-            response.raise_for_status()
+            # Add stop loss details to the response text
+            if "stopLoss" in order:
+                sl_info = order["stopLoss"]
+                if sl_info["type"] == "trailing_stop":
+                    response_text += f"Stop Loss: Trailing @ {sl_info['trailAmount']:.2f}\n"
+                elif stop_loss_type == "Trail after 1st TP":
+                    response_text += f"Stop Loss: Trail after 1st TP, Initial @ {broker_stop_loss['stopPrice']:.2f}, Trail Amount: {local_stop_loss_info['trailAmount']:.2f}\n"
+                else:
+                    response_text += f"Stop Loss: {sl_info['type'].capitalize()} @ {sl_info['stopPrice']:.2f}\n"
             
-            response_data = response.json()
-            if response_data.get("success"):
+            self.update_response_area(response_text, level="INFO" if job['success'] else "ERROR")
+
+        self.send_order_to_server(order, on_completed, kind=action)
+
+    def send_order_to_server(self, order, callback, kind="order"):
+        def on_completed(job):
+            if job['success']:
                 response_text = f"{order['action'].capitalize()} order sent successfully for {order['ticker']}!\n"
                 response_text += f"Quantity: {order['quantity']}\n"
                 response_text += f"Price: {order['limitPrice']:.2f}\n"
@@ -2259,13 +2690,14 @@ class TradingApp(QMainWindow):
                         response_text += f"Stop Loss: Trailing {sl_info['trailAmount']:.2f}\n"
                     else:
                         response_text += f"Stop Loss: {sl_info['type'].capitalize()} @ {sl_info['stopPrice']:.2f}\n"
+            elif job['error']:
+                response_text = f"Error sending {order['action']} order for {order['ticker']}: {job['error']}\n"
             else:
                 response_text = f"Error sending {order['action']} order for {order['ticker']}: Unsuccessful response from server\n"
-                response_text += f"Response: {json.dumps(response_data, indent=2)}\n"
-            
-            return response_text
-        except requests.RequestException as e:
-            return f"Error sending {order['action']} order for {order['ticker']}: {str(e)}\n" 
+                response_text += f"Response: {json.dumps(job['response'], indent=2)}\n"
+            callback(job, response_text)
+
+        return self.dispatch_order(order, kind, on_completed)
     
     # def send_order(self, action):
     #     ticker = self.ticker_combo.currentText()
@@ -2521,62 +2953,133 @@ class TradingApp(QMainWindow):
 
  
 
-    def update_response_area(self, text):
-        self.response_area.append(text)
-        self.response_area.verticalScrollBar().setValue(
-            self.response_area.verticalScrollBar().maximum()
-        )
+    def update_response_area(self, text, level="INFO"):
+        self.response_log.log(text, level)
+
+    def set_log_level(self, level):
+        self.log_level = level  # Saved with the other settings on exit
+
 
+    def monitored_tickers(self):
+        # Every ticker in the current contract type plus any ticker that still has an open position
+        tickers = list(self.symbol_map)
+        tickers += [ticker for ticker in self.active_orders if ticker not in self.symbol_map and ticker in self.all_symbol_map]
+        return tickers
 
     def initialize_databento_worker(self):
         if self.databento_worker:
             self.stop_databento_worker()
 
         try:
-            current_ticker = self.ticker_combo.currentText()
-            symbol = self.symbol_map.get(current_ticker)
+            tickers = self.monitored_tickers()
+            symbols = [self.all_symbol_map[ticker] for ticker in tickers]
             
-            if not symbol:
-                raise ValueError(f"No symbol mapping found for ticker: {current_ticker}")
+            if not symbols:
+                raise ValueError(f"No symbol mappings found for tickers: {tickers}")
 
-            self.databento_worker = DatabentoWorker(key=self.databento_key, is_replay=self.is_replay_mode)
+            self.tick_buffer.clear()
+            self.databento_worker = DatabentoWorker(key=self.databento_key, is_replay=self.is_replay_mode, tick_buffer=self.tick_buffer)
+            self.feed_tickers = {"main": tickers}  # Tick.ticker_index -> ticker, in subscription symbol order
             self.databento_worker.add_subscription(
                 subscription_id="main",
                 dataset="GLBX.MDP3",
                 schema="ohlcv-1s",
                 stype_in="continuous",
-                symbols=[symbol]
+                symbols=symbols
             )
             
-            self.databento_worker.data_received.connect(self.handle_databento_data)
+            self.databento_worker.ticks_ready.connect(self.drain_ticks)
             self.databento_worker.symbol_mapped.connect(self.handle_symbol_mapping)
             self.databento_worker.connection_error.connect(self.handle_databento_error)
             self.databento_worker.start()
             
             self.is_databento_initialized = True
-            self.update_response_area(f"Databento worker initialized for {current_ticker}. Starting to receive price updates.\n")
+            self.update_response_area(f"Databento worker initialized for {', '.join(tickers)}. Starting to receive price updates.\n")
+            self.sync_quote_subscription(force=True)
         except Exception as e:
-            self.update_response_area(f"Error initializing Databento worker: {str(e)}\n")
+            self.update_response_area(f"Error initializing Databento worker: {str(e)}\n", level="ERROR")
             self.databento_worker = None
             self.is_databento_initialized = False
 
     def handle_databento_error(self, error_msg):
-        self.update_response_area(f"{error_msg}\n")
+        self.update_response_area(f"{error_msg}\n", level="ERROR")
         self.update_response_area("Attempting to reconnect in 30 seconds...\n")
         self.databento_reconnect_timer.start(30000)  # 30 seconds
 
+    def quote_tickers(self):
+        # Tickers priced from the top of book: the ones with an open position, if the feed mode asks for it
+        if self.feed_mode not in ("mbp-1", "tbbo") or not self.is_databento_initialized or self.is_replay_mode:
+            return []
+        return sorted(ticker for ticker in self.active_orders if ticker in self.all_symbol_map)
+
+    def has_fresh_quotes(self, ticker):
+        # The 1 s bars keep pricing a ticker until its top-of-book session delivers, and take over again
+        # if that session goes quiet (reconnecting, or out of retries)
+        last_seen = self.quote_last_seen.get(ticker)
+        return last_seen is not None and time.monotonic() - last_seen < self.quote_stale_after
+
+    def sync_quote_subscription(self, force=False):
+        # A live session can't drop symbols, so a changed set of positions gets a fresh top-of-book connection.
+        # The ohlcv-1s feed keeps running for every ticker (ATR still needs its bars).
+        tickers = self.quote_tickers()
+        if not force and tickers == self.feed_tickers.get(self.quote_subscription, []):
+            return
+        self.stop_quote_worker()
+        if not tickers:
+            return
+
+        # Each session gets its own subscription id, so late ticks from the one being replaced are ignored
+        self.quote_sessions += 1
+        self.quote_subscription = f"positions-{self.quote_sessions}"
+        self.quote_worker = DatabentoWorker(key=self.databento_key, tick_buffer=self.tick_buffer)
+        self.quote_worker.add_subscription(
+            subscription_id=self.quote_subscription,
+            dataset="GLBX.MDP3",
+            schema=self.feed_mode,
+            stype_in="continuous",
+            symbols=[self.all_symbol_map[ticker] for ticker in tickers]
+        )
+        self.feed_tickers[self.quote_subscription] = tickers
+        self.quote_worker.ticks_ready.connect(self.drain_ticks)
+        self.quote_worker.connection_error.connect(lambda error_msg: self.update_response_area(f"Top-of-book feed: {error_msg}\n", level="ERROR"))
+        self.quote_worker.start()
+        self.update_response_area(f"Pricing {', '.join(tickers)} from {self.feed_mode}.\n")
+
+    def stop_quote_worker(self):
+        # Called from order callbacks, so the old session is not waited for on the GUI thread
+        if self.quote_worker:
+            self.retire_worker(self.quote_worker)
+            self.quote_worker = None
+        if self.quote_subscription:
+            self.feed_tickers.pop(self.quote_subscription, None)
+            self.tick_buffer.discard(self.quote_subscription)  # Indexes of the old subscription mean nothing now
+            self.quote_subscription = None
+        self.quote_last_seen = {}  # Bars price every ticker until the next session delivers
+
+    def retire_worker(self, worker):
+        self.prune_retired_workers()  # Any whose thread was still winding down when it signalled finished
+        worker.stop()
+        if worker.isRunning():
+            self.retired_workers.append(worker)
+            worker.finished.connect(self.prune_retired_workers)  # Delivered on the GUI thread
+
+    def prune_retired_workers(self):
+        self.retired_workers = [worker for worker in self.retired_workers if worker.isRunning()]
+
     def stop_databento_worker(self):
+        self.stop_quote_worker()
         if self.databento_worker:
             self.databento_worker.stop()
             self.databento_worker.wait()
             self.databento_worker = None
+        self.tick_buffer.clear()
         self.is_databento_initialized = False
         self.databento_reconnect_timer.stop()
         self.update_response_area("Databento connection stopped. Price updates disabled.\n")
 
 
 
-    def initialize_historical_data(self, start_datetime, end_datetime):
+    def initialize_historical_data(self, start_datetime, end_datetime, speed=1, file_path=None):
         try:
             current_ticker = self.ticker_combo.currentText()
             symbol = self.symbol_map.get(current_ticker)
@@ -2584,60 +3087,92 @@ class TradingApp(QMainWindow):
             if not symbol:
                 raise ValueError(f"No symbol mapping found for ticker: {current_ticker}")
 
-            client = db.Historical(self.databento_key)
-            
-            data = client.timeseries.get_range(
-                dataset="GLBX.MDP3",
-                symbols=[symbol],
-                schema="ohlcv-1s",
-                stype_in="continuous",
-                start=start_datetime,
-                end=end_datetime,
-                limit=100  # Adjust this value as needed
-            )
-            
-            self.historical_data = list(data)  # Convert iterator to list
-            self.historical_data_index = 0
-            self.update_response_area(f"Historical data loaded for {current_ticker} from {start_datetime} to {end_datetime}. {len(self.historical_data)} records loaded.\n")
-            
-            # Start the historical data playback
-            self.start_historical_playback()
+            self.stop_replay(resume_live=False)
+            # The replay shares the book with live trading, so it only runs while no real position is open
+            if self.active_orders:
+                raise ValueError(f"Close the open positions first ({', '.join(sorted(self.active_orders))})")
+
+            # Live prices would interleave with the replay, so pause them until the replay ends
+            if self.databento_worker:
+                self.resume_live_after_replay = True
+                self.stop_databento_worker()
+            self.pre_replay_tp_levels = copy.deepcopy(self.tp_levels)
+            self.replay_ticker = current_ticker
+
+            if file_path:
+                self.replay_worker = ReplayWorker(file_path=file_path, symbol=symbol, speed=speed)
+                source = file_path
+            else:
+                self.replay_worker = ReplayWorker(key=self.databento_key, symbol=symbol, start=start_datetime,
+                                                  end=end_datetime, speed=speed, cache=self.dbn_cache)
+                source = f"{start_datetime} to {end_datetime}"
+            self.replay_worker.record_ready.connect(self.handle_replay_record)
+            self.replay_worker.finished_signal.connect(self.handle_replay_finished)
+            self.replay_worker.error_signal.connect(self.handle_replay_finished)
+            self.replay_worker.start()
+
+            speed_text = f"{speed}x" if speed else "maximum speed"
+            self.update_response_area(f"Replaying {current_ticker} from {source} at {speed_text}. Orders are simulated and not sent to the webhook.\n")
+            return True
         except Exception as e:
-            self.update_response_area(f"Error loading historical data: {str(e)}\n")
+            self.update_response_area(f"Error loading historical data: {str(e)}\n", level="ERROR")
+            self.stop_replay()
+            return False
 
+    def handle_replay_record(self, tick):
+        if self.replay_worker is None:
+            return  # Queued before the replay was stopped
+        try:
+            self.replay_clock = tick.ts_event / 1e9
+            self.handle_databento_data("historical", tick)
+            # Drive the timers from replayed time rather than waiting for the 1 s wall-clock tick
+            if self.trade_start_time is not None:
+                self.update_trade_timer()
+            self.check_position_timers()
+        finally:
+            if self.replay_worker:
+                self.replay_worker.record_handled()
+
+    def handle_replay_finished(self, message):
+        level = "ERROR" if message.startswith("Error") else "INFO"
+        self.update_response_area(f"{message}\n", level=level)
+        self.update_response_area("Simulated trades are kept until Replay Mode is switched off.\n")
+
+    def stop_replay(self, resume_live=True):
+        if self.replay_worker:
+            self.replay_worker.stop()
+            self.replay_worker.wait(msecs=5000)
+            self.replay_worker = None
+            self.discard_simulated_trades()
+        self.pre_replay_tp_levels = None
+        self.replay_ticker = None
+        self.replay_clock = None
+        if resume_live and self.resume_live_after_replay:
+            self.resume_live_after_replay = False
+            self.initialize_databento_worker()
 
-    def process_historical_data(self, data):
-        for record in data:
-            # Process each record similar to how you handle live data
-            self.handle_databento_data("historical", record)
-        
-        self.update_response_area("Finished processing historical data.\n")
-    
-    def start_historical_playback(self):
-        self.historical_timer = QTimer(self)
-        self.historical_timer.timeout.connect(self.play_next_historical_data)
-        self.historical_timer.start(1000)  # Update every 1000 ms (1 second)
-
-    def play_next_historical_data(self):
-        while self.historical_data_index < len(self.historical_data):
-            record = self.historical_data[self.historical_data_index]
-            self.historical_data_index += 1
-            
-            if not isinstance(record, db.SystemMsg):
-                self.handle_databento_data("historical", record)
-                break
-        else:
-            self.historical_timer.stop()
-            self.update_response_area("Historical data playback completed.\n")
+    def discard_simulated_trades(self):
+        # Puts the book back the way it was before the replay: no positions, the saved TP ladders.
+        # Simulated orders still queued must not fill into the live book once they complete.
+        for order_id in self.simulated_order_ids:
+            self.order_callbacks.pop(order_id, None)
+        self.simulated_order_ids.clear()
+        self.active_orders = {}
+        if self.pre_replay_tp_levels is not None:
+            self.tp_levels = self.pre_replay_tp_levels
+            self.pre_replay_tp_levels = None
+        self.risk_engine.pending_exits.clear()
+        self.risk_engine.first_tp_hit_tickers.clear()
+        self.risk_engine.timer_notified.clear()
+        self.update_trade_status()
+        self.update_tp_table()
+        self.update_stop_loss_display(self.ticker_combo.currentText())
 
 
     def handle_symbol_mapping(self, subscription_id, message):
+        # Records are routed to tickers inside DatabentoWorker; the mapping is only logged here
         if subscription_id == "main":
-            instrument_id = message.instrument_id
-            continuous_symbol = message.stype_in_symbol
-            raw_symbol = message.stype_out_symbol
-            self.instrument_id_map[instrument_id] = continuous_symbol
-            print(f"Symbol Mapping: {continuous_symbol} ({raw_symbol}) has an instrument ID of {instrument_id}")
+            print(f"Symbol Mapping: {message.stype_in_symbol} ({message.stype_out_symbol}) has an instrument ID of {message.instrument_id}")
 
     
     def toggle_price_updates(self, state):
@@ -2662,6 +3197,8 @@ class TradingApp(QMainWindow):
                             tp['price'] = entry_price + tp['target']
                         else:
                             tp['price'] = entry_price - tp['target']
+            self.risk_engine.invalidate_tp_index(current_ticker)  # Prices moved; re-sort the trigger index
+            self.save_active_orders()
             self.update_tp_table()
 
     def monitor_tp_levels(self, ticker):
@@ -2676,13 +3213,14 @@ class TradingApp(QMainWindow):
         self.is_replay_mode = checked
         if checked:
             self.update_response_area("Historical data mode activated. Please configure settings.\n")
-            self.configure_replay_settings()
+            if not self.configure_replay_settings():
+                # Cancelled or failed to start: stay live
+                self.is_replay_mode = False
+                self.replay_mode_action.setChecked(False)
+                self.update_response_area("Replay not started. Staying on live data.\n")
         else:
             self.update_response_area("Historical data mode deactivated. Switching to live data.\n")
-            if hasattr(self, 'historical_timer'):
-                self.historical_timer.stop()
-            if self.is_databento_initialized:
-                self.initialize_databento_worker()
+            self.stop_replay()
  
     def configure_replay_settings(self):
         dialog = QDialog(self)
@@ -2697,6 +3235,33 @@ class TradingApp(QMainWindow):
         end_date.setDisplayFormat("yyyy-MM-dd HH:mm:ss")
         layout.addRow("End Date:", end_date)
 
+        source_combo = QComboBox()
+        source_combo.addItems(["Historical API", "Local DBN file"])
+        layout.addRow("Source:", source_combo)
+
+        file_layout = QHBoxLayout()
+        file_input = QLineEdit()
+        file_input.setEnabled(False)
+        browse_button = QPushButton("Browse...")
+        browse_button.setEnabled(False)
+        browse_button.clicked.connect(lambda: file_input.setText(
+            QFileDialog.getOpenFileName(dialog, "Select DBN file", "databento_archives", "DBN files (*.dbn *.dbn.zst)")[0] or file_input.text()))
+        file_layout.addWidget(file_input)
+        file_layout.addWidget(browse_button)
+        layout.addRow("DBN File:", file_layout)
+
+        def on_source_changed(source):
+            is_file = source == "Local DBN file"
+            file_input.setEnabled(is_file)
+            browse_button.setEnabled(is_file)
+            start_date.setEnabled(not is_file)
+            end_date.setEnabled(not is_file)
+        source_combo.currentTextChanged.connect(on_source_changed)
+
+        speed_combo = QComboBox()
+        speed_combo.addItems(list(REPLAY_SPEEDS))
+        layout.addRow("Speed:", speed_combo)
+
         buttons = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel)
         buttons.accepted.connect(dialog.accept)
         buttons.rejected.connect(dialog.reject)
@@ -2705,7 +3270,9 @@ class TradingApp(QMainWindow):
         if dialog.exec_() == QDialog.Accepted:
             start_datetime = start_date.dateTime().toString("yyyy-MM-ddTHH:mm:ss")
             end_datetime = end_date.dateTime().toString("yyyy-MM-ddTHH:mm:ss")
-            self.initialize_historical_data(start_datetime, end_datetime)
+            file_path = file_input.text() if source_combo.currentText() == "Local DBN file" else None
+            return self.initialize_historical_data(start_datetime, end_datetime, REPLAY_SPEEDS[speed_combo.currentText()], file_path)
+        return False
 
 
 if __name__ == '__main__':
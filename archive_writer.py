@@ -0,0 +1,102 @@
+import os
+import threading
+import time
+
+FLUSH_POLICIES = ["records", "interval", "bar_close"]
+
+
+class BufferedArchiveWriter:
+    # File-like sink for DBN data. Bytes are collected in memory and written out in batches,
+    # and flush_policy decides when a batch is written and fsync'ed:
+    #   "records"   - every flush_records records
+    #   "interval"  - every flush_interval_ms milliseconds
+    #   "bar_close" - whenever a record opens a new bar of bar_interval_ns (i.e. the previous bar closed),
+    #                 or on the next poll() if closed_bars is set (each record is itself a closed bar, e.g. ohlcv-1m)
+    # The buffer is also written out (without fsync) if it grows past max_buffer_bytes.
+    def __init__(self, file_path, flush_policy="records", flush_records=500, flush_interval_ms=1000,
+                 bar_interval_ns=60_000_000_000, max_buffer_bytes=1 << 20, closed_bars=False):
+        if flush_policy not in FLUSH_POLICIES:
+            raise ValueError(f"Unknown flush policy: {flush_policy}. Expected one of {FLUSH_POLICIES}")
+
+        self.file_path = file_path
+        self.flush_policy = flush_policy
+        self.flush_records = flush_records
+        self.flush_interval_ms = flush_interval_ms
+        self.bar_interval_ns = bar_interval_ns
+        self.max_buffer_bytes = max_buffer_bytes
+        self.closed_bars = closed_bars
+
+        # The live client may write from its own thread while we count records from ours
+        self.lock = threading.Lock()
+        self.file = open(file_path, 'ab')
+        self.buffer = bytearray()
+        self.records_since_sync = 0
+        self.last_sync = time.monotonic()
+        self.current_bar = None
+        self.sync_count = 0
+
+    def write(self, data):
+        with self.lock:
+            self.buffer += data
+            if len(self.buffer) >= self.max_buffer_bytes:
+                self._write_buffer()
+        return len(data)
+
+    def record_written(self, ts_event=None):
+        # Call once per record after its bytes went through write() (or after the live stream wrote it)
+        with self.lock:
+            self.records_since_sync += 1
+            if self._sync_due(ts_event):
+                self._sync()
+
+    def poll(self):
+        # Call periodically: records arrive in bursts, and the last batch of a burst would otherwise
+        # wait for the next record before the "interval" or closed-bar "bar_close" policy syncs it
+        with self.lock:
+            if self.flush_policy == "interval" and self.buffer and self._interval_elapsed():
+                self._sync()
+            elif self.flush_policy == "bar_close" and self.closed_bars and self.records_since_sync:
+                self._sync()
+
+    def flush(self):
+        with self.lock:
+            self._write_buffer()
+
+    def close(self):
+        with self.lock:
+            if self.file is None:
+                return
+            self._sync()
+            self.file.close()
+            self.file = None
+
+    def _interval_elapsed(self):
+        return (time.monotonic() - self.last_sync) * 1000 >= self.flush_interval_ms
+
+    def _sync_due(self, ts_event):
+        if self.flush_policy == "records":
+            return self.records_since_sync >= self.flush_records
+        if self.flush_policy == "interval":
+            return self._interval_elapsed()
+
+        # bar_close
+        if ts_event is None:
+            return False
+        bar = ts_event // self.bar_interval_ns
+        bar_closed = self.current_bar is not None and bar != self.current_bar
+        self.current_bar = bar
+        return bar_closed
+
+    def _write_buffer(self):
+        if self.buffer and self.file is not None:
+            self.file.write(self.buffer)
+            self.file.flush()
+            self.buffer.clear()
+
+    def _sync(self):
+        self._write_buffer()
+        if self.file is not None:
+            os.fsync(self.file.fileno())
+        self.records_since_sync = 0
+        self.last_sync = time.monotonic()
+        self.sync_count += 1
@@ -0,0 +1,80 @@
+from collections import deque
+
+MINUTE_NS = 60_000_000_000
+
+
+class IncrementalATR:
+    # Simple moving average of true range over the last `period` 1-minute bars.
+    # Each completed bar is folded in with O(1) work, so nothing has to be re-read from disk.
+    def __init__(self, period):
+        self.period = period
+        self.true_ranges = deque(maxlen=period)
+        self.tr_sum = 0.0
+        self.prev_close = None
+        self.last_bar_ts = None
+        self.bars_since_resum = 0
+
+    def add_bar(self, ts, high, low, close):
+        if self.last_bar_ts is not None and ts <= self.last_bar_ts:
+            return False  # Already counted, e.g. overlap between the archive seed and the live feed
+
+        if self.prev_close is None:
+            true_range = high - low
+        else:
+            true_range = max(high - low, abs(high - self.prev_close), abs(low - self.prev_close))
+
+        if len(self.true_ranges) == self.period:
+            self.tr_sum -= self.true_ranges[0]
+        self.true_ranges.append(true_range)
+        self.tr_sum += true_range
+
+        # Re-add from scratch now and then so float drift in the running sum can't accumulate
+        self.bars_since_resum += 1
+        if self.bars_since_resum >= 1000:
+            self.tr_sum = sum(self.true_ranges)
+            self.bars_since_resum = 0
+
+        self.prev_close = close
+        self.last_bar_ts = ts
+        return True
+
+    @property
+    def ready(self):
+        return len(self.true_ranges) == self.period
+
+    @property
+    def value(self):
+        if not self.ready:
+            return 0
+        return self.tr_sum / self.period
+
+
+class MinuteBarAggregator:
+    # Rolls 1-second bars up into 1-minute bars. add() returns the previous bar once a new minute starts.
+    def __init__(self, interval_ns=MINUTE_NS):
+        self.interval_ns = interval_ns
+        self.bar = None  # [start_ts, open, high, low, close]
+        self.bar_is_partial = False
+        self.first_bar = True
+
+    def add(self, ts, open_price, high, low, close):
+        start = ts - ts % self.interval_ns
+        completed = None
+
+        if self.bar is not None and start != self.bar[0]:
+            # A bar we only saw part of would understate the range
+            if not self.bar_is_partial:
+                completed = tuple(self.bar)
+            self.bar = None
+
+        if self.bar is None:
+            self.bar = [start, open_price, high, low, close]
+            # Only the very first bar can be partial: we may have joined mid-minute
+            self.bar_is_partial = self.first_bar and ts != start
+            self.first_bar = False
+            return completed
+
+        self.bar[2] = max(self.bar[2], high)
+        self.bar[3] = min(self.bar[3], low)
+        self.bar[4] = close
+        return completed
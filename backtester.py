@@ -0,0 +1,238 @@
+import argparse
+
+import numpy as np
+
+from bar_store import BarStore
+
+# Stop rules as the risk engine applies them, keyed by the stop_loss 'type' stored on a position
+STOP_TYPES = {
+    "stop": 0,                # fixed stop at entry -/+ stop amount
+    "stop_limit": 0,          # same trigger as "stop"
+    "trailing_stop": 1,       # ratchets at stop amount behind the best price since entry
+    "trail_after_1st_tp": 2,  # fixed stop until the first TP fills
+}
+
+EXIT_STOP = 0     # stopped out
+EXIT_TARGETS = 1  # the TP ladder closed the whole position
+EXIT_OPEN = 2     # still open at the end of the horizon (marked to the last bar)
+
+
+def load_archive_bars(root, archive_dir="databento_archives", store_dir="bar_store"):
+    # 1-minute bars for one root symbol (e.g. "MES") across the whole archive, oldest first.
+    # Archive files are converted into the bar store first; only new or changed files are decoded.
+    store = BarStore(store_dir, archive_dir)
+    store.update()
+    bars = store.window(root)
+    if len(bars['close']) == 0:
+        raise ValueError(f"No archived bars found for {root} in {archive_dir}")
+    return bars
+
+
+def compute_atr(high, low, close, period):
+    # Simple moving average of true range, matching IncrementalATR; NaN until `period` bars are in
+    prev_close = np.concatenate(([close[0]], close[:-1]))
+    true_range = np.maximum(high - low, np.maximum(np.abs(high - prev_close), np.abs(low - prev_close)))
+    true_range[0] = high[0] - low[0]
+    csum = np.concatenate(([0.0], np.cumsum(true_range)))
+    atr = np.full(len(close), np.nan)
+    if len(close) >= period:
+        atr[period - 1:] = (csum[period:] - csum[:-period]) / period
+    return atr
+
+
+def first_at_least(values, thresholds):
+    # values: (N, H) nondecreasing along H; thresholds: (N, P). First index reaching each threshold, H if never.
+    first = np.empty(thresholds.shape, dtype=np.int64)
+    for row in range(values.shape[0]):
+        first[row] = np.searchsorted(values[row], thresholds[row], side='left')
+    return first
+
+
+def intrabar_path(bars):
+    # Each bar as the four prices RiskEngine.on_bar walks: O->L->H->C for an up bar, O->H->L->C otherwise
+    up = bars['close'] >= bars['open']
+    return np.column_stack((
+        bars['open'],
+        np.where(up, bars['low'], bars['high']),
+        np.where(up, bars['high'], bars['low']),
+        bars['close'],
+    )).ravel()
+
+
+def run_backtest(bars, entry_idx, sides, params, tp_targets, tp_quantities, quantity=1, horizon=390, chunk_size=None,
+                 intrabar=False):
+    # Evaluates every entry against every parameter set in one pass.
+    #   bars          dict of float arrays ('close' is the price the rules see, like the live 1s closes)
+    #   entry_idx     (E,) bar index of each entry; the entry fills at that bar's close
+    #   sides         (E,) +1 for buy, -1 for sell
+    #   params        dict of (P,) arrays: 'stop_type' (STOP_TYPES codes), 'stop_amount', 'trail_amount',
+    #                 optional 'atr_multiplier' (stop amount = ATR at entry * multiplier when not NaN) with 'atr'
+    #                 being a (T,) array in bars
+    #   tp_targets    (K,) or (P, K) distances from entry; NaN disables a level
+    #   tp_quantities (K,) or (P, K)
+    # Rules follow RiskEngine: the stop is checked before TPs on the same bar, several TPs can fill on one bar,
+    # and every TP fill that leaves size open replaces the stop with a trailing stop from entry -/+ trail
+    # (trail = stop amount for trailing_stop positions, trail_amount otherwise).
+    # With intrabar=True each bar's high and low are checked along the path the live feed assumes (see intrabar_path),
+    # otherwise only closes are.
+    # Returns (E, P) arrays: pnl (points x contracts), exit_bar (bars after entry), exit_reason, tp_fills.
+    if intrabar:
+        prices = intrabar_path({field: np.asarray(bars[field], dtype=np.float64) for field in ('open', 'high', 'low', 'close')})
+        points_per_bar = 4
+    else:
+        prices = np.asarray(bars['close'], dtype=np.float64)
+        points_per_bar = 1
+    horizon = horizon * points_per_bar  # From here on, horizon and bar offsets count path points
+    entry_idx = np.asarray(entry_idx, dtype=np.int64)
+    sides = np.asarray(sides, dtype=np.float64)
+    stop_type = np.asarray(params['stop_type'], dtype=np.int64)
+    n_params = len(stop_type)
+    stop_amount = np.broadcast_to(np.asarray(params.get('stop_amount', 0.0), dtype=np.float64), (n_params,))
+    trail_amount = np.broadcast_to(np.asarray(params.get('trail_amount', 0.0), dtype=np.float64), (n_params,))
+    atr_multiplier = params.get('atr_multiplier')
+    targets = np.broadcast_to(np.asarray(tp_targets, dtype=np.float64), (n_params, np.shape(tp_targets)[-1]))
+    targets = np.where(np.isnan(targets), np.inf, np.abs(targets))
+    tp_qty = np.broadcast_to(np.asarray(tp_quantities, dtype=np.float64), targets.shape)
+
+    n_entries = len(entry_idx)
+    if chunk_size is None:
+        chunk_size = max(1, int(4_000_000 // max(1, n_params * horizon)))
+
+    results = {
+        'pnl': np.zeros((n_entries, n_params)),
+        'exit_bar': np.zeros((n_entries, n_params), dtype=np.int64),
+        'exit_reason': np.zeros((n_entries, n_params), dtype=np.int8),
+        'tp_fills': np.zeros((n_entries, n_params), dtype=np.int8),
+    }
+    steps = np.arange(horizon)
+
+    for start in range(0, n_entries, chunk_size):
+        chunk = slice(start, min(start + chunk_size, n_entries))
+        entries = entry_idx[chunk]
+        side = sides[chunk]
+
+        # Favourable move from entry, one row per entry (points past the data repeat the last close)
+        entry_points = entries * points_per_bar + points_per_bar - 1
+        idx = np.minimum(entry_points[:, None] + 1 + steps, len(prices) - 1)
+        move = side[:, None] * (prices[idx] - prices[entry_points][:, None])
+
+        if atr_multiplier is not None:
+            atr_at_entry = np.asarray(params['atr'], dtype=np.float64)[entries]
+            multiplier = np.asarray(atr_multiplier, dtype=np.float64)
+            stop = np.where(np.isnan(multiplier)[None, :], stop_amount[None, :], atr_at_entry[:, None] * multiplier[None, :])
+        else:
+            stop = np.broadcast_to(stop_amount[None, :], (len(entries), n_params))
+
+        best = np.maximum.accumulate(move, axis=1)
+        worst = np.minimum.accumulate(move, axis=1)
+
+        # Point each TP level is first touched
+        tp_bar = first_at_least(best, np.broadcast_to(targets.reshape(1, -1), (len(entries), targets.size)).copy())
+        tp_bar = tp_bar.reshape(len(entries), n_params, -1)
+
+        # Phase 1: the stop the position was opened with
+        fixed_stop_bar = first_at_least(-worst, stop)
+        prev_best = np.maximum(np.concatenate((np.zeros((len(entries), 1)), best[:, :-1]), axis=1), 0.0)
+        drawdown = np.maximum.accumulate(prev_best - move, axis=1)
+        trailing_stop_bar = first_at_least(drawdown, stop)
+        stop1 = np.where(stop_type[None, :] == 1, trailing_stop_bar, fixed_stop_bar)
+
+        # Phase 2: each TP fill re-arms a trailing stop from entry -/+ trail, ratcheting on the bars after the fill.
+        # The fill is only reported once the whole bar has been checked, so the stop in force carries on to the
+        # end of the TP's bar. Between consecutive re-arms the stop only depends on that stretch of points,
+        # so each stretch is checked on its own and the first hit wins.
+        order = np.argsort(tp_bar, axis=2, kind='stable')
+        sorted_bar = np.take_along_axis(tp_bar, order, axis=2)
+        armed = (sorted_bar // points_per_bar + 1) * points_per_bar - 1
+        trail2 = np.where(stop_type[None, :] == 1, stop, trail_amount[None, :])
+        stop2 = np.full(stop1.shape, horizon)
+        for level in range(armed.shape[2]):
+            anchor = armed[:, :, level, None]
+            next_anchor = armed[:, :, level + 1, None] if level + 1 < armed.shape[2] else horizon
+            in_stretch = (steps > anchor) & (steps <= next_anchor)
+            masked = np.where(in_stretch, move[:, None, :], -np.inf)
+            running = np.maximum.accumulate(masked, axis=2)
+            prev_running = np.concatenate((np.full(running.shape[:2] + (1,), -np.inf), running[:, :, :-1]), axis=2)
+            drawdown2 = np.where(in_stretch, np.maximum(prev_running, 0.0) - move[:, None, :], -np.inf)
+            hit2 = drawdown2 >= trail2[:, :, None]
+            stop2 = np.where((stop2 == horizon) & hit2.any(axis=2), hit2.argmax(axis=2), stop2)
+
+        stop_bar = np.where(stop1 <= armed[:, :, 0], stop1, stop2)
+
+        # TP fills happen strictly before the stop bar, in bar order then ladder order, capped at the position size
+        sorted_qty = np.take_along_axis(np.broadcast_to(tp_qty[None], tp_bar.shape), order, axis=2)
+        fills_before_stop = sorted_bar < np.minimum(stop_bar, horizon)[:, :, None]
+        wanted = np.where(fills_before_stop, sorted_qty, 0.0)
+        filled_before = np.cumsum(wanted, axis=2) - wanted
+        filled = np.clip(quantity - filled_before, 0.0, wanted)
+        remaining = quantity - filled.sum(axis=2)
+
+        fill_price = np.take_along_axis(move[:, None, :], np.minimum(sorted_bar, horizon - 1), axis=2)
+        tp_pnl = (filled * fill_price).sum(axis=2)
+
+        closed_by_tp = remaining <= 1e-12
+        close_bar = np.where(filled > 0, sorted_bar, -1).max(axis=2)
+        stopped = ~closed_by_tp & (stop_bar < horizon)
+        exit_bar = np.where(closed_by_tp, close_bar, np.where(stopped, stop_bar, horizon - 1))
+        exit_price = np.take_along_axis(move, exit_bar, axis=1)
+
+        results['pnl'][chunk] = tp_pnl + np.where(closed_by_tp, 0.0, remaining * exit_price)
+        results['exit_bar'][chunk] = exit_bar // points_per_bar + 1
+        results['exit_reason'][chunk] = np.where(closed_by_tp, EXIT_TARGETS, np.where(stopped, EXIT_STOP, EXIT_OPEN))
+        results['tp_fills'][chunk] = (filled > 0).sum(axis=2)
+
+    return results
+
+
+def summarize(results):
+    # Per parameter set: total and mean P&L, win rate and how trades ended
+    pnl = results['pnl']
+    return {
+        'total_pnl': pnl.sum(axis=0),
+        'mean_pnl': pnl.mean(axis=0),
+        'win_rate': (pnl > 0).mean(axis=0),
+        'stopped': (results['exit_reason'] == EXIT_STOP).mean(axis=0),
+        'targets': (results['exit_reason'] == EXIT_TARGETS).mean(axis=0),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Backtest the stop/TP rules over archived 1-minute bars")
+    parser.add_argument("root", help="Root symbol, e.g. MES")
+    parser.add_argument("--archive-dir", default="databento_archives")
+    parser.add_argument("--stop-type", default="trail_after_1st_tp", choices=list(STOP_TYPES))
+    parser.add_argument("--atr-period", type=int, default=14)
+    parser.add_argument("--atr-multipliers", default="1,1.5,2,3", help="Comma separated")
+    parser.add_argument("--trail-amounts", default="5,10,20", help="Comma separated")
+    parser.add_argument("--tp-targets", default="5,10,20", help="Comma separated distances from entry")
+    parser.add_argument("--tp-quantities", default="1,1,1", help="Comma separated")
+    parser.add_argument("--quantity", type=int, default=3)
+    parser.add_argument("--entry-every", type=int, default=15, help="Open a long and a short every N bars")
+    parser.add_argument("--horizon", type=int, default=390, help="Bars to hold before marking to market")
+    parser.add_argument("--intrabar", action="store_true", help="Check each bar's high and low, not just its close")
+    args = parser.parse_args()
+
+    bars = load_archive_bars(args.root, args.archive_dir)
+    atr = compute_atr(bars['high'], bars['low'], bars['close'], args.atr_period)
+    starts = np.arange(args.atr_period, len(bars['close']) - 1, args.entry_every)
+    entry_idx = np.repeat(starts, 2)
+    sides = np.tile([1.0, -1.0], len(starts))
+
+    multipliers = [float(x) for x in args.atr_multipliers.split(',')]
+    trails = [float(x) for x in args.trail_amounts.split(',')]
+    grid = [(m, t) for m in multipliers for t in trails]
+    params = {
+        'stop_type': np.full(len(grid), STOP_TYPES[args.stop_type]),
+        'atr_multiplier': np.array([m for m, _ in grid]),
+        'trail_amount': np.array([t for _, t in grid]),
+        'atr': atr,
+    }
+    results = run_backtest(bars, entry_idx, sides, params,
+                           [float(x) for x in args.tp_targets.split(',')],
+                           [float(x) for x in args.tp_quantities.split(',')],
+                           quantity=args.quantity, horizon=args.horizon, intrabar=args.intrabar)
+    summary = summarize(results)
+    print(f"{len(entry_idx)} entries x {len(grid)} parameter sets over {len(bars['close'])} bars")
+    for i, (m, t) in enumerate(grid):
+        print(f"ATR x{m:<5} trail {t:<6} total {summary['total_pnl'][i]:10.2f}  mean {summary['mean_pnl'][i]:7.2f}  "
+              f"win {summary['win_rate'][i]:.0%}  stopped {summary['stopped'][i]:.0%}  targets {summary['targets'][i]:.0%}")
@@ -0,0 +1,196 @@
+import json
+import os
+import re
+
+import numpy as np
+
+COLUMNS = {
+    'ts': np.int64,  # ts_event in ns
+    'open': np.float64,
+    'high': np.float64,
+    'low': np.float64,
+    'close': np.float64,
+    'volume': np.uint64,
+}
+
+
+class BarStore:
+    # 1-minute bars from databento_archives, converted once into fixed-width column files per root symbol:
+    #   bar_store/<ROOT>/<column>.bin  raw little-endian arrays, read back with np.memmap
+    #   bar_store/<ROOT>/index.json    row count and date -> [first_row, end_row] (UTC dates)
+    #   bar_store/sources.json         size/mtime and first/last bar ts of each archive file already converted
+    # update() only decodes archive files that are new or changed since the last run (today's file grows),
+    # and appends bars newer than the last stored one. Readers get memmap slices, so nothing is copied.
+    def __init__(self, store_dir="bar_store", archive_dir="databento_archives"):
+        self.store_dir = store_dir
+        self.archive_dir = archive_dir
+        self.sources_path = os.path.join(store_dir, "sources.json")
+        os.makedirs(store_dir, exist_ok=True)
+        self.sources = self.load_json(self.sources_path, {})
+        self.indexes = {}  # root -> index dict
+        self.maps = {}  # root -> {column: memmap}
+
+    @staticmethod
+    def load_json(path, default):
+        if os.path.exists(path):
+            try:
+                with open(path, 'r') as f:
+                    return json.load(f)
+            except json.JSONDecodeError as e:
+                print(f"Error loading {path}: {e}. Starting from scratch.")
+        return default
+
+    @staticmethod
+    def save_json(path, data):
+        temp_path = path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(data, f, indent=2)
+        os.replace(temp_path, path)
+
+    @staticmethod
+    def root_symbol(contract_symbol):
+        # MESZ4 -> MES
+        match = re.match(r'([A-Z]+)[A-Z]\d', contract_symbol)
+        return match.group(1) if match else None
+
+    def root_dir(self, root):
+        return os.path.join(self.store_dir, root)
+
+    def index(self, root):
+        if root not in self.indexes:
+            index = self.load_json(os.path.join(self.root_dir(root), "index.json"), {'rows': 0, 'dates': {}})
+            # Column bytes past the committed row count are from an interrupted append
+            for column, dtype in COLUMNS.items():
+                path = os.path.join(self.root_dir(root), f"{column}.bin")
+                committed = index['rows'] * np.dtype(dtype).itemsize
+                if os.path.exists(path) and os.path.getsize(path) > committed:
+                    with open(path, 'r+b') as f:
+                        f.truncate(committed)
+            self.indexes[root] = index
+        return self.indexes[root]
+
+    def files_covering(self, start=None, end=None):
+        # Archive files with bars in [start, end), oldest first
+        return sorted(file_name for file_name, source in self.sources.items()
+                      if 'start' in source
+                      and (end is None or source['start'] < end)
+                      and (start is None or source['end'] > start))
+
+    def roots(self):
+        return sorted(name for name in os.listdir(self.store_dir) if os.path.isdir(self.root_dir(name)))
+
+    # --- Conversion ---
+
+    def update(self):
+        # Converts new or changed archive files. Returns the number of bars appended.
+        if not os.path.isdir(self.archive_dir):
+            return 0
+        import databento as db
+
+        appended = 0
+        for file_name in sorted(os.listdir(self.archive_dir)):
+            if not file_name.endswith('.dbn'):
+                continue
+            path = os.path.join(self.archive_dir, file_name)
+            stat = os.stat(path)
+            source = {'size': stat.st_size, 'mtime': stat.st_mtime}
+            known = self.sources.get(file_name, {})
+            if known.get('size') == source['size'] and known.get('mtime') == source['mtime']:
+                continue
+
+            try:
+                df = db.read_dbn(path).to_df(schema="ohlcv-1m")
+            except Exception as e:
+                print(f"Error converting {path}: {e}")
+                continue
+
+            if not df.empty:
+                ts = df.index.as_unit('ns').asi8
+                source['start'] = int(ts.min())
+                source['end'] = int(ts.max()) + 1
+                roots = {symbol: self.root_symbol(symbol) for symbol in df['symbol'].unique()}
+                df['root'] = df['symbol'].map(roots)
+                for root, bars in df[df['root'].notna()].groupby('root'):
+                    appended += self.append(root, bars)
+            self.sources[file_name] = source
+            self.save_json(self.sources_path, self.sources)
+        return appended
+
+    def append(self, root, bars):
+        index = self.index(root)
+        bars = bars.sort_index()
+        bars = bars[~bars.index.duplicated(keep='last')]
+        ts = bars.index.as_unit('ns').asi8
+        last_ts = index.get('last_ts')
+        if last_ts is not None:
+            keep = ts > last_ts  # Already stored, e.g. the part of today's file converted last time
+            bars, ts = bars[keep], ts[keep]
+        if len(bars) == 0:
+            return 0
+
+        scale_factor = 1e9 if bars['high'].max() > 1e6 else 1
+        columns = {
+            'ts': ts,
+            'open': bars['open'].to_numpy(np.float64) / scale_factor,
+            'high': bars['high'].to_numpy(np.float64) / scale_factor,
+            'low': bars['low'].to_numpy(np.float64) / scale_factor,
+            'close': bars['close'].to_numpy(np.float64) / scale_factor,
+            'volume': bars['volume'].to_numpy(np.uint64),
+        }
+        os.makedirs(self.root_dir(root), exist_ok=True)
+        for column, dtype in COLUMNS.items():
+            with open(os.path.join(self.root_dir(root), f"{column}.bin"), 'ab') as f:
+                f.write(np.ascontiguousarray(columns[column], dtype=dtype).tobytes())
+
+        # Extend the date ranges, then commit the new row count
+        start_row = index['rows']
+        dates = (ts // 86_400_000_000_000).astype('datetime64[D]').astype(str)
+        for date in np.unique(dates):
+            rows = np.flatnonzero(dates == date) + start_row
+            first_row, end_row = index['dates'].get(date, [int(rows[0]), int(rows[-1]) + 1])
+            index['dates'][date] = [min(first_row, int(rows[0])), max(end_row, int(rows[-1]) + 1)]
+        index['rows'] = start_row + len(ts)
+        index['last_ts'] = int(ts[-1])
+        self.save_json(os.path.join(self.root_dir(root), "index.json"), index)
+        self.maps.pop(root, None)  # Remap at the new length on next read
+        return len(ts)
+
+    # --- Reading ---
+
+    def columns(self, root):
+        # {column: read-only memmap} over every stored bar for root
+        if root not in self.maps:
+            rows = self.index(root)['rows']
+            columns = {}
+            for column, dtype in COLUMNS.items():
+                if rows == 0:
+                    columns[column] = np.empty(0, dtype=dtype)
+                else:
+                    columns[column] = np.memmap(os.path.join(self.root_dir(root), f"{column}.bin"),
+                                                dtype=dtype, mode='r', shape=(rows,))
+            self.maps[root] = columns
+        return self.maps[root]
+
+    def slice_rows(self, root, first_row, end_row):
+        return {column: values[first_row:end_row] for column, values in self.columns(root).items()}
+
+    def window(self, root, start=None, end=None):
+        # Bars with start <= ts < end (ns); either bound may be None
+        ts = self.columns(root)['ts']
+        first_row = int(np.searchsorted(ts, start, side='left')) if start is not None else 0
+        end_row = int(np.searchsorted(ts, end, side='left')) if end is not None else len(ts)
+        return self.slice_rows(root, first_row, end_row)
+
+    def lookback(self, root, bars, end=None):
+        # The last `bars` bars before end (ns), however many daily files they span
+        ts = self.columns(root)['ts']
+        end_row = int(np.searchsorted(ts, end, side='left')) if end is not None else len(ts)
+        return self.slice_rows(root, max(0, end_row - bars), end_row)
+
+    def day(self, root, date):
+        # date as 'YYYY-MM-DD' (UTC)
+        first_row, end_row = self.index(root)['dates'].get(date, [0, 0])
+        return self.slice_rows(root, first_row, end_row)
+
+    def dates(self, root):
+        return sorted(self.index(root)['dates'])
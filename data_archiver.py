@@ -4,11 +4,17 @@ from datetime import datetime, timedelta
 import time
 import signal
 import shutil
+from archive_writer import BufferedArchiveWriter
 
 # Create a directory for storing the archived data if it doesn't exist
 archive_dir = "databento_archives"
 os.makedirs(archive_dir, exist_ok=True)
 
+# Durability policy for the archive file: "records", "interval" or "bar_close"
+FLUSH_POLICY = "bar_close"
+FLUSH_RECORDS = 500
+FLUSH_INTERVAL_MS = 1000
+
 # Flag to control the main loop
 running = True
 
@@ -47,16 +53,25 @@ def archive_data():
                 start=start_time
             )
 
-            # Open a file for writing and start streaming
-            live_client.add_stream(file_path)
+            # Stream into a buffered writer that batches disk writes according to FLUSH_POLICY
+            writer = BufferedArchiveWriter(file_path, flush_policy=FLUSH_POLICY, flush_records=FLUSH_RECORDS,
+                                           flush_interval_ms=FLUSH_INTERVAL_MS, closed_bars=True)
+            live_client.add_stream(writer)
+            live_client.add_callback(lambda rec: writer.record_written(getattr(rec, 'ts_event', None)))
             live_client.start()
 
-            # Run until stopped or an hour has passed
-            # start_time = time.time()
-            # while running and (time.time() - start_time) < 3600:  # Run for up to an hour
-            #     time.sleep(10)  # Check every 10 seconds
-
-            # live_client.stop()  # Ensure we stop the client after the loop
+            # Keep streaming until stopped, disconnected or the day rolls over to a new file
+            try:
+                while running and live_client.is_connected() and datetime.now().strftime('%Y%m%d') == current_date:
+                    writer.poll()
+                    time.sleep(1)
+            finally:
+                live_client.stop()
+                try:
+                    live_client.block_for_close(timeout=5)
+                except Exception as e:
+                    print(f"Error waiting for stream to close: {e}")
+                writer.close()
 
         except Exception as e:
             print(f"Error occurred: {e}")
@@ -0,0 +1,187 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+import pandas as pd
+
+
+class DBNCache:
+    # On-disk cache for Historical timeseries requests.
+    # Requests are keyed by a hash of dataset/schema/symbols/stype_in; each key owns a set of
+    # non-overlapping time segments stored as DBN files. A request only downloads the parts of its
+    # range no segment covers yet, so overlapping replays reuse what is already on disk.
+    # Data newer than fresh_margin is never cached (it may still be revised) and is fetched every time.
+    # Once the cache grows past max_bytes, the least recently used segments are deleted.
+    def __init__(self, cache_dir="databento_cache", max_bytes=2 * 1024 ** 3, fresh_margin=pd.Timedelta(hours=1)):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.fresh_margin = fresh_margin
+        self.index_path = os.path.join(cache_dir, "index.json")
+        self.lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        self.index = self.load_index()
+
+    def load_index(self):
+        if os.path.exists(self.index_path):
+            try:
+                with open(self.index_path, 'r') as f:
+                    index = json.load(f)
+                # Forget segments whose files were removed by hand
+                for entry in index.values():
+                    entry['segments'] = [seg for seg in entry['segments'] if os.path.exists(os.path.join(self.cache_dir, seg['file']))]
+                return index
+            except (json.JSONDecodeError, KeyError) as e:
+                print(f"Error loading {self.index_path}: {e}. Starting with an empty cache index.")
+        return {}
+
+    def save_index(self):
+        temp_path = self.index_path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(self.index, f, indent=2)
+        os.replace(temp_path, self.index_path)
+
+    @staticmethod
+    def to_ns(value):
+        ts = pd.Timestamp(value)
+        if ts.tzinfo is None:
+            ts = ts.tz_localize('UTC')  # Databento treats naive times as UTC
+        return ts.value
+
+    @staticmethod
+    def request_key(dataset, schema, symbols, stype_in):
+        request = {'dataset': str(dataset), 'schema': str(schema), 'symbols': sorted(symbols), 'stype_in': stype_in}
+        digest = hashlib.sha256(json.dumps(request, sort_keys=True).encode()).hexdigest()[:32]
+        return digest, request
+
+    @staticmethod
+    def missing_ranges(start, end, segments):
+        # Parts of [start, end) not covered by any segment
+        gaps = []
+        cursor = start
+        for seg in sorted(segments, key=lambda seg: seg['start']):
+            if seg['end'] <= cursor or seg['start'] >= end:
+                continue
+            if seg['start'] > cursor:
+                gaps.append((cursor, seg['start']))
+            cursor = max(cursor, seg['end'])
+            if cursor >= end:
+                break
+        if cursor < end:
+            gaps.append((cursor, end))
+        return gaps
+
+    def download(self, client, request, start, end, path):
+        params = {
+            'dataset': request['dataset'],
+            'schema': request['schema'],
+            'symbols': request['symbols'],
+            'start': pd.Timestamp(start, unit='ns', tz='UTC'),
+            'end': pd.Timestamp(end, unit='ns', tz='UTC'),
+            'path': path
+        }
+        if request['stype_in']:
+            params['stype_in'] = request['stype_in']
+        print(f"Downloading {request['schema']} {request['symbols']} {params['start']} - {params['end']}")
+        client.timeseries.get_range(**params)
+        if not os.path.exists(path):
+            open(path, 'wb').close()  # Nothing in range; remember that too so it isn't requested again
+
+    def fetch(self, client, dataset, schema, symbols, start, end=None, stype_in=None):
+        # Returns [(path, is_temporary)] covering [start, end) in time order.
+        # Temporary files hold the uncached recent part; the caller deletes them when done.
+        start_ns = self.to_ns(start)
+        now_ns = time.time_ns()
+        end_ns = self.to_ns(end) if end is not None else now_ns
+        cutoff_ns = min(end_ns, now_ns - self.fresh_margin.value)
+        key, request = self.request_key(dataset, schema, symbols, stype_in)
+
+        paths = []
+        with self.lock:
+            entry = self.index.setdefault(key, {'request': request, 'segments': []})
+            if start_ns < cutoff_ns:
+                for gap_start, gap_end in self.missing_ranges(start_ns, cutoff_ns, entry['segments']):
+                    file_name = f"{key}_{gap_start}_{gap_end}.dbn"
+                    file_path = os.path.join(self.cache_dir, file_name)
+                    self.download(client, request, gap_start, gap_end, file_path + '.part')
+                    os.replace(file_path + '.part', file_path)
+                    entry['segments'].append({
+                        'start': gap_start,
+                        'end': gap_end,
+                        'file': file_name,
+                        'size': os.path.getsize(file_path),
+                        'last_used': time.time()
+                    })
+
+                for seg in sorted(entry['segments'], key=lambda seg: seg['start']):
+                    if seg['end'] > start_ns and seg['start'] < cutoff_ns:
+                        seg['last_used'] = time.time()
+                        paths.append((os.path.join(self.cache_dir, seg['file']), False))
+
+                self.evict(keep={path for path, _ in paths})
+                self.save_index()
+
+        if end_ns > max(start_ns, cutoff_ns):
+            fd, temp_path = tempfile.mkstemp(prefix="dbn_fresh_", suffix=".dbn")
+            os.close(fd)
+            self.download(client, request, max(start_ns, cutoff_ns), end_ns, temp_path)
+            paths.append((temp_path, True))
+        return paths
+
+    def evict(self, keep=()):
+        segments = [(seg['last_used'], key, seg) for key, entry in self.index.items() for seg in entry['segments']]
+        total = sum(seg['size'] for _, _, seg in segments)
+        for _, key, seg in sorted(segments, key=lambda item: item[0]):
+            if total <= self.max_bytes:
+                break
+            path = os.path.join(self.cache_dir, seg['file'])
+            if path in keep:
+                continue  # Needed by the request being served
+            if os.path.exists(path):
+                os.remove(path)
+            self.index[key]['segments'].remove(seg)
+            total -= seg['size']
+            print(f"Evicted {seg['file']} from the DBN cache")
+
+    def records(self, client, dataset, schema, symbols, start, end=None, stype_in=None):
+        # Yields records with start <= ts_event < end across all the files making up the range
+        import databento as db
+        start_ns = self.to_ns(start)
+        end_ns = self.to_ns(end) if end is not None else None
+        paths = self.fetch(client, dataset, schema, symbols, start, end, stype_in)
+        try:
+            for path, _ in paths:
+                if os.path.getsize(path) == 0:
+                    continue
+                for record in db.DBNStore.from_file(path):
+                    ts_event = getattr(record, 'ts_event', None)
+                    if ts_event is not None and hasattr(record, 'instrument_id') and not isinstance(record, db.SymbolMappingMsg):
+                        if ts_event < start_ns or (end_ns is not None and ts_event >= end_ns):
+                            continue
+                    yield record
+        finally:
+            for path, is_temporary in paths:
+                if is_temporary and os.path.exists(path):
+                    os.remove(path)
+
+    def to_df(self, client, dataset, schema, symbols, start, end=None, stype_in=None):
+        import databento as db
+        paths = self.fetch(client, dataset, schema, symbols, start, end, stype_in)
+        try:
+            frames = [db.DBNStore.from_file(path).to_df() for path, _ in paths if os.path.getsize(path) > 0]
+        finally:
+            for path, is_temporary in paths:
+                if is_temporary and os.path.exists(path):
+                    os.remove(path)
+
+        frames = [df for df in frames if not df.empty]
+        if not frames:
+            return pd.DataFrame()
+        df = pd.concat(frames).sort_index()
+        start_ts = pd.Timestamp(self.to_ns(start), unit='ns', tz='UTC')
+        df = df[df.index >= start_ts]
+        if end is not None:
+            df = df[df.index < pd.Timestamp(self.to_ns(end), unit='ns', tz='UTC')]
+        return df
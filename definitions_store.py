@@ -0,0 +1,99 @@
+import sqlite3
+import threading
+from datetime import datetime, timezone
+
+import databento as db
+import pandas as pd
+
+
+class DefinitionsStore:
+    # Instrument definitions kept in SQLite, indexed for option chain lookups.
+    # refresh() downloads only definitions published since the last refresh, at most once a day;
+    # expired instruments are dropped so the table stays the size of the live chain.
+    def __init__(self, db_path="definitions.sqlite", dataset="GLBX.MDP3", initial_start="2024-09-26"):
+        self.dataset = dataset
+        self.initial_start = initial_start
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS definitions (
+                instrument_id INTEGER PRIMARY KEY,
+                raw_symbol TEXT NOT NULL,
+                security_type TEXT,
+                instrument_class TEXT,
+                underlying TEXT,
+                strike_price REAL,
+                expiration INTEGER,
+                ts_recv INTEGER
+            );
+            CREATE INDEX IF NOT EXISTS idx_definitions_chain
+                ON definitions (security_type, underlying, expiration, strike_price);
+            CREATE INDEX IF NOT EXISTS idx_definitions_expiration ON definitions (expiration);
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+        """)
+        self.conn.commit()
+
+    def get_meta(self, key):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key, value):
+        self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, str(value)))
+
+    def refresh(self, client, force=False):
+        # Returns the number of definitions added or updated
+        today = datetime.now(timezone.utc).strftime('%Y-%m-%d')
+        with self.lock:
+            if not force and self.get_meta('last_refresh_date') == today:
+                return 0
+
+            last_ts = self.get_meta('last_ts_recv')
+            start = pd.Timestamp(int(last_ts) + 1, unit='ns', tz='UTC') if last_ts else self.initial_start
+            print(f"Refreshing instrument definitions from {start}")
+            df = client.timeseries.get_range(
+                dataset=self.dataset,
+                schema=db.Schema.DEFINITION,
+                start=start,
+            ).to_df()
+
+            rows = []
+            if not df.empty:
+                expirations = pd.to_datetime(df['expiration'], utc=True)
+                for ts_recv, row, expiration in zip(df.index, df.itertuples(index=False), expirations):
+                    rows.append((
+                        int(row.instrument_id),
+                        row.raw_symbol,
+                        row.security_type,
+                        row.instrument_class,
+                        row.underlying,
+                        float(row.strike_price) if pd.notna(row.strike_price) else None,
+                        expiration.value if pd.notna(expiration) else None,
+                        ts_recv.value
+                    ))
+                # A later definition for the same instrument replaces the earlier one
+                self.conn.executemany("INSERT OR REPLACE INTO definitions VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+                self.set_meta('last_ts_recv', df.index.max().value)
+
+            self.conn.execute("DELETE FROM definitions WHERE expiration IS NOT NULL AND expiration < ?",
+                              (pd.Timestamp.now(tz='UTC').value,))
+            self.set_meta('last_refresh_date', today)
+            self.conn.commit()
+            print(f"Stored {len(rows)} new or updated instrument definitions")
+            return len(rows)
+
+    def query_options(self, underlying, min_strike, max_strike, security_type="OOF"):
+        # (raw_symbol, underlying, instrument_class, strike_price, expiration) ordered by expiration then strike
+        with self.lock:
+            rows = self.conn.execute("""
+                SELECT raw_symbol, underlying, instrument_class, strike_price, expiration
+                FROM definitions
+                WHERE security_type = ? AND underlying = ? AND strike_price BETWEEN ? AND ?
+                ORDER BY expiration, strike_price
+            """, (security_type, underlying, min_strike, max_strike)).fetchall()
+        return [(raw_symbol, row_underlying, instrument_class, strike_price,
+                 pd.Timestamp(expiration, unit='ns', tz='UTC') if expiration is not None else None)
+                for raw_symbol, row_underlying, instrument_class, strike_price, expiration in rows]
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
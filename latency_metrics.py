@@ -0,0 +1,111 @@
+import json
+import os
+import time
+from collections import deque
+from datetime import datetime, timezone
+
+# Consecutive stages of the tick-to-order path, plus the end-to-end totals
+STAGES = [
+    "exchange_to_gateway",  # ts_event -> ts_recv (Databento gateway)
+    "gateway_to_worker",    # ts_recv (or bar close) -> DatabentoWorker read the record
+    "worker_to_handler",    # DatabentoWorker -> handle_databento_data on the GUI thread
+    "risk_decision",        # handle_databento_data -> risk engine produced an order intent
+    "order_queue",          # intent submitted -> OrderDispatchWorker dequeued it
+    "http_round_trip",      # HTTP send -> webhook response
+    "tick_to_send",         # exchange -> HTTP send
+    "tick_to_response",     # exchange -> webhook response
+]
+
+
+class LatencyTracker:
+    # Keeps the last `window` samples per stage and reports rolling percentiles in milliseconds.
+    # Times are wall-clock nanoseconds; stages that compare our clock with the exchange's
+    # include whatever offset the local clock has.
+    def __init__(self, window=1000):
+        self.window = window
+        self.samples = {stage: deque(maxlen=window) for stage in STAGES}
+        self.counts = {stage: 0 for stage in STAGES}
+
+    def record(self, stage, elapsed_ns):
+        if elapsed_ns is None or elapsed_ns < 0:
+            return  # Clock skew or a missing timestamp; a negative sample would only confuse the percentiles
+        self.samples[stage].append(elapsed_ns / 1e6)
+        self.counts[stage] += 1
+
+    def trace_record(self, record, received_ns, bar_interval_ns=0):
+        # Builds the timing trace for one market-data record. OHLCV bars carry no ts_recv and
+        # their ts_event is the bar open, so the exchange reference becomes the bar close.
+        ts_event = getattr(record, 'ts_event', None)
+        ts_recv = getattr(record, 'ts_recv', None)
+        if ts_event is None:
+            return None
+
+        trace = {
+            'ts_event': ts_event,
+            'ts_recv': ts_recv,
+            'ts_exchange': ts_event if ts_recv is not None else ts_event + bar_interval_ns,
+            'received_ns': received_ns,
+            'handled_ns': time.time_ns(),
+            'decided_ns': None
+        }
+        if ts_recv is not None:
+            self.record("exchange_to_gateway", ts_recv - ts_event)
+        if received_ns is not None:
+            self.record("gateway_to_worker", received_ns - (ts_recv if ts_recv is not None else trace['ts_exchange']))
+            self.record("worker_to_handler", trace['handled_ns'] - received_ns)
+        return trace
+
+    def record_decision(self, trace):
+        if trace is None or trace['decided_ns'] is not None:
+            return
+        trace['decided_ns'] = time.time_ns()
+        self.record("risk_decision", trace['decided_ns'] - trace['handled_ns'])
+
+    def record_order(self, job):
+        # Order jobs carry time.time() seconds from OrderDispatchWorker
+        if job['dequeued_at'] is not None:
+            self.record("order_queue", int((job['dequeued_at'] - job['submitted_at']) * 1e9))
+        if job['sent_at'] is not None and job['responded_at'] is not None:
+            self.record("http_round_trip", int((job['responded_at'] - job['sent_at']) * 1e9))
+
+        trace = job.get('trace')
+        if trace is None:
+            return
+        if job['sent_at'] is not None:
+            self.record("tick_to_send", int(job['sent_at'] * 1e9) - trace['ts_exchange'])
+        if job['responded_at'] is not None:
+            self.record("tick_to_response", int(job['responded_at'] * 1e9) - trace['ts_exchange'])
+
+    def percentiles(self, stage):
+        values = sorted(self.samples[stage])
+        if not values:
+            return {'count': self.counts[stage], 'p50': None, 'p90': None, 'p99': None, 'max': None}
+
+        def rank(p):
+            return values[min(len(values) - 1, int(p / 100 * len(values)))]
+
+        return {
+            'count': self.counts[stage],
+            'p50': rank(50),
+            'p90': rank(90),
+            'p99': rank(99),
+            'max': values[-1]
+        }
+
+    def snapshot(self, extra=None):
+        snapshot = {
+            'generated_at': datetime.now(timezone.utc).isoformat(),
+            'window': self.window,
+            'unit': 'ms',
+            'stages': {stage: self.percentiles(stage) for stage in STAGES}
+        }
+        if extra:
+            snapshot.update(extra)
+        return snapshot
+
+    def dump(self, path, extra=None):
+        # Written atomically so a reader polling the file never sees half a document
+        temp_path = path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(self.snapshot(extra), f, indent=2)
+        os.replace(temp_path, path)
@@ -0,0 +1,92 @@
+import json
+
+# Append-only journal of order and TP ladder changes, one JSON event per line, written on top of the
+# active_orders.json snapshot. Loading the snapshot and applying every journaled event in order gives
+# back the exact state at the last save.
+#
+# State is compared per ('order' | 'tp_levels', ticker) key as canonical JSON, so unchanged tickers cost nothing.
+
+TP_EVENTS = ('tp_levels_set', 'tp_hit', 'tp_levels_removed', 'position_closed')  # Events after which a TP ladder must be re-sorted
+
+
+def encode_state(active_orders, tp_levels):
+    state = {}
+    for ticker, order in active_orders.items():
+        state[('order', ticker)] = json.dumps(order, separators=(',', ':'), sort_keys=True)
+    for ticker, tps in tp_levels.items():
+        state[('tp_levels', ticker)] = json.dumps(tps, separators=(',', ':'), sort_keys=True)
+    return state
+
+
+def journal_event(key, previous, encoded):
+    kind, ticker = key
+    if kind == 'order':
+        order = json.loads(encoded)
+        if previous is None:
+            return {'event': 'order_opened', 'ticker': ticker, 'order': order}
+        previous_order = json.loads(previous)
+        if {**previous_order, 'stop_loss': order.get('stop_loss')} == order:
+            return {'event': 'stop_moved', 'ticker': ticker, 'stop_loss': order.get('stop_loss')}
+        return {'event': 'order_updated', 'ticker': ticker, 'order': order}
+
+    tps = json.loads(encoded)
+    if previous is not None:
+        previous_tps = json.loads(previous)
+        # Levels that only flipped to hit are journaled by index rather than as a whole ladder
+        if len(previous_tps) == len(tps) and all({**old_tp, 'hit': tp.get('hit')} == tp for old_tp, tp in zip(previous_tps, tps)):
+            changed = [index for index, (old_tp, tp) in enumerate(zip(previous_tps, tps)) if old_tp.get('hit') != tp.get('hit')]
+            if all(tps[index].get('hit') for index in changed):
+                return {'event': 'tp_hit', 'ticker': ticker, 'indexes': changed}
+    return {'event': 'tp_levels_set', 'ticker': ticker, 'tp_levels': tps}
+
+
+def diff_events(previous_state, state):
+    # Events that turn previous_state into state
+    events = []
+    for key, encoded in state.items():
+        previous = previous_state.get(key)
+        if encoded != previous:
+            events.append(journal_event(key, previous, encoded))
+    for kind, ticker in previous_state.keys() - state.keys():
+        events.append({'event': 'position_closed' if kind == 'order' else 'tp_levels_removed', 'ticker': ticker})
+    return events
+
+
+def format_events(events, ts):
+    return ''.join(json.dumps({**event, 'ts': ts}, separators=(',', ':')) + '\n' for event in events)
+
+
+def apply_event(active_orders, tp_levels, event):
+    ticker = event['ticker']
+    kind = event['event']
+    if kind in ('order_opened', 'order_updated'):
+        active_orders[ticker] = event['order']
+    elif kind == 'stop_moved':
+        if ticker in active_orders:
+            active_orders[ticker]['stop_loss'] = event['stop_loss']
+    elif kind == 'position_closed':
+        active_orders.pop(ticker, None)
+    elif kind == 'tp_levels_set':
+        tp_levels[ticker] = event['tp_levels']
+    elif kind == 'tp_hit':
+        for index in event['indexes']:
+            if index < len(tp_levels.get(ticker, [])):
+                tp_levels[ticker][index]['hit'] = True
+    elif kind == 'tp_levels_removed':
+        tp_levels.pop(ticker, None)
+
+
+def replay(journal_path, active_orders, tp_levels):
+    # Applies every complete event in the journal; returns how many were applied
+    replayed = 0
+    with open(journal_path, 'r') as f:
+        for line in f:
+            try:
+                event = json.loads(line)
+            except json.JSONDecodeError:
+                # Only the last line can be torn by a crash mid-append; everything before it is intact
+                print(f"Stopping journal replay at a partially written entry after {replayed} events")
+                break
+            apply_event(active_orders, tp_levels, event)
+            replayed += 1
+    return replayed
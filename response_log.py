@@ -0,0 +1,86 @@
+import heapq
+from collections import deque
+
+from PyQt5.QtWidgets import QWidget, QVBoxLayout, QHBoxLayout, QLabel, QComboBox, QPlainTextEdit
+from PyQt5.QtCore import QTimer, pyqtSignal
+
+LOG_LEVELS = ["DEBUG", "INFO", "WARNING", "ERROR"]
+
+
+class ResponseLog(QWidget):
+    # Response area that stays cheap over a full trading day:
+    # - the last max_lines messages of each level are kept in ring buffers, so a flood of DEBUG lines
+    #   can't push out errors, and the view is capped to max_lines
+    # - messages are collected and appended in one batch every flush_interval_ms
+    # - messages below the selected level are kept in the buffer but not shown
+    level_changed = pyqtSignal(str)
+
+    def __init__(self, parent=None, max_lines=2000, flush_interval_ms=100, level="INFO"):
+        super().__init__(parent)
+        self.max_lines = max_lines
+        self.entries = [deque(maxlen=max_lines) for _ in LOG_LEVELS]  # Per level: (sequence, text)
+        self.sequence = 0
+        self.pending = []
+        self.min_level = LOG_LEVELS.index(level) if level in LOG_LEVELS else LOG_LEVELS.index("INFO")
+
+        layout = QVBoxLayout(self)
+        layout.setContentsMargins(0, 0, 0, 0)
+
+        filter_layout = QHBoxLayout()
+        filter_layout.addWidget(QLabel("Log level:"))
+        self.level_combo = QComboBox()
+        self.level_combo.addItems(LOG_LEVELS)
+        self.level_combo.setCurrentIndex(self.min_level)
+        self.level_combo.currentTextChanged.connect(self.set_level)
+        filter_layout.addWidget(self.level_combo)
+        filter_layout.addStretch()
+        layout.addLayout(filter_layout)
+
+        self.view = QPlainTextEdit()
+        self.view.setReadOnly(True)
+        self.view.setMaximumBlockCount(max_lines)
+        layout.addWidget(self.view)
+
+        self.flush_timer = QTimer(self)
+        self.flush_timer.setSingleShot(True)
+        self.flush_timer.setInterval(flush_interval_ms)
+        self.flush_timer.timeout.connect(self.flush)
+
+    def log(self, text, level="INFO"):
+        level_index = LOG_LEVELS.index(level) if level in LOG_LEVELS else LOG_LEVELS.index("INFO")
+        text = text.rstrip("\n")
+        self.sequence += 1
+        self.entries[level_index].append((self.sequence, text))
+        if level_index < self.min_level:
+            return
+        self.pending.append(text)
+        if len(self.pending) > self.max_lines:
+            del self.pending[:-self.max_lines]  # Older lines would be trimmed from the view anyway
+        if not self.flush_timer.isActive():
+            self.flush_timer.start()
+
+    def flush(self):
+        if not self.pending:
+            return
+        scrollbar = self.view.verticalScrollBar()
+        at_bottom = scrollbar.value() >= scrollbar.maximum()
+        self.view.appendPlainText("\n".join(self.pending))
+        self.pending.clear()
+        # Only follow new output if the user hasn't scrolled up to read something
+        if at_bottom:
+            scrollbar.setValue(scrollbar.maximum())
+
+    def set_level(self, level):
+        self.min_level = LOG_LEVELS.index(level)
+        self.pending.clear()
+        visible = heapq.merge(*self.entries[self.min_level:])  # Back into arrival order
+        lines = deque((text for sequence, text in visible), maxlen=self.max_lines)
+        self.view.setPlainText("\n".join(lines))
+        self.view.verticalScrollBar().setValue(self.view.verticalScrollBar().maximum())
+        self.level_changed.emit(level)
+
+    def clear(self):
+        for entries in self.entries:
+            entries.clear()
+        self.pending.clear()
+        self.view.clear()
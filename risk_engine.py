@@ -0,0 +1,416 @@
+import time
+
+
+class RiskEngine:
+    # Owns positions, stops and TP ladders, with no Qt or widget dependencies.
+    # Feed it prices with on_tick() and it returns order intents; the caller sends the orders
+    # and reports back with on_order_result(), which applies fills and may return follow-up intents.
+    #
+    # An intent is a dict:
+    #   kind   - 'stop_loss', 'take_profit', 'trailing_stop', 'timer_exit', 'reverse_exit', 'reverse_entry'
+    #            or a notice that needs no order: 'stop_moved', 'timer_notice'
+    #   ticker - the root ticker (e.g. "MES")
+    #   order  - webhook payload to send, or None for notices
+    #   price  - the price that triggered it
+    # plus kind-specific fields ('tps', 'stop_loss', 'message', ...).
+    def __init__(self):
+        self.positions = {}  # ticker -> active order dict (same shape as active_orders.json)
+        self.tp_levels = {}  # ticker -> list of TP dicts
+        self.tp_index = {}  # ticker -> [enabled un-hit TPs nearest first, position of the next one to trigger]
+        self.pending_exits = set()  # Tickers with an exit order in flight
+        self.first_tp_hit_tickers = set()  # Positions where trail_after_1st_tp has switched to trailing
+        self.timer_notified = set()  # Tickers whose timer-expired notice has already been issued
+        self.last_prices = {}
+        self.clock = time.time  # Replaced with a virtual clock when replaying recorded data
+
+        # Settings the caller keeps in sync with its inputs
+        self.order_symbols = {}  # ticker -> broker symbol
+        self.trail_by_amounts = {}  # ticker -> trail amount used after a TP fill
+        self.timer_duration = 5 * 60
+        self.timer_action = "Hold"  # "Hold", "Exit" or "Reverse"
+        self.reverse_stop_loss_type = "stop"  # Broker stop type for the reversed position
+        self.reverse_stop_loss_amount = 0
+        self.reverse_quantity = 1
+
+    def symbol(self, ticker):
+        return self.order_symbols.get(ticker, ticker)
+
+    def intent(self, kind, ticker, price, order=None, **extra):
+        intent = {'kind': kind, 'ticker': ticker, 'order': order, 'price': price}
+        intent.update(extra)
+        return intent
+
+    # --- Positions ---
+
+    def open_position(self, ticker, action, quantity, entry_price, stop_loss=None, timestamp=None):
+        # Adds to an existing position at a weighted entry, or opens a new one. Returns the position.
+        if timestamp is None:
+            timestamp = int(self.clock())
+
+        if ticker in self.positions:
+            position = self.positions[ticker]
+            new_quantity = position['quantity'] + quantity
+            weighted_entry_price = (position['entry_price'] * position['quantity'] + entry_price * quantity) / new_quantity
+            position.update({
+                "quantity": new_quantity,
+                "entry_price": weighted_entry_price,
+                "timestamp": timestamp,
+                "stop_loss": stop_loss
+            })
+        else:
+            position = {
+                "symbol": ticker,
+                "action": action,
+                "quantity": quantity,
+                "entry_price": entry_price,
+                "timestamp": timestamp,
+                "stop_loss": stop_loss
+            }
+            self.positions[ticker] = position
+
+        self.first_tp_hit_tickers.discard(ticker)
+        self.timer_notified.discard(ticker)
+        self.invalidate_tp_index(ticker)
+        return position
+
+    def close_position(self, ticker):
+        self.first_tp_hit_tickers.discard(ticker)
+        self.timer_notified.discard(ticker)
+        self.invalidate_tp_index(ticker)
+        return self.positions.pop(ticker, None)
+
+    def reduce_position(self, ticker, quantity):
+        # Returns the remaining quantity; the position is removed once nothing is left
+        if ticker not in self.positions:
+            return 0
+        self.positions[ticker]['quantity'] -= quantity
+        remaining_quantity = self.positions[ticker]['quantity']
+        if remaining_quantity <= 0:
+            self.close_position(ticker)
+        return remaining_quantity
+
+    def reset_tp_hits(self, ticker):
+        for tp in self.tp_levels.get(ticker, []):
+            tp['hit'] = False
+        self.invalidate_tp_index(ticker)
+
+    def invalidate_tp_index(self, ticker=None):
+        # Call after editing a ladder from outside (prices, enabled flags, levels added or removed);
+        # the index is rebuilt on the next tick
+        if ticker is None:
+            self.tp_index.clear()
+        else:
+            self.tp_index.pop(ticker, None)
+
+    def build_tp_index(self, ticker):
+        buy = self.positions[ticker]['action'] == 'buy'
+        pending = [tp for tp in self.tp_levels[ticker] if tp['enabled'] and not tp['hit']]
+        pending.sort(key=lambda tp: tp['price'] if buy else -tp['price'])  # Stable, so equal prices keep ladder order
+        index = [pending, 0]
+        self.tp_index[ticker] = index
+        return index
+
+    def adjust_tp_levels(self, ticker, entry_price, action, flip_targets=False):
+        # Re-prices the ladder around a new entry and clears hits.
+        # flip_targets makes targets signed to the new direction (used when reversing).
+        if ticker not in self.tp_levels:
+            return False
+
+        adjusted_tp_levels = []
+        for tp in self.tp_levels[ticker]:
+            new_tp = tp.copy()
+            new_tp['hit'] = False  # Reset hit status
+            if flip_targets:
+                new_tp['target'] = abs(new_tp['target']) if action == 'buy' else -abs(new_tp['target'])
+                new_tp['price'] = entry_price + new_tp['target']
+            elif action == 'buy':
+                new_tp['price'] = entry_price + abs(new_tp['target'])
+            else:  # sell
+                new_tp['price'] = entry_price - abs(new_tp['target'])
+            adjusted_tp_levels.append(new_tp)
+
+        self.tp_levels[ticker] = adjusted_tp_levels
+        self.invalidate_tp_index(ticker)
+        return True
+
+    # --- Ticks ---
+
+    def on_tick(self, ticker, price):
+        self.last_prices[ticker] = price
+        if ticker not in self.positions or ticker in self.pending_exits:
+            return []
+
+        stop_loss = self.positions[ticker].get('stop_loss') or {}
+        previous_stop_price = stop_loss.get('stopPrice')
+
+        if self.check_stop_loss(ticker, price):
+            return [self.stop_loss_intent(ticker, price)]
+
+        intents = []
+        if stop_loss.get('stopPrice') != previous_stop_price:
+            intents.append(self.intent('stop_moved', ticker, price, stop_loss=stop_loss))
+        intents.extend(self.check_tp_levels(ticker, price))
+        return intents
+
+    def on_bar(self, ticker, open_price, high, low, close):
+        # Runs a whole bar through on_tick along the path it most likely took, so a level touched
+        # inside the bar counts even if the close moved away again: O->L->H->C for an up bar, O->H->L->C otherwise.
+        # Once the stop fires the ticker is pending an exit and the rest of the path is ignored.
+        path = (open_price, low, high, close) if close >= open_price else (open_price, high, low, close)
+        intents = []
+        for price in path:
+            for intent in self.on_tick(ticker, price):
+                if intent['kind'] == 'stop_moved':
+                    intents = [i for i in intents if i['kind'] != 'stop_moved']  # Only the final stop matters
+                intents.append(intent)
+        return intents
+
+    def check_stop_loss(self, ticker, current_price):
+        # True when the stop is hit; ratchets trailing stops in place otherwise
+        if ticker not in self.positions:
+            return False
+
+        order = self.positions[ticker]
+        entry_price = order['entry_price']
+        action = order['action']
+        stop_loss = order.get('stop_loss')
+
+        if not stop_loss:
+            return False
+
+        stop_type = stop_loss.get('type')
+        stop_price = stop_loss.get('stopPrice')
+        trail_amount = stop_loss.get('trailAmount')
+
+        if stop_type == 'stop' or stop_type == 'stop_limit':
+            if stop_price is None:
+                return False
+            if action == 'buy' and current_price <= stop_price:
+                return True
+            elif action == 'sell' and current_price >= stop_price:
+                return True
+        elif stop_type == 'trailing_stop':
+            if trail_amount is None:
+                return False
+            if action == 'buy':
+                if stop_price is None:
+                    stop_price = entry_price - trail_amount
+                new_stop_price = max(current_price - trail_amount, stop_price)
+                if current_price <= new_stop_price:
+                    return True
+                if new_stop_price > stop_price:
+                    stop_loss['stopPrice'] = new_stop_price
+            elif action == 'sell':
+                if stop_price is None:
+                    stop_price = entry_price + trail_amount
+                new_stop_price = min(current_price + trail_amount, stop_price)
+                if current_price >= new_stop_price:
+                    return True
+                if new_stop_price < stop_price:
+                    stop_loss['stopPrice'] = new_stop_price
+        elif stop_type == 'trail_after_1st_tp':
+            initial_stop_price = stop_loss.get('initialStopPrice')
+            if initial_stop_price is None:
+                return False
+            if ticker not in self.first_tp_hit_tickers:
+                if action == 'buy' and current_price <= initial_stop_price:
+                    return True
+                elif action == 'sell' and current_price >= initial_stop_price:
+                    return True
+            else:
+                # After first TP hit, behave like a trailing stop
+                if action == 'buy':
+                    new_stop_price = max(current_price - trail_amount, stop_price or initial_stop_price)
+                    if current_price <= new_stop_price:
+                        return True
+                    if new_stop_price > (stop_price or initial_stop_price):
+                        stop_loss['stopPrice'] = new_stop_price
+                elif action == 'sell':
+                    new_stop_price = min(current_price + trail_amount, stop_price or initial_stop_price)
+                    if current_price >= new_stop_price:
+                        return True
+                    if new_stop_price < (stop_price or initial_stop_price):
+                        stop_loss['stopPrice'] = new_stop_price
+
+        return False
+
+    def check_tp_levels(self, ticker, current_price):
+        # One comparison against the next target per tick. Every level the price has crossed is
+        # hit in ladder order and goes out as a single exit.
+        if ticker not in self.tp_levels or ticker not in self.positions:
+            return []
+
+        index = self.tp_index.get(ticker) or self.build_tp_index(ticker)
+        pending, next_tp = index
+        buy = self.positions[ticker]['action'] == 'buy'
+        crossed = []
+        while next_tp < len(pending):
+            tp = pending[next_tp]
+            if (buy and current_price < tp['price']) or (not buy and current_price > tp['price']):
+                break
+            tp['hit'] = True
+            crossed.append(tp)
+            next_tp += 1
+        index[1] = next_tp
+
+        if not crossed:
+            return []
+        return [self.take_profit_intent(ticker, crossed, current_price)]
+
+    def timer_remaining(self, ticker, now=None):
+        if ticker not in self.positions:
+            return None
+        if now is None:
+            now = self.clock()
+        return max(0, self.timer_duration - (now - self.positions[ticker]['timestamp']))
+
+    def check_timers(self, now=None):
+        # Headless counterpart of the GUI trade timer: runs the exit check for every expired position
+        intents = []
+        for ticker in list(self.positions):
+            if self.timer_remaining(ticker, now) <= 0:
+                intents.extend(self.check_exit_condition(ticker))
+        return intents
+
+    def check_exit_condition(self, ticker, current_price=None):
+        if ticker in self.pending_exits or ticker not in self.positions:
+            return []
+        if current_price is None:
+            current_price = self.last_prices.get(ticker)
+        if not current_price:
+            return []
+
+        order = self.positions[ticker]
+        entry_price = order['entry_price']
+        action = order['action']
+        selected_action = self.timer_action
+
+        # Check if the trade is in profit
+        is_in_profit = (action == 'buy' and current_price > entry_price) or (action == 'sell' and current_price < entry_price)
+
+        if selected_action in ["Exit", "Reverse"]:
+            if not is_in_profit:
+                self.timer_notified.discard(ticker)
+                if selected_action == "Exit":
+                    return [self.timer_exit_intent(ticker, current_price)]
+                return self.reverse_intents(ticker, current_price)
+            if ticker not in self.timer_notified:
+                self.timer_notified.add(ticker)
+                return [self.intent('timer_notice', ticker, current_price,
+                                    message=f"Timer expired. In profit. Holding trade ({selected_action} not executed).\n")]
+        elif selected_action == "Hold" and ticker not in self.timer_notified:
+            self.timer_notified.add(ticker)
+            return [self.intent('timer_notice', ticker, current_price,
+                                message="Timer expired. Holding trade as per selected action.\n")]
+        return []
+
+    # --- Intents ---
+
+    def stop_loss_intent(self, ticker, price):
+        self.pending_exits.add(ticker)
+        exit_order = {
+            "ticker": self.symbol(ticker),
+            "action": "exit",
+            "orderType": "market"
+            #"quantity": order['quantity']  # Exit the full position
+        }
+        return self.intent('stop_loss', ticker, price, exit_order)
+
+    def take_profit_intent(self, ticker, tps, price):
+        # tps: the levels hit on this tick, nearest first; they are exited together
+        quantity = sum(tp['quantity'] for tp in tps)
+        exit_order = {
+            "ticker": self.symbol(ticker),
+            "action": "exit",
+            "orderType": "market",
+            "quantity": quantity,
+            "price": tps[-1]['price']
+        }
+        return self.intent('take_profit', ticker, price, exit_order, tps=tps, quantity=quantity)
+
+    def trailing_stop_intent(self, ticker, signal_price, remaining_quantity):
+        stop_loss = self.positions[ticker].get('stop_loss') or {}
+        trail_amount = stop_loss.get('trailAmount') or self.trail_by_amounts.get(ticker, 0)
+        update_order = {
+            "ticker": self.symbol(ticker),
+            "action": "exit",
+            "orderType": "trailing_stop",
+            "signalPrice": str(int(signal_price)),  # Convert to integer and then to string
+            "trailAmount": str(trail_amount),
+            "quantity": str(remaining_quantity)
+        }
+        return self.intent('trailing_stop', ticker, signal_price, update_order,
+                           trail_amount=trail_amount, remaining_quantity=remaining_quantity)
+
+    def timer_exit_intent(self, ticker, price, kind='timer_exit'):
+        self.pending_exits.add(ticker)
+        exit_order = {
+            "ticker": self.symbol(ticker),
+            "action": "exit",
+            "orderType": "market",
+            "limitPrice": price,
+            "quantity": self.positions[ticker]['quantity']
+        }
+        return self.intent(kind, ticker, price, exit_order)
+
+    def reverse_intents(self, ticker, current_price):
+        # Exit, then enter the opposite side. The entry is queued behind the exit so the broker sees them in order.
+        new_action = 'sell' if self.positions[ticker]['action'] == 'buy' else 'buy'
+
+        if self.reverse_stop_loss_type == "trailing_stop":
+            stop_loss_info = {
+                "type": "trailing_stop",
+                "trailAmount": self.reverse_stop_loss_amount
+            }
+        else:
+            if new_action == "buy":
+                stop_loss_price = current_price - self.reverse_stop_loss_amount
+            else:  # sell
+                stop_loss_price = current_price + self.reverse_stop_loss_amount
+            stop_loss_info = {
+                "type": self.reverse_stop_loss_type,
+                "stopPrice": stop_loss_price
+            }
+
+        new_order = {
+            "ticker": self.symbol(ticker),
+            "action": new_action,
+            "orderType": "market",
+            "limitPrice": current_price,
+            "quantity": self.reverse_quantity,
+            "stopLoss": stop_loss_info  # Include the stop loss information
+        }
+        return [
+            self.timer_exit_intent(ticker, current_price, kind='reverse_exit'),
+            self.intent('reverse_entry', ticker, current_price, new_order, action=new_action, stop_loss=stop_loss_info),
+        ]
+
+    def on_order_result(self, intent, success):
+        # Applies a completed order to the book. Returns follow-up intents to send.
+        kind = intent['kind']
+        ticker = intent['ticker']
+
+        if kind in ('stop_loss', 'timer_exit', 'reverse_exit'):
+            self.pending_exits.discard(ticker)
+            if success:
+                self.close_position(ticker)
+        elif kind == 'take_profit':
+            if success and ticker in self.positions:
+                self.first_tp_hit_tickers.add(ticker)
+                remaining_quantity = self.reduce_position(ticker, intent['quantity'])
+                intent['remaining_quantity'] = remaining_quantity
+                if remaining_quantity > 0:
+                    return [self.trailing_stop_intent(ticker, intent['tps'][-1]['price'], remaining_quantity)]
+        elif kind == 'trailing_stop':
+            if success and ticker in self.positions:
+                self.positions[ticker]['stop_loss'] = {
+                    "type": "trailing_stop",
+                    "trailAmount": intent['trail_amount'],
+                    "signalPrice": intent['price']
+                }
+        elif kind == 'reverse_entry':
+            if success:
+                self.close_position(ticker)
+                self.open_position(ticker, intent['action'], intent['order']['quantity'], intent['price'], intent['stop_loss'])
+                self.adjust_tp_levels(ticker, intent['price'], intent['action'], flip_targets=True)
+        return []
@@ -0,0 +1,174 @@
+import argparse
+import itertools
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from backtester import STOP_TYPES, load_archive_bars, compute_atr, run_backtest, summarize
+
+BAR_FIELDS = ('open', 'high', 'low', 'close')
+RESULT_FIELDS = ('total_pnl', 'mean_pnl', 'win_rate', 'stopped', 'targets')
+
+# Set in each worker process by init_worker
+worker_bars = None
+worker_shm = None
+worker_entries = None
+worker_config = None
+
+
+def share_bars(bars):
+    # Copies the OHLC columns into one shared memory block so workers map them instead of unpickling copies
+    shm = shared_memory.SharedMemory(create=True, size=len(BAR_FIELDS) * len(bars['close']) * 8)
+    block = np.ndarray((len(BAR_FIELDS), len(bars['close'])), dtype=np.float64, buffer=shm.buf)
+    for row, field in enumerate(BAR_FIELDS):
+        block[row] = bars[field]
+    return shm
+
+
+def init_worker(shm_name, n_bars, entry_idx, sides, config):
+    global worker_bars, worker_shm, worker_entries, worker_config
+    worker_shm = shared_memory.SharedMemory(name=shm_name)
+    block = np.ndarray((len(BAR_FIELDS), n_bars), dtype=np.float64, buffer=worker_shm.buf)
+    worker_bars = {field: block[row] for row, field in enumerate(BAR_FIELDS)}
+    worker_entries = (entry_idx, sides)
+    worker_config = config
+
+
+def run_task(task_id, atr_period, stop_types, atr_multipliers, trail_amounts):
+    # One ATR period per task, so the ATR column is computed once and shared by every row in it
+    entry_idx, sides = worker_entries
+    atr = compute_atr(worker_bars['high'], worker_bars['low'], worker_bars['close'], atr_period)
+    params = {
+        'stop_type': stop_types,
+        'atr_multiplier': atr_multipliers,
+        'trail_amount': trail_amounts,
+        'atr': atr,
+    }
+    results = run_backtest(worker_bars, entry_idx, sides, params,
+                           worker_config['tp_targets'], worker_config['tp_quantities'],
+                           quantity=worker_config['quantity'], horizon=worker_config['horizon'],
+                           intrabar=worker_config['intrabar'])
+    return task_id, summarize(results)
+
+
+def grid_params(atr_periods, atr_multipliers, trail_amounts, stop_types):
+    rows = list(itertools.product(atr_periods, atr_multipliers, trail_amounts, stop_types))
+    return {
+        'atr_period': np.array([row[0] for row in rows], dtype=np.int64),
+        'atr_multiplier': np.array([row[1] for row in rows], dtype=np.float64),
+        'trail_amount': np.array([row[2] for row in rows], dtype=np.float64),
+        'stop_type': np.array([STOP_TYPES[row[3]] for row in rows], dtype=np.int64),
+    }
+
+
+def random_params(n, atr_period_range, atr_multiplier_range, trail_amount_range, stop_types, seed=None):
+    rng = np.random.default_rng(seed)
+    return {
+        'atr_period': rng.integers(atr_period_range[0], atr_period_range[1] + 1, n),
+        'atr_multiplier': np.round(rng.uniform(*atr_multiplier_range, n), 1),  # Same step as the GUI spin box
+        'trail_amount': np.round(rng.uniform(*trail_amount_range, n), 2),
+        'stop_type': np.array([STOP_TYPES[t] for t in rng.choice(stop_types, n)], dtype=np.int64),
+    }
+
+
+def run_sweep(bars, params, entry_idx, sides, tp_targets, tp_quantities, quantity=1, horizon=390,
+              workers=None, rows_per_task=64, intrabar=False):
+    # Returns params plus one result column per RESULT_FIELDS, in the same row order as params
+    n_rows = len(params['atr_period'])
+    columns = {field: np.full(n_rows, np.nan) for field in RESULT_FIELDS}
+    config = {'tp_targets': tp_targets, 'tp_quantities': tp_quantities, 'quantity': quantity, 'horizon': horizon,
+              'intrabar': intrabar}
+
+    # Tasks never mix ATR periods; large groups are split so the pool stays busy
+    tasks = []
+    for atr_period in np.unique(params['atr_period']):
+        rows = np.flatnonzero(params['atr_period'] == atr_period)
+        for start in range(0, len(rows), rows_per_task):
+            tasks.append((int(atr_period), rows[start:start + rows_per_task]))
+
+    shm = share_bars(bars)
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                                 initargs=(shm.name, len(bars['close']), entry_idx, sides, config)) as pool:
+            futures = [pool.submit(run_task, task_id, atr_period, params['stop_type'][rows],
+                                   params['atr_multiplier'][rows], params['trail_amount'][rows])
+                       for task_id, (atr_period, rows) in enumerate(tasks)]
+            for done, future in enumerate(as_completed(futures), start=1):
+                task_id, summary = future.result()
+                rows = tasks[task_id][1]
+                for field in RESULT_FIELDS:
+                    columns[field][rows] = summary[field]
+                print(f"Finished {done}/{len(tasks)} tasks")
+    finally:
+        shm.close()
+        shm.unlink()
+
+    columns.update(params)
+    return columns
+
+
+def save_results(path, columns, **metadata):
+    # One array per column; np.load(path) gives them back by name
+    temp_path = path + '.tmp.npz'
+    np.savez_compressed(temp_path, **columns, **{f"meta_{key}": np.asarray(value) for key, value in metadata.items()})
+    os.replace(temp_path, path)
+
+
+def parse_list(text, cast=float):
+    return [cast(x) for x in text.split(',') if x.strip()]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Grid or random search over ATR and stop/TP settings")
+    parser.add_argument("root", help="Root symbol, e.g. MES")
+    parser.add_argument("--archive-dir", default="databento_archives")
+    parser.add_argument("--random", type=int, default=0, help="Sample this many random settings instead of the full grid")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--atr-periods", default="7,14,21", help="Grid values, or min,max with --random")
+    parser.add_argument("--atr-lookback", type=int, default=390, help="Minutes of history required before the first entry")
+    parser.add_argument("--atr-multipliers", default="1,2,3,5,10", help="Grid values, or min,max with --random")
+    parser.add_argument("--trail-amounts", default="5,10,20", help="Grid values, or min,max with --random")
+    parser.add_argument("--stop-types", default="stop,trailing_stop,trail_after_1st_tp")
+    parser.add_argument("--tp-targets", default="5,10,20")
+    parser.add_argument("--tp-quantities", default="1,1,1")
+    parser.add_argument("--quantity", type=int, default=3)
+    parser.add_argument("--entry-every", type=int, default=15, help="Open a long and a short every N bars")
+    parser.add_argument("--horizon", type=int, default=390)
+    parser.add_argument("--intrabar", action="store_true", help="Check each bar's high and low, not just its close")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--output", default="sweep_results.npz")
+    args = parser.parse_args()
+
+    stop_types = parse_list(args.stop_types, str)
+    if args.random:
+        params = random_params(args.random, parse_list(args.atr_periods, int)[:2], parse_list(args.atr_multipliers)[:2],
+                               parse_list(args.trail_amounts)[:2], stop_types, args.seed)
+    else:
+        params = grid_params(parse_list(args.atr_periods, int), parse_list(args.atr_multipliers),
+                             parse_list(args.trail_amounts), stop_types)
+
+    bars = load_archive_bars(args.root, args.archive_dir)
+    # Same history the live app seeds ATR from, so every setting is evaluated on the same entries
+    warmup = max(args.atr_lookback, int(params['atr_period'].max()) * 2)
+    starts = np.arange(warmup, len(bars['close']) - 1, args.entry_every)
+    if len(starts) == 0:
+        raise SystemExit(f"Not enough bars for a {warmup} bar warm-up ({len(bars['close'])} archived)")
+    entry_idx = np.repeat(starts, 2)
+    sides = np.tile([1.0, -1.0], len(starts))
+
+    print(f"Sweeping {len(params['atr_period'])} settings over {len(entry_idx)} entries and {len(bars['close'])} bars")
+    start_time = time.time()
+    columns = run_sweep(bars, params, entry_idx, sides, parse_list(args.tp_targets), parse_list(args.tp_quantities),
+                        quantity=args.quantity, horizon=args.horizon, workers=args.workers, intrabar=args.intrabar)
+    save_results(args.output, columns, root=args.root, entries=len(entry_idx), horizon=args.horizon, intrabar=args.intrabar,
+                 tp_targets=parse_list(args.tp_targets), tp_quantities=parse_list(args.tp_quantities))
+    print(f"Saved {args.output} in {time.time() - start_time:.1f}s")
+
+    stop_names = {code: name for name, code in reversed(list(STOP_TYPES.items()))}
+    for row in np.argsort(-columns['total_pnl'])[:10]:
+        print(f"ATR {columns['atr_period'][row]:>3} x{columns['atr_multiplier'][row]:<5} "
+              f"trail {columns['trail_amount'][row]:<6} {stop_names[columns['stop_type'][row]]:<18} "
+              f"total {columns['total_pnl'][row]:10.2f}  win {columns['win_rate'][row]:.0%}")
@@ -0,0 +1,86 @@
+import os
+
+import pytest
+
+from archive_writer import BufferedArchiveWriter
+
+MINUTE_NS = 60_000_000_000
+RECORD = b'r' * 10
+
+
+def on_disk(writer):
+    return os.path.getsize(writer.file_path)
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "archive.dbn")
+
+
+def test_rejects_unknown_policy(path):
+    with pytest.raises(ValueError):
+        BufferedArchiveWriter(path, flush_policy="sometimes")
+
+
+def test_records_policy_syncs_every_n_records(path):
+    writer = BufferedArchiveWriter(path, flush_policy="records", flush_records=3)
+    for _ in range(2):
+        writer.write(RECORD)
+        writer.record_written()
+    assert on_disk(writer) == 0
+    writer.write(RECORD)
+    writer.record_written()
+    assert on_disk(writer) == 30
+    assert writer.sync_count == 1
+    writer.close()
+
+
+def test_interval_policy_syncs_an_idle_burst_on_poll(path):
+    writer = BufferedArchiveWriter(path, flush_policy="interval", flush_interval_ms=50)
+    for _ in range(8):
+        writer.write(RECORD)
+        writer.record_written()
+    writer.poll()
+    assert on_disk(writer) == 0  # Interval not up yet
+    writer.last_sync -= 0.1
+    writer.poll()
+    assert on_disk(writer) == 80
+    writer.close()
+
+
+def test_bar_close_policy_syncs_when_the_next_bar_opens(path):
+    writer = BufferedArchiveWriter(path, flush_policy="bar_close")
+    writer.write(RECORD)
+    writer.record_written(10)
+    writer.write(RECORD)
+    writer.record_written(MINUTE_NS - 1)
+    writer.poll()
+    assert on_disk(writer) == 0  # The bar is still open
+    writer.write(RECORD)
+    writer.record_written(MINUTE_NS)
+    assert on_disk(writer) == 30
+    writer.close()
+
+
+def test_closed_bars_are_synced_on_the_next_poll(path):
+    writer = BufferedArchiveWriter(path, flush_policy="bar_close", closed_bars=True)
+    for _ in range(8):
+        writer.write(RECORD)
+        writer.record_written(0)
+    writer.poll()
+    assert on_disk(writer) == 80
+    assert writer.sync_count == 1
+    writer.poll()
+    assert writer.sync_count == 1  # Nothing new to sync
+    writer.close()
+
+
+def test_large_buffer_is_written_early_and_close_writes_the_rest(path):
+    writer = BufferedArchiveWriter(path, flush_policy="records", flush_records=1000, max_buffer_bytes=25)
+    for _ in range(3):
+        writer.write(RECORD)
+    assert on_disk(writer) == 30
+    writer.write(RECORD)
+    writer.close()
+    assert on_disk(writer) == 40
+    writer.close()  # Closing twice is harmless
@@ -0,0 +1,46 @@
+import pytest
+
+from atr_engine import MINUTE_NS, IncrementalATR, MinuteBarAggregator
+
+
+def test_atr_is_the_mean_true_range_of_the_last_period_bars():
+    atr = IncrementalATR(3)
+    bars = [(10.0, 8.0, 9.0), (12.0, 9.5, 11.0), (11.5, 10.0, 10.5), (10.0, 7.0, 8.0)]
+    for minute, (high, low, close) in enumerate(bars[:2]):
+        atr.add_bar(minute * MINUTE_NS, high, low, close)
+    assert not atr.ready
+    assert atr.value == 0
+    for minute, (high, low, close) in enumerate(bars[2:], start=2):
+        atr.add_bar(minute * MINUTE_NS, high, low, close)
+    # True ranges 3.0 (vs previous close 9), 1.5, 3.5 (vs previous close 10.5)
+    assert atr.ready
+    assert atr.value == pytest.approx((3.0 + 1.5 + 3.5) / 3)
+
+
+def test_atr_ignores_bars_it_has_already_counted():
+    atr = IncrementalATR(2)
+    assert atr.add_bar(MINUTE_NS, 10.0, 9.0, 9.5)
+    assert not atr.add_bar(MINUTE_NS, 20.0, 1.0, 9.5)
+    assert not atr.add_bar(0, 20.0, 1.0, 9.5)
+
+
+def test_running_sum_matches_a_fresh_sum():
+    atr = IncrementalATR(14)
+    for minute in range(2500):
+        price = 100 + (minute * 7919 % 101) / 10
+        atr.add_bar(minute * MINUTE_NS, price + 1.3, price - 0.7, price)
+    assert atr.tr_sum == pytest.approx(sum(atr.true_ranges))
+
+
+def test_aggregator_rolls_seconds_into_minutes():
+    aggregator = MinuteBarAggregator()
+    assert aggregator.add(0, 10.0, 11.0, 9.0, 10.5) is None
+    assert aggregator.add(30 * 10**9, 10.5, 12.0, 10.0, 11.0) is None
+    assert aggregator.add(MINUTE_NS, 11.0, 11.5, 10.5, 11.2) == (0, 10.0, 12.0, 9.0, 11.0)
+
+
+def test_aggregator_drops_a_first_minute_joined_midway():
+    aggregator = MinuteBarAggregator()
+    assert aggregator.add(45 * 10**9, 10.0, 11.0, 9.0, 10.5) is None
+    assert aggregator.add(MINUTE_NS, 11.0, 11.5, 10.5, 11.2) is None
+    assert aggregator.add(2 * MINUTE_NS, 11.0, 11.5, 10.5, 11.2) == (MINUTE_NS, 11.0, 11.5, 10.5, 11.2)
@@ -0,0 +1,142 @@
+import numpy as np
+import pytest
+
+from atr_engine import IncrementalATR
+from backtester import EXIT_OPEN, EXIT_STOP, EXIT_TARGETS, STOP_TYPES, compute_atr, run_backtest, summarize
+from risk_engine import RiskEngine
+
+STOP_NAMES = ['stop', 'trailing_stop', 'trail_after_1st_tp']
+PARAM_SETS = [(stop_type, stop_amount, trail_amount)
+              for stop_type in STOP_NAMES for stop_amount in (2.0, 4.0) for trail_amount in (1.5, 3.0)]
+TP_TARGETS = [2.0, 4.0, np.nan, 6.0]
+TP_QUANTITIES = [1, 1, 1, 2]
+QUANTITY = 3
+HORIZON = 120
+
+
+@pytest.fixture(scope='module')
+def market():
+    rng = np.random.default_rng(1)
+    n_bars = 3000
+    close = np.round(100 + np.cumsum(rng.normal(0, 1, n_bars)), 2)
+    open_price = close + rng.normal(0, 0.7, n_bars)
+    high = np.maximum(open_price, close) + np.abs(rng.normal(0, 1, n_bars))
+    low = np.minimum(open_price, close) - np.abs(rng.normal(0, 1, n_bars))
+    entry_idx = rng.integers(0, n_bars - 50, 200)
+    sides = rng.choice([1.0, -1.0], 200)
+    bars = {'open': open_price, 'high': high, 'low': low, 'close': close}
+    return bars, entry_idx, sides
+
+
+def param_arrays():
+    return {
+        'stop_type': np.array([STOP_TYPES[stop_type] for stop_type, _, _ in PARAM_SETS]),
+        'stop_amount': np.array([stop_amount for _, stop_amount, _ in PARAM_SETS]),
+        'trail_amount': np.array([trail_amount for _, _, trail_amount in PARAM_SETS]),
+    }
+
+
+def simulate(bars, entry, side, stop_type, stop_amount, trail_amount, intrabar):
+    # Runs one trade through RiskEngine the way the app does, filling every order at the price that triggered it
+    close = bars['close']
+    last_bar = len(close) - 1
+    entry_price = close[entry]
+    action = 'buy' if side > 0 else 'sell'
+    if stop_type == 'trailing_stop':
+        stop_loss = {'type': stop_type, 'trailAmount': stop_amount}
+    elif stop_type == 'trail_after_1st_tp':
+        stop_loss = {'type': stop_type, 'initialStopPrice': entry_price - side * stop_amount}
+    else:
+        stop_loss = {'type': stop_type, 'stopPrice': entry_price - side * stop_amount}
+
+    engine = RiskEngine()
+    engine.trail_by_amounts['X'] = trail_amount
+    engine.open_position('X', action, QUANTITY, entry_price, stop_loss, timestamp=0)
+    engine.tp_levels['X'] = [{'target': target if target == target else 1, 'quantity': quantity,
+                              'enabled': target == target, 'hit': False}
+                             for target, quantity in zip(TP_TARGETS, TP_QUANTITIES)]
+    engine.adjust_tp_levels('X', entry_price, action)
+
+    pnl, reason, exit_bar = 0.0, EXIT_OPEN, HORIZON
+    for offset in range(HORIZON):
+        bar = min(entry + 1 + offset, last_bar)
+        if intrabar:
+            intents = engine.on_bar('X', bars['open'][bar], bars['high'][bar], bars['low'][bar], close[bar])
+        else:
+            intents = engine.on_tick('X', close[bar])
+        for intent in intents:
+            if intent['kind'] == 'stop_loss':
+                if 'X' in engine.positions:
+                    pnl += side * (intent['price'] - entry_price) * engine.positions['X']['quantity']
+                    reason, exit_bar = EXIT_STOP, offset + 1
+                engine.on_order_result(intent, True)
+            elif intent['kind'] == 'take_profit':
+                if 'X' in engine.positions:
+                    pnl += side * (intent['price'] - entry_price) * min(intent['quantity'], engine.positions['X']['quantity'])
+                for follow_up in engine.on_order_result(intent, True):
+                    engine.on_order_result(follow_up, True)
+                if 'X' not in engine.positions and reason == EXIT_OPEN:
+                    reason, exit_bar = EXIT_TARGETS, offset + 1
+        if 'X' not in engine.positions:
+            break
+    if 'X' in engine.positions:
+        pnl += side * (close[min(entry + HORIZON, last_bar)] - entry_price) * engine.positions['X']['quantity']
+    return pnl, reason, exit_bar
+
+
+@pytest.mark.parametrize('intrabar', [False, True])
+def test_backtest_matches_risk_engine(market, intrabar):
+    bars, entry_idx, sides = market
+    results = run_backtest(bars, entry_idx, sides, param_arrays(), TP_TARGETS, TP_QUANTITIES,
+                           quantity=QUANTITY, horizon=HORIZON, chunk_size=37, intrabar=intrabar)
+    mismatches = []
+    for row, (entry, side) in enumerate(zip(entry_idx, sides)):
+        for column, (stop_type, stop_amount, trail_amount) in enumerate(PARAM_SETS):
+            pnl, reason, exit_bar = simulate(bars, entry, side, stop_type, stop_amount, trail_amount, intrabar)
+            if (abs(results['pnl'][row, column] - pnl) > 1e-6 or results['exit_reason'][row, column] != reason
+                    or (reason != EXIT_OPEN and results['exit_bar'][row, column] != exit_bar)):
+                mismatches.append((row, stop_type, stop_amount, trail_amount))
+    assert mismatches == []
+
+
+def test_chunking_does_not_change_results(market):
+    bars, entry_idx, sides = market
+    whole = run_backtest(bars, entry_idx, sides, param_arrays(), TP_TARGETS, TP_QUANTITIES, quantity=QUANTITY,
+                         horizon=HORIZON)
+    chunked = run_backtest(bars, entry_idx, sides, param_arrays(), TP_TARGETS, TP_QUANTITIES, quantity=QUANTITY,
+                           horizon=HORIZON, chunk_size=7)
+    for field in whole:
+        np.testing.assert_array_equal(whole[field], chunked[field])
+
+
+def test_compute_atr_matches_incremental_atr(market):
+    bars, _, _ = market
+    atr = compute_atr(bars['high'], bars['low'], bars['close'], 14)
+    incremental = IncrementalATR(14)
+    for minute in range(300):
+        incremental.add_bar(minute, bars['high'][minute], bars['low'][minute], bars['close'][minute])
+        assert (incremental.value if incremental.ready else np.nan) == pytest.approx(atr[minute], nan_ok=True)
+
+
+def test_atr_multiplier_sets_the_stop_from_atr(market):
+    bars, entry_idx, sides = market
+    atr = compute_atr(bars['high'], bars['low'], bars['close'], 14)
+    params = {'stop_type': np.array([STOP_TYPES['stop']]), 'atr_multiplier': np.array([2.0]), 'atr': atr}
+    explicit = {'stop_type': np.array([STOP_TYPES['stop']] * len(entry_idx)), 'stop_amount': atr[entry_idx] * 2.0}
+    via_atr = run_backtest(bars, entry_idx, sides, params, [np.nan], [1], horizon=HORIZON)['pnl'][:, 0]
+    for row, entry in enumerate(entry_idx):
+        single = {key: values[row:row + 1] for key, values in explicit.items()}
+        expected = run_backtest(bars, entry_idx[row:row + 1], sides[row:row + 1], single, [np.nan], [1], horizon=HORIZON)
+        assert via_atr[row] == pytest.approx(expected['pnl'][0, 0], nan_ok=True)
+
+
+def test_summarize_gives_exit_shares():
+    results = {
+        'pnl': np.array([[2.0], [-1.0], [0.5]]),
+        'exit_reason': np.array([[EXIT_TARGETS], [EXIT_STOP], [EXIT_OPEN]]),
+    }
+    summary = summarize(results)
+    assert summary['total_pnl'][0] == pytest.approx(1.5)
+    assert summary['win_rate'][0] == pytest.approx(2 / 3)
+    assert summary['stopped'][0] == pytest.approx(1 / 3)
+    assert summary['targets'][0] == pytest.approx(1 / 3)
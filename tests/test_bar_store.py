@@ -0,0 +1,81 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from bar_store import BarStore
+
+
+def minute_bars(start, count, first_price=100.0, scale=1):
+    index = pd.date_range(start, periods=count, freq='min', tz='UTC', name='ts_event')
+    close = first_price + np.arange(count, dtype=np.float64)
+    return pd.DataFrame({
+        'open': close * scale,
+        'high': (close + 1) * scale,
+        'low': (close - 1) * scale,
+        'close': close * scale,
+        'volume': np.full(count, 5, dtype=np.uint64),
+    }, index=index)
+
+
+@pytest.fixture
+def store(tmp_path):
+    return BarStore(store_dir=str(tmp_path / "bar_store"), archive_dir=str(tmp_path / "archives"))
+
+
+def test_root_symbol():
+    assert BarStore.root_symbol("MESZ4") == "MES"
+    assert BarStore.root_symbol("MES.c.0") is None
+
+
+def test_append_skips_bars_already_stored(store):
+    assert store.append('MES', minute_bars('2024-01-02 23:58', 4)) == 4
+    # Today's file converted again: only the two new bars at the end are added
+    assert store.append('MES', minute_bars('2024-01-02 23:58', 6)) == 2
+    columns = store.columns('MES')
+    assert len(columns['ts']) == 6
+    np.testing.assert_array_equal(columns['close'], 100 + np.arange(6))
+    assert store.dates('MES') == ['2024-01-02', '2024-01-03']
+    assert len(store.day('MES', '2024-01-02')['ts']) == 2
+    assert len(store.day('MES', '2024-01-03')['ts']) == 4
+
+
+def test_fixed_point_prices_are_scaled(store):
+    store.append('MES', minute_bars('2024-01-02', 3, scale=1e9))
+    np.testing.assert_allclose(store.columns('MES')['high'], [101.0, 102.0, 103.0])
+
+
+def test_window_is_half_open(store):
+    store.append('MES', minute_bars('2024-01-02', 10))
+    ts = store.columns('MES')['ts']
+    window = store.window('MES', start=ts[2], end=ts[5])
+    np.testing.assert_array_equal(window['ts'], ts[2:5])
+
+
+def test_store_reopens_and_drops_an_interrupted_append(store, tmp_path):
+    store.append('MES', minute_bars('2024-01-02', 5))
+    # Crash after writing column bytes but before the index recorded the new row count
+    with open(tmp_path / "bar_store" / "MES" / "close.bin", 'ab') as f:
+        f.write(np.zeros(3).tobytes())
+
+    reopened = BarStore(store_dir=store.store_dir, archive_dir=store.archive_dir)
+    assert reopened.roots() == ['MES']
+    assert len(reopened.columns('MES')['close']) == 5
+    assert reopened.append('MES', minute_bars('2024-01-02 00:05', 2, first_price=105)) == 2
+    np.testing.assert_array_equal(reopened.columns('MES')['close'], 100 + np.arange(7))
+
+
+def test_lookback_spans_days(store):
+    store.append('MES', minute_bars('2024-01-02 23:50', 20))
+    bars = store.lookback('MES', 15)
+    assert len(bars['ts']) == 15
+    assert pd.Timestamp(int(bars['ts'][0]), tz='UTC') == pd.Timestamp('2024-01-02 23:55', tz='UTC')
+    assert pd.Timestamp(int(bars['ts'][-1]), tz='UTC') == pd.Timestamp('2024-01-03 00:09', tz='UTC')
+
+
+def test_lookback_ends_before_end(store):
+    store.append('MES', minute_bars('2024-01-02', 30))
+    end = pd.Timestamp('2024-01-02 00:20', tz='UTC').value
+    bars = store.lookback('MES', 5, end=end)
+    np.testing.assert_array_equal(bars['close'], 100 + np.arange(15, 20))
+    assert len(store.lookback('MES', 100, end=end)['ts']) == 20  # Only what exists
+    assert len(store.lookback('NQ', 5)['ts']) == 0
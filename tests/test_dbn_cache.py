@@ -0,0 +1,104 @@
+import os
+import time
+
+import pandas as pd
+import pytest
+
+from dbn_cache import DBNCache
+
+HOUR_NS = 3_600_000_000_000
+
+
+class RecordingClient:
+    # Stands in for db.Historical: get_range writes one byte per hour requested and records the range
+    def __init__(self):
+        self.requests = []
+        self.timeseries = self
+
+    def get_range(self, start, end, path, **params):
+        self.requests.append((start.value, end.value))
+        with open(path, 'wb') as f:
+            f.write(b'x' * max(1, (end.value - start.value) // HOUR_NS))
+
+
+def hours(n):
+    return pd.Timestamp('2024-01-02', tz='UTC') + pd.Timedelta(hours=n)
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return DBNCache(cache_dir=str(tmp_path / "cache"), max_bytes=10 ** 6)
+
+
+def test_missing_ranges_skips_covered_parts():
+    segments = [{'start': 10, 'end': 20}, {'start': 30, 'end': 40}, {'start': 15, 'end': 25}]
+    assert DBNCache.missing_ranges(0, 50, segments) == [(0, 10), (25, 30), (40, 50)]
+    assert DBNCache.missing_ranges(12, 22, segments) == []
+    assert DBNCache.missing_ranges(50, 60, segments) == [(50, 60)]
+
+
+def test_overlapping_requests_only_download_the_gaps(cache):
+    client = RecordingClient()
+    cache.fetch(client, "GLBX.MDP3", "ohlcv-1s", ["MES.c.0"], hours(2), hours(4))
+    paths = cache.fetch(client, "GLBX.MDP3", "ohlcv-1s", ["MES.c.0"], hours(0), hours(6))
+    assert client.requests == [(hours(2).value, hours(4).value), (hours(0).value, hours(2).value),
+                               (hours(4).value, hours(6).value)]
+    # Served in time order, all from the cache
+    assert [os.path.basename(path).split('_')[1] for path, _ in paths] == [str(hours(n).value) for n in (0, 2, 4)]
+    assert not any(is_temporary for _, is_temporary in paths)
+
+    cache.fetch(client, "GLBX.MDP3", "ohlcv-1s", ["MES.c.0"], hours(1), hours(5))
+    assert len(client.requests) == 3
+
+
+def test_requests_for_other_symbols_are_cached_separately(cache):
+    client = RecordingClient()
+    cache.fetch(client, "GLBX.MDP3", "ohlcv-1s", ["MES.c.0"], hours(0), hours(1))
+    cache.fetch(client, "GLBX.MDP3", "ohlcv-1s", ["MNQ.c.0"], hours(0), hours(1))
+    assert len(client.requests) == 2
+
+
+def test_recent_data_is_fetched_every_time(cache):
+    client = RecordingClient()
+    now = pd.Timestamp.now(tz='UTC').floor('min')
+    for _ in range(2):
+        paths = cache.fetch(client, "GLBX.MDP3", "ohlcv-1s", ["MES.c.0"], now - pd.Timedelta(hours=3), now)
+        assert paths[-1][1]  # The last hour comes from a temporary file
+        os.remove(paths[-1][0])
+    first_cached, first_fresh, *later = client.requests
+    assert first_fresh[1] == now.value
+    # The second call only adds the sliver the cutoff moved by since the first, then the fresh hour again
+    assert later[0][0] >= first_cached[1]
+    assert later[-1] == (later[-1][0], now.value)
+
+
+def test_least_recently_used_segments_are_evicted(cache):
+    client = RecordingClient()
+    cache.max_bytes = 6  # Three 2-hour segments
+    for day in range(3):
+        cache.fetch(client, "GLBX.MDP3", "ohlcv-1s", ["MES.c.0"], hours(24 * day), hours(24 * day + 2))
+        time.sleep(0.01)
+    # Touch the first range again so the second becomes the oldest
+    cache.fetch(client, "GLBX.MDP3", "ohlcv-1s", ["MES.c.0"], hours(0), hours(2))
+    cache.fetch(client, "GLBX.MDP3", "ohlcv-1s", ["MES.c.0"], hours(72), hours(74))
+
+    assert len(client.requests) == 4  # The first range was still cached
+    [entry] = cache.index.values()
+    assert sorted(seg['start'] for seg in entry['segments']) == [hours(0).value, hours(48).value, hours(72).value]
+    assert sorted(os.listdir(cache.cache_dir)) == sorted([seg['file'] for seg in entry['segments']] + ['index.json'])
+
+
+def test_segments_in_use_are_not_evicted(cache):
+    client = RecordingClient()
+    cache.max_bytes = 1
+    paths = cache.fetch(client, "GLBX.MDP3", "ohlcv-1s", ["MES.c.0"], hours(0), hours(6))
+    assert all(os.path.exists(path) for path, _ in paths)
+
+
+def test_index_forgets_files_removed_by_hand(cache):
+    client = RecordingClient()
+    paths = cache.fetch(client, "GLBX.MDP3", "ohlcv-1s", ["MES.c.0"], hours(0), hours(2))
+    os.remove(paths[0][0])
+    reloaded = DBNCache(cache_dir=cache.cache_dir)
+    [entry] = reloaded.index.values()
+    assert entry['segments'] == []
@@ -0,0 +1,112 @@
+import copy
+import json
+import random
+
+import order_journal
+
+
+class Book:
+    # The app's side of the journal: live state, the last journaled encoding, and the files on disk
+    def __init__(self, tmp_path):
+        self.snapshot_path = tmp_path / "active_orders.json"
+        self.journal_path = tmp_path / "active_orders.journal"
+        self.active_orders = {}
+        self.tp_levels = {}
+        self.journaled_state = {}
+        self.compact()
+
+    def save(self):
+        state = order_journal.encode_state(self.active_orders, self.tp_levels)
+        events = order_journal.diff_events(self.journaled_state, state)
+        self.journaled_state = state
+        with open(self.journal_path, 'a') as f:
+            f.write(order_journal.format_events(events, 0))
+        return events
+
+    def compact(self):
+        self.snapshot_path.write_text(json.dumps({'active_orders': self.active_orders, 'tp_levels': self.tp_levels}))
+        self.journal_path.write_text('')
+        self.journaled_state = order_journal.encode_state(self.active_orders, self.tp_levels)
+
+    def recover(self):
+        data = json.loads(self.snapshot_path.read_text())
+        active_orders, tp_levels = data['active_orders'], data['tp_levels']
+        order_journal.replay(self.journal_path, active_orders, tp_levels)
+        return active_orders, tp_levels
+
+
+def ladder(entry_price, rng):
+    return [{'target': target, 'quantity': 1, 'enabled': rng.random() < 0.8, 'hit': False,
+             'price': entry_price + target} for target in (2.0, 4.0, 6.0)]
+
+
+def mutate(book, rng):
+    ticker = rng.choice(['MES', 'MNQ', 'MCL'])
+    order = book.active_orders.get(ticker)
+    step = rng.random()
+    if order is None:
+        entry_price = round(rng.uniform(90, 110), 2)
+        book.active_orders[ticker] = {'action': rng.choice(['buy', 'sell']), 'quantity': 3, 'entry_price': entry_price,
+                                      'timestamp': rng.randint(0, 10**6),
+                                      'stop_loss': {'type': 'stop', 'stopPrice': entry_price - 2}}
+        book.tp_levels[ticker] = ladder(entry_price, rng)
+    elif step < 0.3:
+        order['stop_loss']['stopPrice'] += 0.25
+    elif step < 0.55:
+        pending = [tp for tp in book.tp_levels.get(ticker, []) if not tp['hit']]
+        if pending:
+            pending[0]['hit'] = True
+            order['quantity'] -= 1
+    elif step < 0.7:
+        book.tp_levels[ticker][0]['enabled'] = not book.tp_levels[ticker][0]['enabled']
+    elif step < 0.85:
+        del book.active_orders[ticker]
+    else:
+        del book.active_orders[ticker]
+        book.tp_levels.pop(ticker, None)
+
+
+def test_snapshot_plus_journal_recovers_the_exact_state(tmp_path):
+    rng = random.Random(7)
+    book = Book(tmp_path)
+    for step in range(400):
+        mutate(book, rng)
+        book.save()
+        if step % 97 == 96:
+            book.compact()
+        assert book.recover() == (book.active_orders, book.tp_levels)
+
+
+def test_small_changes_journal_small_events(tmp_path):
+    book = Book(tmp_path)
+    book.active_orders['MES'] = {'action': 'buy', 'quantity': 3, 'entry_price': 100.0,
+                                 'stop_loss': {'type': 'trailing_stop', 'trailAmount': 2.0}}
+    book.tp_levels['MES'] = ladder(100.0, random.Random(1))
+    assert [event['event'] for event in book.save()] == ['order_opened', 'tp_levels_set']
+
+    book.active_orders['MES']['stop_loss'] = {'type': 'trailing_stop', 'trailAmount': 2.0, 'stopPrice': 99.0}
+    assert book.save() == [{'event': 'stop_moved', 'ticker': 'MES', 'stop_loss': book.active_orders['MES']['stop_loss']}]
+
+    book.tp_levels['MES'][0]['hit'] = True
+    book.tp_levels['MES'][1]['hit'] = True
+    assert book.save() == [{'event': 'tp_hit', 'ticker': 'MES', 'indexes': [0, 1]}]
+
+    book.tp_levels['MES'][0]['hit'] = False  # Un-hitting is not an index event
+    assert [event['event'] for event in book.save()] == ['tp_levels_set']
+
+    del book.active_orders['MES']
+    assert book.save() == [{'event': 'position_closed', 'ticker': 'MES'}]
+    assert book.save() == []
+
+
+def test_replay_stops_at_a_torn_last_line(tmp_path):
+    book = Book(tmp_path)
+    book.active_orders['MES'] = {'action': 'buy', 'quantity': 1, 'entry_price': 100.0}
+    book.save()
+    expected = copy.deepcopy(book.active_orders)
+    book.active_orders['MNQ'] = {'action': 'sell', 'quantity': 1, 'entry_price': 200.0}
+    book.save()
+    text = book.journal_path.read_text()
+    book.journal_path.write_text(text[:-10])  # Crash in the middle of the second append
+    active_orders, _ = book.recover()
+    assert active_orders == expected
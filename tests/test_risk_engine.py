@@ -0,0 +1,131 @@
+from risk_engine import RiskEngine
+
+
+def make_engine(action='buy', entry_price=100.0, quantity=3, stop_loss=None, targets=(), timestamp=0):
+    engine = RiskEngine()
+    engine.trail_by_amounts['MES'] = 2.0
+    engine.open_position('MES', action, quantity, entry_price, stop_loss, timestamp=timestamp)
+    if targets:
+        engine.tp_levels['MES'] = [{'target': target, 'quantity': 1, 'enabled': True, 'hit': False} for target in targets]
+        engine.adjust_tp_levels('MES', entry_price, action)
+    return engine
+
+
+def kinds(intents):
+    return [intent['kind'] for intent in intents]
+
+
+def test_fixed_stop_fires_once():
+    engine = make_engine(stop_loss={'type': 'stop', 'stopPrice': 98.0})
+    assert engine.on_tick('MES', 99.0) == []
+    intents = engine.on_tick('MES', 97.5)
+    assert kinds(intents) == ['stop_loss']
+    assert engine.on_tick('MES', 97.0) == []  # Exit already in flight
+    engine.on_order_result(intents[0], True)
+    assert 'MES' not in engine.positions
+    assert 'MES' not in engine.pending_exits
+
+
+def test_failed_exit_rearms_the_stop():
+    engine = make_engine(stop_loss={'type': 'stop', 'stopPrice': 98.0})
+    intents = engine.on_tick('MES', 97.5)
+    engine.on_order_result(intents[0], False)
+    assert 'MES' in engine.positions
+    assert kinds(engine.on_tick('MES', 97.5)) == ['stop_loss']
+
+
+def test_trailing_stop_ratchets_for_a_short():
+    engine = make_engine(action='sell', stop_loss={'type': 'trailing_stop', 'trailAmount': 2.0})
+    assert kinds(engine.on_tick('MES', 97.0)) == ['stop_moved']
+    assert engine.positions['MES']['stop_loss']['stopPrice'] == 99.0
+    assert engine.on_tick('MES', 98.0) == []  # Never loosens
+    assert kinds(engine.on_tick('MES', 99.0)) == ['stop_loss']
+
+
+def test_trail_after_first_tp_switches_to_trailing():
+    engine = make_engine(stop_loss={'type': 'trail_after_1st_tp', 'initialStopPrice': 97.0, 'trailAmount': 2.0},
+                         targets=(2.0, 4.0))
+    intents = engine.on_tick('MES', 102.0)
+    assert kinds(intents) == ['take_profit']
+    follow_ups = engine.on_order_result(intents[0], True)
+    assert kinds(follow_ups) == ['trailing_stop']
+    assert engine.positions['MES']['quantity'] == 2
+    engine.on_order_result(follow_ups[0], True)
+    assert engine.positions['MES']['stop_loss']['type'] == 'trailing_stop'
+
+
+def test_crossed_targets_exit_together_in_ladder_order():
+    engine = make_engine(targets=(4.0, 2.0, 6.0))
+    assert engine.on_tick('MES', 101.0) == []
+    intents = engine.on_tick('MES', 104.5)
+    assert kinds(intents) == ['take_profit']
+    assert [tp['price'] for tp in intents[0]['tps']] == [102.0, 104.0]
+    assert intents[0]['quantity'] == 2
+    assert intents[0]['order']['price'] == 104.0
+    assert engine.on_tick('MES', 105.0) == []  # Already hit
+    assert [tp['price'] for tp in engine.on_tick('MES', 106.0)[0]['tps']] == [106.0]
+
+
+def test_tp_index_follows_ladder_edits():
+    engine = make_engine(targets=(2.0, 4.0))
+    engine.on_tick('MES', 101.0)  # Builds the index
+    engine.tp_levels['MES'][0]['enabled'] = False
+    engine.invalidate_tp_index('MES')
+    intents = engine.on_tick('MES', 102.5)
+    assert intents == []
+    assert [tp['price'] for tp in engine.on_tick('MES', 104.0)[0]['tps']] == [104.0]
+
+
+def test_bar_low_hits_stop_even_when_close_recovers():
+    engine = make_engine(stop_loss={'type': 'stop', 'stopPrice': 98.0})
+    assert kinds(engine.on_bar('MES', 100.0, 100.5, 97.5, 100.2)) == ['stop_loss']
+
+
+def test_up_bar_checks_low_before_high():
+    # O -> L -> H -> C: the stop is hit before the target could be
+    engine = make_engine(stop_loss={'type': 'stop', 'stopPrice': 98.0}, targets=(2.0,))
+    assert kinds(engine.on_bar('MES', 100.0, 102.5, 97.5, 101.0)) == ['stop_loss']
+    # O -> H -> L -> C on a down bar: the target goes first, then the stop
+    engine = make_engine(stop_loss={'type': 'stop', 'stopPrice': 98.0}, targets=(2.0,))
+    assert kinds(engine.on_bar('MES', 100.0, 102.5, 97.5, 99.0)) == ['take_profit', 'stop_loss']
+
+
+def test_bar_reports_only_the_final_stop_move():
+    engine = make_engine(stop_loss={'type': 'trailing_stop', 'trailAmount': 2.0})
+    intents = engine.on_bar('MES', 100.0, 103.0, 100.0, 102.5)
+    assert kinds(intents) == ['stop_moved']
+    assert engine.positions['MES']['stop_loss']['stopPrice'] == 101.0
+
+
+def test_timers_cover_every_position():
+    engine = make_engine(timestamp=0)
+    engine.open_position('MNQ', 'sell', 1, 200.0, timestamp=100)
+    engine.timer_action = "Exit"
+    engine.on_tick('MES', 99.0)
+    engine.on_tick('MNQ', 201.0)
+    assert engine.check_timers(now=engine.timer_duration - 1) == []
+    intents = engine.check_timers(now=engine.timer_duration + 100)
+    assert sorted((intent['kind'], intent['ticker']) for intent in intents) == [('timer_exit', 'MES'), ('timer_exit', 'MNQ')]
+    assert engine.check_timers(now=engine.timer_duration + 101) == []  # Exits in flight
+
+
+def test_timer_holds_a_winning_trade_and_notifies_once():
+    engine = make_engine(timestamp=0)
+    engine.timer_action = "Exit"
+    engine.on_tick('MES', 101.0)
+    assert kinds(engine.check_timers(now=engine.timer_duration)) == ['timer_notice']
+    assert engine.check_timers(now=engine.timer_duration + 1) == []
+
+
+def test_reverse_flips_the_position():
+    engine = make_engine(timestamp=0)
+    engine.timer_action = "Reverse"
+    engine.reverse_stop_loss_amount = 3.0
+    engine.on_tick('MES', 99.0)
+    exit_intent, entry_intent = engine.check_timers(now=engine.timer_duration)
+    assert (exit_intent['kind'], entry_intent['kind']) == ('reverse_exit', 'reverse_entry')
+    engine.on_order_result(exit_intent, True)
+    engine.on_order_result(entry_intent, True)
+    position = engine.positions['MES']
+    assert position['action'] == 'sell'
+    assert position['stop_loss']['stopPrice'] == 102.0
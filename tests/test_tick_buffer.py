@@ -0,0 +1,59 @@
+from collections import namedtuple
+
+from tick_buffer import ConflatingTickBuffer
+
+# Same fields the feed worker fills in
+Tick = namedtuple('Tick', ['ticker_index', 'ts_event', 'ts_recv', 'open', 'high', 'low', 'close', 'volume',
+                           'received_ns', 'bid', 'ask'], defaults=(None, None))
+
+
+def tick(second, open_price, high, low, close, volume=1):
+    ts = second * 1_000_000_000
+    return Tick(0, ts, ts, open_price, high, low, close, volume, ts)
+
+
+def test_only_the_first_put_wakes_the_consumer():
+    buffer = ConflatingTickBuffer()
+    assert buffer.put(('main', 0), tick(1, 10, 11, 9, 10))
+    assert not buffer.put(('main', 1), tick(1, 20, 21, 19, 20))
+    assert len(buffer.take()) == 2
+    assert buffer.put(('main', 0), tick(2, 10, 11, 9, 10))
+    assert buffer.stats()['wakes'] == 2
+
+
+def test_newer_tick_keeps_the_range_of_the_one_it_replaces():
+    buffer = ConflatingTickBuffer()
+    buffer.put(('main', 0), tick(1, 10, 12, 9, 11, volume=3))
+    buffer.put(('main', 0), tick(2, 11, 11.5, 10.5, 11.25, volume=2))
+    [(key, merged)] = buffer.take()
+    assert (merged.ts_event, merged.open, merged.high, merged.low, merged.close, merged.volume) == \
+        (2_000_000_000, 10, 12, 9, 11.25, 5)
+    stats = buffer.stats()
+    assert (stats['received'], stats['delivered'], stats['conflated'], stats['pending']) == (2, 1, 1, 0)
+
+
+def test_ticks_from_different_minutes_are_not_merged():
+    buffer = ConflatingTickBuffer()
+    buffer.put(('main', 0), tick(58, 10, 15, 9, 14))
+    buffer.put(('main', 0), tick(59, 14, 14.5, 13, 14))
+    buffer.put(('main', 0), tick(60, 14, 14.25, 13.75, 14))
+    buffer.put(('main', 0), tick(61, 14, 14.5, 13.5, 14.25))
+    ticks = [(tick.ts_event // 1_000_000_000, tick.open, tick.high, tick.low, tick.close) for _, tick in buffer.take()]
+    # The earlier minute's range stays with that minute, ahead of the newer tick
+    assert ticks == [(59, 10, 15, 9, 14), (61, 14, 14.5, 13.5, 14.25)]
+
+
+def test_discard_drops_one_subscription():
+    buffer = ConflatingTickBuffer()
+    buffer.put(('main', 0), tick(1, 10, 11, 9, 10))
+    buffer.put(('positions', 0), tick(1, 10, 11, 9, 10))
+    buffer.discard('positions')
+    assert [key for key, _ in buffer.take()] == [('main', 0)]
+
+
+def test_clear_rearms_the_wake():
+    buffer = ConflatingTickBuffer()
+    buffer.put(('main', 0), tick(1, 10, 11, 9, 10))
+    buffer.clear()
+    assert buffer.take() == []
+    assert buffer.put(('main', 0), tick(2, 10, 11, 9, 10))
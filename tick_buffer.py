@@ -0,0 +1,80 @@
+import threading
+
+from atr_engine import MINUTE_NS
+
+
+class ConflatingTickBuffer:
+    # Latest tick per (subscription, ticker), shared between a feed thread and the GUI thread.
+    # If the GUI falls behind, a newer tick replaces the one still waiting instead of queueing behind it,
+    # so risk checks always run on the newest price. The replaced tick's open, high, low and volume are
+    # merged in, so a stop or target touched only by the replaced bar is still seen.
+    # Ticks from different minutes are never merged, since the consumer rolls them up into 1-minute ATR bars:
+    # the last tick of the earlier minute is held back and delivered ahead of the newer one.
+    # put() returns True only when the consumer has to be woken; while a wake is pending nothing new is signalled.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latest = {}
+        self.closing = {}  # key -> last waiting tick of an earlier minute than the one in latest
+        self.wake_pending = False
+        self.received = 0
+        self.conflated = 0
+        self.delivered = 0
+        self.wakes = 0
+        self.max_pending = 0
+
+    def put(self, key, tick):
+        with self.lock:
+            self.received += 1
+            previous = self.latest.get(key)
+            if previous is not None:
+                if previous.ts_event // MINUTE_NS != tick.ts_event // MINUTE_NS:
+                    if key in self.closing:
+                        self.conflated += 1  # Stalled for more than a minute; only the latest closed minute is kept
+                    self.closing[key] = previous
+                else:
+                    self.conflated += 1
+                    tick = tick._replace(open=previous.open, high=max(previous.high, tick.high),
+                                         low=min(previous.low, tick.low), volume=previous.volume + tick.volume)
+            self.latest[key] = tick
+            self.max_pending = max(self.max_pending, len(self.latest) + len(self.closing))
+            if self.wake_pending:
+                return False
+            self.wake_pending = True
+            self.wakes += 1
+            return True
+
+    def take(self):
+        # Everything waiting, as [(key, tick)] with held-back ticks of earlier minutes first;
+        # the next put() wakes the consumer again
+        with self.lock:
+            ticks = list(self.closing.items()) + list(self.latest.items())
+            self.latest = {}
+            self.closing = {}
+            self.wake_pending = False
+            self.delivered += len(ticks)
+            return ticks
+
+    def clear(self):
+        # Drops whatever is waiting, e.g. ticks from a feed that was just stopped
+        with self.lock:
+            self.latest = {}
+            self.closing = {}
+            self.wake_pending = False
+
+    def discard(self, subscription_id):
+        # Drops the waiting ticks of one subscription; keys are (subscription id, ticker index)
+        with self.lock:
+            for key in [key for key in self.latest if key[0] == subscription_id]:
+                del self.latest[key]
+                self.closing.pop(key, None)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'received': self.received,
+                'delivered': self.delivered,
+                'conflated': self.conflated,
+                'pending': len(self.latest) + len(self.closing),
+                'max_pending': self.max_pending,
+                'wakes': self.wakes
+            }